@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Replays access traces against the NCZBLOCK NCZs inside an NSZ/XCZ through
+# BlockDecompressorReader the same way a mounted file would be read, and reports
+# the latency per read and the read amplification for every block size and
+# cache size combination.
+#
+# Given an NSP/XCI it's block compressed once per --bs exponent first (into
+# --work), given an NSZ/XCZ that file is used as it is.
+#
+# Traces are either synthetic (sequential, strided, random4k, loader) or a
+# recorded trace file with one "offset length" pair per line (decimal or 0x
+# hex, # starts a comment). An optional third column names the NCZ to read,
+# otherwise the biggest NCZ of the container is used.
+#
+# Usage: python benchmark/blockread.py [--bs 14 16 18 20] [--cache 1 16] [--trace loader random4k] [--json] file
+
+from pathlib import Path
+import subprocess
+import argparse
+import random
+import json
+import sys
+import time
+
+repoPath = Path(__file__).resolve().parent.parent
+if not str(repoPath) in sys.path:
+	sys.path.insert(0, str(repoPath))
+
+SYNTHETIC_TRACES = ['sequential', 'strided', 'random4k', 'loader']
+
+def openBlockReaders(container, cache = None):
+	'''Returns {name: BlockDecompressorReader} for every block compressed NCZ'''
+	from nsz import Header, BlockDecompressorReader
+	if hasattr(container, 'hfs0'):
+		files = [nspf for partition in container.hfs0 for nspf in partition]
+	else:
+		files = list(container)
+	readers = {}
+	for nspf in files:
+		if not nspf._path.endswith('.ncz'):
+			continue
+		nspf.seek(0x4000)
+		if nspf.read(8) != b'NCZSECTN':
+			continue
+		sectionCount = nspf.readInt64()
+		for _ in range(sectionCount):
+			Header.Section(nspf)
+		pos = nspf.tell()
+		if nspf.read(8) != b'NCZBLOCK':
+			continue
+		nspf.seek(pos)
+		blockHeader = Header.Block(nspf)
+		readers[nspf._path] = BlockDecompressorReader.BlockDecompressorReader(nspf, blockHeader, cache, nspf._path)
+	return readers
+
+def syntheticTrace(name, size, reads, seed = 0):
+	'''Returns a list of (offset, length) within a file of the given size'''
+	r = random.Random(seed)
+	trace = []
+	if name == 'sequential':
+		offset = 0
+		while len(trace) < reads and offset < size:
+			trace.append((offset, 0x10000))
+			offset += 0x10000
+	elif name == 'strided':
+		stride = 0x40000
+		#Every further pass over the file is shifted by 4 KiB
+		for i in range(reads):
+			trace.append(((i * stride + (i * stride // size) * 0x1000) % size, 0x1000))
+	elif name == 'random4k':
+		for i in range(reads):
+			trace.append((r.randrange(0, max(1, size // 0x1000)) * 0x1000, 0x1000))
+	elif name == 'loader':
+		#Asset loading: sequential runs of medium reads starting at random places
+		#interleaved with small lookups of file system metadata near the start
+		while len(trace) < reads:
+			offset = r.randrange(0, max(1, size // 0x1000)) * 0x1000
+			chunk = r.choice([0x4000, 0x10000, 0x20000])
+			for i in range(r.randint(1, 16)):
+				trace.append((offset, chunk))
+				offset += chunk
+			for i in range(r.randint(0, 3)):
+				trace.append((r.randrange(0, max(1, min(size, 0x100000) // 0x200)) * 0x200, r.choice([0x200, 0x1000])))
+		trace = trace[:reads]
+	else:
+		raise ValueError('Unknown trace {0}'.format(name))
+	return [(offset, min(length, size - offset)) for offset, length in trace if offset < size]
+
+def loadTrace(path):
+	'''Returns a list of (offset, length, name or None)'''
+	trace = []
+	with open(str(path), encoding='utf-8') as f:
+		for line in f:
+			fields = line.split('#')[0].split()
+			if len(fields) < 2:
+				continue
+			trace.append((int(fields[0], 0), int(fields[1], 0), fields[2] if len(fields) > 2 else None))
+	return trace
+
+def percentile(sortedValues, p):
+	if len(sortedValues) == 0:
+		return 0.0
+	return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * p / 100))]
+
+def replay(filePath, traceName, cacheBlocks, reads = 1000, seed = 0):
+	from nsz.Fs import factory
+	from nsz.BlockDecompressorReader import BlockCache
+	container = factory(Path(filePath))
+	container.open(str(filePath), 'rb')
+	cache = BlockCache(cacheBlocks)
+	latencies = []
+	served = 0
+	try:
+		readers = openBlockReaders(container, cache)
+		if len(readers) == 0:
+			raise ValueError('{0} contains no block compressed NCZ'.format(filePath))
+		biggest = max(readers, key=lambda name: readers[name].BlockHeader.decompressedSize)
+		if traceName in SYNTHETIC_TRACES:
+			trace = [(offset, length, None) for offset, length in syntheticTrace(traceName, readers[biggest].BlockHeader.decompressedSize, reads, seed)]
+		else:
+			trace = loadTrace(traceName)
+		for offset, length, name in trace:
+			reader = readers[name or biggest]
+			start = time.perf_counter()
+			reader.seek(offset)
+			served += len(reader.read(length))
+			latencies.append(time.perf_counter() - start)
+		blockSizeExponent = readers[biggest].BlockHeader.blockSizeExponent
+		compressedBytesRead = sum(reader.CompressedBytesRead for reader in readers.values())
+	finally:
+		container.close()
+	latencies.sort()
+	total = sum(latencies)
+	return {
+		'file': Path(filePath).name,
+		'trace': traceName if traceName in SYNTHETIC_TRACES else Path(traceName).name,
+		'block_size_exponent': blockSizeExponent,
+		'cache_blocks': cacheBlocks,
+		'reads': len(latencies),
+		'seconds': round(total, 6),
+		'bytes': served,
+		'compressed_bytes_read': compressedBytesRead,
+		#Compressed bytes read from disk per byte returned to the caller
+		'amplification': round(compressedBytesRead / served, 3) if served > 0 else 0.0,
+		'cache_hit_rate': round(cache.hits / (cache.hits + cache.misses), 3) if cache.hits + cache.misses > 0 else 0.0,
+		'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+		'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+		'mib_per_s': round(served / total / 1048576, 2) if total > 0 else 0.0
+	}
+
+def blockCompressed(filePath, blockSizeExponents, work, level):
+	'''Returns the paths of filePath block compressed with every block size'''
+	filePath = Path(filePath)
+	if filePath.suffix in ('.nsz', '.xcz'):
+		return [filePath]
+	paths = []
+	for blockSizeExponent in blockSizeExponents:
+		outputDir = Path(work).joinpath('bs{0}-l{1}'.format(blockSizeExponent, level))
+		outputDir.mkdir(parents=True, exist_ok=True)
+		outputPath = outputDir.joinpath(filePath.stem + ('.xcz' if filePath.suffix == '.xci' else '.nsz'))
+		if not outputPath.is_file():
+			command = [sys.executable, str(repoPath.joinpath('nsz.py')), '-C', '-B', '-K', '-w', '-s', str(blockSizeExponent), '-l', str(level), '--log-level', 'warning', '-o', str(outputDir), str(filePath)]
+			subprocess.run(command, cwd=str(repoPath), stdout=subprocess.DEVNULL, check=True)
+		paths.append(outputPath)
+	return paths
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('file')
+	parser.add_argument('--bs', type=int, nargs='+', default=[14, 16, 18, 20], help='Block size exponents to compress an NSP/XCI with')
+	parser.add_argument('--cache', type=int, nargs='+', default=[1, 16], help='Cache sizes in blocks')
+	parser.add_argument('--trace', nargs='+', default=SYNTHETIC_TRACES, help='Synthetic trace names or trace files')
+	parser.add_argument('--reads', type=int, default=1000, help='Reads per synthetic trace')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--level', type=int, default=18)
+	parser.add_argument('--work', type=str, default=str(repoPath.joinpath('benchmark', 'work', 'blockread')))
+	parser.add_argument('--json', action="store_true", default=False)
+	args = parser.parse_args()
+
+	from nsz.nut import Print
+	Print.setLevel(Print.WARNING)
+	results = []
+	for filePath in blockCompressed(args.file, args.bs, args.work, args.level):
+		for cacheBlocks in args.cache:
+			for traceName in args.trace:
+				results.append(replay(filePath, traceName, cacheBlocks, args.reads, args.seed))
+
+	if args.json:
+		print(json.dumps(results))
+		return
+	print('{0:<12} {1:>3} {2:>6} {3:>7} {4:>9} {5:>9} {6:>10} {7:>8} {8:>9}'.format('trace', 'bs', 'cache', 'reads', 'p50 ms', 'p99 ms', 'MiB/s', 'amplif.', 'hit rate'))
+	for result in results:
+		print('{0:<12} {1:>3} {2:>6} {3:>7} {4:>9.3f} {5:>9.3f} {6:>10.2f} {7:>8.2f} {8:>9.3f}'.format(result['trace'], result['block_size_exponent'], result['cache_blocks'], result['reads'], result['p50_ms'], result['p99_ms'], result['mib_per_s'], result['amplification'], result['cache_hit_rate']))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Generates synthetic NSP and XCI files which nsz can compress, decompress and
+# verify without any real game or console keys. Everything is derived from
+# fixed seeds so the same parameters always produce bit-identical files.
+# The NCAs are encrypted with the keys from TEST_KEYS. Point NSZ_TEST_KEYS at
+# a file written by writeKeys() to make nsz use them.
+
+from Crypto.Cipher import AES
+from hashlib import sha256
+from pathlib import Path
+import random
+import os
+
+TEST_KEYS = {
+	'header_key': bytes(range(32)),
+	'aes_kek_generation_source': bytes([1] * 16),
+	'aes_key_generation_source': bytes([2] * 16),
+	'titlekek_source': bytes([3] * 16),
+	'key_area_key_application_source': bytes([4] * 16),
+	'key_area_key_ocean_source': bytes([5] * 16),
+	'key_area_key_system_source': bytes([6] * 16),
+	'master_key_00': bytes([7] * 16),
+}
+
+CHUNK_SZ = 0x100000
+NCA_HEADER_SIZE = 0x4000
+MEDIA_SIZE = 0x200
+
+class ContentType:
+	PROGRAM = 0
+	META = 1
+	CONTROL = 2
+	PUBLICDATA = 5
+
+#Content types of the NCA header and the matching ones used in a CNMT
+CNMT_CONTENT_TYPES = {ContentType.PROGRAM: 1, ContentType.CONTROL: 3, ContentType.PUBLICDATA: 2}
+
+class TitleType:
+	APPLICATION = 0x80
+	PATCH = 0x81
+
+class FsType:
+	PFS0 = 2
+	ROMFS = 3
+
+def writeKeys(path):
+	with open(str(path), 'w', encoding='utf-8') as f:
+		for name, key in TEST_KEYS.items():
+			f.write('{0} = {1}\n'.format(name, key.hex().upper()))
+	return path
+
+def align(size, alignment = MEDIA_SIZE):
+	return (size + alignment - 1) // alignment * alignment
+
+def keyAreaKey():
+	kek = AES.new(TEST_KEYS['master_key_00'], AES.MODE_ECB).decrypt(TEST_KEYS['aes_kek_generation_source'])
+	sourceKek = AES.new(kek, AES.MODE_ECB).decrypt(TEST_KEYS['key_area_key_application_source'])
+	return AES.new(sourceKek, AES.MODE_ECB).decrypt(TEST_KEYS['aes_key_generation_source'])
+
+def xtsEncrypt(data):
+	from nsz.nut import aes128
+	return aes128.AESXTS(TEST_KEYS['header_key']).encrypt(data)
+
+def randomData(size, seed):
+	'''Incompressible data'''
+	r = random.Random(seed)
+	while size > 0:
+		chunk = min(size, CHUNK_SZ)
+		yield r.randbytes(chunk)
+		size -= chunk
+
+def textData(size, seed):
+	'''Data zstd compresses to roughly a fifth: shuffled words of a small dictionary'''
+	r = random.Random(seed)
+	words = [bytes(r.choice(b'abcdefghijklmnopqrstuvwxyz') for _ in range(r.randint(2, 10))) for _ in range(512)]
+	while size > 0:
+		chunk = b' '.join(r.choices(words, k=CHUNK_SZ // 5))[:min(size, CHUNK_SZ)]
+		yield chunk
+		size -= len(chunk)
+
+def mixedData(size, seed, incompressibleShare = 0.5):
+	'''Alternates incompressible and compressible runs like the assets of a real game'''
+	r = random.Random(seed)
+	while size > 0:
+		run = min(size, r.randint(1, 8) * CHUNK_SZ)
+		generator = randomData if r.random() < incompressibleShare else textData
+		yield from generator(run, r.getrandbits(32))
+		size -= run
+
+def pfs0(files):
+	'''Builds a small in-memory PFS0 from a list of (name, bytes)'''
+	stringTable = b''
+	entries = b''
+	dataOffset = 0
+	for name, data in files:
+		entries += dataOffset.to_bytes(8, 'little') + len(data).to_bytes(8, 'little') + len(stringTable).to_bytes(4, 'little') + b'\0' * 4
+		stringTable += name.encode() + b'\0'
+		dataOffset += len(data)
+	headerSize = 0x10 + len(entries) + len(stringTable)
+	stringTable += b'\0' * ((0x20 - headerSize % 0x20) % 0x20)
+	header = b'PFS0' + len(files).to_bytes(4, 'little') + len(stringTable).to_bytes(4, 'little') + b'\0' * 4 + entries + stringTable
+	return header + b''.join(data for _, data in files)
+
+def writeNca(directory, contentType, sections, titleId, seed):
+	'''Writes an NCA encrypted with a key area key and returns (path, size, sha256).
+	sections is a list of (fsType, size, chunks) where chunks yields the plaintext.'''
+	contentKey = random.Random(seed).randbytes(16)
+	offset = NCA_HEADER_SIZE
+	sectionTable = b''
+	fsHeaders = b''
+	layout = []
+	for i, (fsType, size, chunks) in enumerate(sections):
+		#A PFS0 section starts with its hash table so the PFS0 itself is at 0x200 like in real NCAs
+		hashTableSize = MEDIA_SIZE if fsType == FsType.PFS0 else 0
+		sectionSize = align(hashTableSize + size)
+		generation = (i + 1).to_bytes(4, 'little') + b'\0' * 4
+		layout.append((offset, hashTableSize, sectionSize, generation, chunks))
+		sectionTable += (offset // MEDIA_SIZE).to_bytes(4, 'little') + ((offset + sectionSize) // MEDIA_SIZE).to_bytes(4, 'little') + b'\0' * 8
+		fsHeader = bytearray(MEDIA_SIZE)
+		fsHeader[0x3] = fsType
+		fsHeader[0x4] = 3 #AES-CTR
+		if fsType == FsType.PFS0:
+			fsHeader[0x40:0x48] = hashTableSize.to_bytes(8, 'little')
+			fsHeader[0x48:0x50] = size.to_bytes(8, 'little')
+		fsHeader[0x140:0x148] = generation
+		fsHeaders += bytes(fsHeader)
+		offset += sectionSize
+	ncaSize = offset
+
+	header = bytearray(0x400)
+	header[0x200:0x204] = b'NCA3'
+	header[0x205] = contentType
+	header[0x208:0x210] = ncaSize.to_bytes(8, 'little')
+	header[0x210:0x218] = titleId.to_bytes(8, 'little')
+	header[0x240:0x280] = sectionTable.ljust(0x40, b'\0')
+	header[0x300:0x340] = AES.new(keyAreaKey(), AES.MODE_ECB).encrypt(b'\0' * 0x20 + contentKey + b'\0' * 0x10)
+	header = xtsEncrypt(bytes(header) + fsHeaders.ljust(0x800, b'\0'))
+
+	hash = sha256()
+	tmpPath = Path(directory).joinpath('{0}.tmp'.format(seed))
+	with open(str(tmpPath), 'wb') as f:
+		def write(data):
+			hash.update(data)
+			f.write(data)
+		write(header.ljust(NCA_HEADER_SIZE, b'\0'))
+		for offset, hashTableSize, sectionSize, generation, chunks in layout:
+			cipher = AES.new(contentKey, AES.MODE_CTR, nonce=generation[::-1], initial_value=offset >> 4)
+			written = hashTableSize
+			write(cipher.encrypt(b'\0' * hashTableSize))
+			for data in ([chunks] if isinstance(chunks, bytes) else chunks):
+				write(cipher.encrypt(data))
+				written += len(data)
+			write(cipher.encrypt(b'\0' * (sectionSize - written)))
+	digest = hash.digest()
+	extension = '.cnmt.nca' if contentType == ContentType.META else '.nca'
+	path = tmpPath.with_name(digest[:16].hex() + extension)
+	os.replace(str(tmpPath), str(path))
+	return (path, ncaSize, digest)
+
+def cnmt(titleId, version, contents, titleType = TitleType.APPLICATION):
+	body = titleId.to_bytes(8, 'little') + version.to_bytes(4, 'little') + bytes([titleType, 0]) + (0x10).to_bytes(2, 'little') + len(contents).to_bytes(2, 'little')
+	body = body.ljust(0x30, b'\0')
+	for digest, size, contentType in contents:
+		body += digest + digest[:16] + size.to_bytes(6, 'little') + bytes([contentType, 0])
+	return body
+
+def ticket():
+	data = (0x010004).to_bytes(4, 'little') + b'\0' * 0x13C
+	data += b'Root-CA00000003-XS00000020'.ljust(0x40, b'\0') + b'\0' * 0x180
+	return data
+
+def writeNcas(directory, titleId, version, contents, seed, titleType = TitleType.APPLICATION):
+	'''Writes the given (contentType, sections) NCAs plus a matching CNMT NCA.
+	Returns the list of (name, path) to pack.'''
+	files = []
+	metaContents = []
+	for i, (contentType, sections) in enumerate(contents):
+		path, size, digest = writeNca(directory, contentType, sections, titleId, seed * 1000 + i)
+		files.append((path.name, path))
+		metaContents.append((digest, size, CNMT_CONTENT_TYPES[contentType]))
+	meta = pfs0([('{0}_{1:016x}.cnmt'.format('Patch' if titleType == TitleType.PATCH else 'Application', titleId), cnmt(titleId, version, metaContents, titleType))])
+	path, size, digest = writeNca(directory, ContentType.META, [(FsType.PFS0, len(meta), meta)], titleId, seed * 1000 + 999)
+	files.append((path.name, path))
+	return files
+
+def programSections(size, seed, incompressibleShare = 0.5):
+	exefs = pfs0([('main', random.Random(seed).randbytes(0x8000) + b'\0' * 0x8000), ('main.npdm', b'META'.ljust(0x400, b'\0'))])
+	return [(FsType.PFS0, len(exefs), exefs), (FsType.ROMFS, size, mixedData(size, seed, incompressibleShare))]
+
+def updateSections(size, seed):
+	'''programSections of the base title with seed where the start of every
+	chunk changed like in an update'''
+	sections = programSections(size, seed)
+	fsType, size, chunks = sections[-1]
+	sections[-1] = (fsType, size, (b'\xff' * 64 + chunk[64:] for chunk in chunks))
+	return sections
+
+def packPfs0(path, files):
+	'''Streams the (name, path or bytes) files into a PFS0 at path'''
+	names = b''
+	entries = b''
+	dataOffset = 0
+	for name, content in files:
+		size = len(content) if isinstance(content, bytes) else os.path.getsize(str(content))
+		entries += dataOffset.to_bytes(8, 'little') + size.to_bytes(8, 'little') + len(names).to_bytes(4, 'little') + b'\0' * 4
+		names += name.encode() + b'\0'
+		dataOffset += size
+	headerSize = 0x10 + len(entries) + len(names)
+	names += b'\0' * ((0x20 - headerSize % 0x20) % 0x20)
+	with open(str(path), 'wb') as f:
+		f.write(b'PFS0' + len(files).to_bytes(4, 'little') + len(names).to_bytes(4, 'little') + b'\0' * 4 + entries + names)
+		copyFiles(f, files)
+
+def copyFiles(f, files):
+	for name, content in files:
+		if isinstance(content, bytes):
+			f.write(content)
+			continue
+		with open(str(content), 'rb') as source:
+			while True:
+				data = source.read(CHUNK_SZ)
+				if not data:
+					break
+				f.write(data)
+		os.unlink(str(content))
+
+def hfs0Header(files, dataAlignment = MEDIA_SIZE):
+	'''Header of an HFS0 whose data starts at a multiple of dataAlignment'''
+	names = b''.join(name.encode() + b'\0' for name, size in files)
+	headerSize = align(0x10 + 0x40 * len(files) + len(names), dataAlignment)
+	names = names.ljust(headerSize - 0x10 - 0x40 * len(files), b'\0')
+	header = b'HFS0' + len(files).to_bytes(4, 'little') + len(names).to_bytes(4, 'little') + b'\0' * 4
+	offset = 0
+	nameOffset = 0
+	for name, size in files:
+		header += offset.to_bytes(8, 'little') + size.to_bytes(8, 'little') + nameOffset.to_bytes(4, 'little') + b'\0' * 4 + b'\0' * 8 + b'\0' * 0x20
+		offset += size
+		nameOffset += len(name) + 1
+	return header + names
+
+def packXci(path, files):
+	'''Writes a trimmed XCI (without key area) with files in the secure partition'''
+	sizes = [(name, len(content) if isinstance(content, bytes) else os.path.getsize(str(content))) for name, content in files]
+	secureHeader = hfs0Header(sizes)
+	secureSize = len(secureHeader) + sum(size for name, size in sizes)
+	partitions = [('update', hfs0Header([])), ('normal', hfs0Header([]))]
+	rootHeader = hfs0Header([(name, len(data)) for name, data in partitions] + [('secure', secureSize)])
+	hfs0Offset = 0xF000
+	secureOffset = hfs0Offset + len(rootHeader) + sum(len(data) for name, data in partitions)
+
+	header = bytearray(0x200)
+	header[0x100:0x104] = b'HEAD'
+	header[0x104:0x108] = (secureOffset // MEDIA_SIZE).to_bytes(4, 'little')
+	header[0x108:0x10C] = (0xFFFFFFFF).to_bytes(4, 'little')
+	header[0x10D] = 0xFA #Gamecard size
+	header[0x118:0x120] = ((secureOffset + secureSize) // MEDIA_SIZE - 1).to_bytes(8, 'little')
+	header[0x130:0x138] = hfs0Offset.to_bytes(8, 'little')
+	header[0x138:0x140] = len(rootHeader).to_bytes(8, 'little')
+	header[0x140:0x160] = sha256(rootHeader).digest()
+	with open(str(path), 'wb') as f:
+		f.write(bytes(header).ljust(hfs0Offset, b'\0'))
+		f.write(rootHeader)
+		for name, data in partitions:
+			f.write(data)
+		f.write(secureHeader)
+		copyFiles(f, files)
+
+def titleFiles(directory, titleId, version, contents, seed, titleType = TitleType.APPLICATION):
+	files = writeNcas(directory, titleId, version, contents, seed, titleType)
+	files.append(('{0:016x}{1:016x}.tik'.format(titleId, 0), ticket()))
+	return files
+
+def buildNsp(path, contents, titleId = 0x0100000000010000, version = 0, seed = 1, titleType = TitleType.APPLICATION):
+	path = Path(path)
+	packPfs0(path, titleFiles(path.parent, titleId, version, contents, seed, titleType))
+	return path
+
+def buildXci(path, contents, titleId = 0x0100000000010000, version = 0, seed = 1, titleType = TitleType.APPLICATION):
+	path = Path(path)
+	packXci(path, titleFiles(path.parent, titleId, version, contents, seed, titleType))
+	return path
+
+def buildSet(directory, scale = 1.0):
+	'''The fixtures used by the benchmark suite. Returns {name: path}.
+	mixed:  one program NCA alternating incompressible and compressible runs
+	small:  many small program and public data NCAs
+	huge:   a single big program NCA
+	xci:    the mixed content as trimmed XCI
+	base:   a title whose program NCA the update mostly shares
+	update: the update of base, used with --patch-base'''
+	directory = Path(directory)
+	directory.mkdir(parents=True, exist_ok=True)
+	mib = lambda n: max(CHUNK_SZ, int(n * scale) * CHUNK_SZ)
+	small = [(ContentType.PROGRAM, programSections(0x40000, 100 + i)) for i in range(32)]
+	small += [(ContentType.PUBLICDATA, [(FsType.ROMFS, 0x20000, textData(0x20000, 200 + i))]) for i in range(96)]
+	fixtures = [
+		('mixed', buildNsp, [(ContentType.PROGRAM, programSections(mib(64), 1))], 0x0100000000010000, 0, TitleType.APPLICATION),
+		('small', buildNsp, small, 0x0100000000020000, 0, TitleType.APPLICATION),
+		('huge', buildNsp, [(ContentType.PROGRAM, programSections(mib(512), 3, 0.25))], 0x0100000000030000, 0, TitleType.APPLICATION),
+		('xci', buildXci, [(ContentType.PROGRAM, programSections(mib(64), 4))], 0x0100000000040000, 0, TitleType.APPLICATION),
+		('base', buildNsp, [(ContentType.PROGRAM, programSections(mib(32), 5))], 0x0100000000050000, 0, TitleType.APPLICATION),
+		('update', buildNsp, [(ContentType.PROGRAM, updateSections(mib(32), 5))], 0x0100000000050800, 0x10000, TitleType.PATCH),
+	]
+	paths = {}
+	for seed, (name, build, contents, titleId, version, titleType) in enumerate(fixtures, 1):
+		path = directory.joinpath('{0} [{1:016X}][v{2}].{3}'.format(name, titleId, version, 'xci' if build == buildXci else 'nsp'))
+		#Existing fixtures are reused. A file only gets its final name once it's complete.
+		if not path.is_file():
+			partPath = path.with_name(path.name + '.part')
+			build(partPath, contents, titleId, version, seed, titleType)
+			os.replace(str(partPath), str(path))
+		paths[name] = path
+	return paths
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Measures how long a fresh interpreter needs to import the modules used by the
+# different nsz commands. Every spawned worker process pays this cost too.
+# Usage: python benchmark/importtime.py [--runs N] [--json]
+
+import subprocess
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+repoPath = Path(__file__).resolve().parent.parent
+
+targets = [
+	('nsz', 'import nsz'),
+	('nsz.Fs', 'import nsz.Fs'),
+	('compress', 'import nsz.BlockCompressor, nsz.SolidCompressor'),
+	('decompress', 'import nsz.NszDecompressor'),
+	('keys', 'from nsz.nut import Keys; Keys.keyAreaKey(0, 0)'),
+]
+
+def measure(statement, runs):
+	timings = []
+	for i in range(runs):
+		start = time.perf_counter()
+		result = subprocess.run([sys.executable, '-c', statement], cwd=str(repoPath), capture_output=True)
+		timings.append(time.perf_counter() - start)
+		if result.returncode != 0:
+			return {'error': result.stderr.decode(errors='replace').strip().splitlines()[-1]}
+	timings.sort()
+	return {'min_ms': round(timings[0]*1000, 2), 'median_ms': round(timings[len(timings)//2]*1000, 2)}
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--runs', type=int, default=5)
+	parser.add_argument('--json', action="store_true", default=False)
+	args = parser.parse_args()
+
+	report = {'python': sys.version.split()[0], 'baseline': measure('pass', args.runs)}
+	for name, statement in targets:
+		report[name] = measure(statement, args.runs)
+
+	if args.json:
+		print(json.dumps(report, indent=2))
+		return
+	for name, result in report.items():
+		if name == 'python':
+			continue
+		if 'error' in result:
+			print('{0:<12} {1}'.format(name, result['error']))
+		else:
+			print('{0:<12} min {1:>8.2f} ms   median {2:>8.2f} ms'.format(name, result['min_ms'], result['median_ms']))
+
+if __name__ == '__main__':
+	main()
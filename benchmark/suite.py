@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Reproducible end-to-end benchmark. Generates synthetic fixtures (see
+# fixtures.py) encrypted with test keys, runs every scenario in a fresh
+# process and records MiB/s, peak RSS and the --profile stage timings.
+# Usage: python benchmark/suite.py [--scale X] [--only REGEX] [--json out.json] [--compare old.json]
+
+from pathlib import Path
+import subprocess
+import argparse
+import platform
+import json
+import sys
+import os
+import re
+import time
+
+repoPath = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repoPath))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import fixtures
+
+def scenarios(fixturePaths, work):
+	'''(name, input path, nsz arguments) in the order they have to run.
+	Decompress, verify and random reads use the output of the compress runs.'''
+	block = work.joinpath('block')
+	solid = work.joinpath('solid')
+	decompressed = work.joinpath('decompressed')
+	patch = work.joinpath('patch')
+	for directory in [block, solid, decompressed, patch]:
+		directory.mkdir(exist_ok=True)
+	compressed = lambda outputDir, name, extension = '.nsz': outputDir.joinpath(fixturePaths[name].stem + extension)
+	result = []
+	for name in ['mixed', 'small', 'huge']:
+		result.append(('compress-block-' + name, fixturePaths[name], ['-C', '-B', '-K', '-w', '-o', str(block)]))
+	result.append(('compress-block-xci', fixturePaths['xci'], ['-C', '-B', '-K', '-w', '-o', str(block)]))
+	for name in ['mixed', 'small']:
+		result.append(('compress-solid-' + name, fixturePaths[name], ['-C', '-S', '-K', '-w', '-o', str(solid)]))
+	result.append(('compress-solid-update', fixturePaths['update'], ['-C', '-S', '-K', '-w', '-o', str(solid)]))
+	result.append(('compress-patch-base-update', fixturePaths['update'], ['-C', '-S', '-K', '-w', '--patch-base', str(fixturePaths['base']), '-o', str(patch)]))
+	result.append(('decompress-block-mixed', compressed(block, 'mixed'), ['-D', '-w', '-o', str(decompressed)]))
+	result.append(('decompress-block-huge', compressed(block, 'huge'), ['-D', '-w', '-o', str(decompressed)]))
+	result.append(('decompress-solid-mixed', compressed(solid, 'mixed'), ['-D', '-w', '-o', str(decompressed)]))
+	result.append(('decompress-block-xcz', compressed(block, 'xci', '.xcz'), ['-D', '-w', '-o', str(decompressed)]))
+	result.append(('verify-block-mixed', compressed(block, 'mixed'), ['-V']))
+	result.append(('verify-solid-small', compressed(solid, 'small'), ['-V']))
+	result.append(('info-small', compressed(block, 'small'), ['-i', '--depth', '3']))
+	result.append(('undupe-scan', block, ['--undupe-dryrun', '-p']))
+	result.append(('random-read-mixed', compressed(block, 'mixed'), None))
+	return result
+
+def checkPatchBase(fixturePaths, work):
+	'''Compares the update compressed against its base with the plain solid one.
+	Returns None if one of them wasn't compressed in this run.'''
+	name = fixturePaths['update'].stem + '.nsz'
+	plainPath = work.joinpath('solid', name)
+	patchPath = work.joinpath('patch', name)
+	if not plainPath.is_file() or not patchPath.is_file():
+		return None
+	plain = plainPath.stat().st_size
+	patched = patchPath.stat().st_size
+	return {'plain_bytes': plain, 'patch_base_bytes': patched, 'passed': patched < plain}
+
+def run(command, env, logPath):
+	'''Runs command and returns (returncode, seconds, peak RSS in MiB or None)'''
+	with open(str(logPath), 'ab') as log:
+		start = time.perf_counter()
+		process = subprocess.Popen(command, cwd=str(repoPath), env=env, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+		if hasattr(os, 'wait4'):
+			#The usage of a child includes the worker processes it waited for
+			pid, status, usage = os.wait4(process.pid, 0)
+			seconds = time.perf_counter() - start
+			process.returncode = os.waitstatus_to_exitcode(status)
+			#ru_maxrss is in KiB on Linux but in bytes on macOS
+			rss = usage.ru_maxrss / (1048576 if sys.platform == 'darwin' else 1024)
+			return (process.returncode, seconds, round(rss, 1))
+		process.wait()
+		return (process.returncode, time.perf_counter() - start, None)
+
+def inputSize(path):
+	if path.is_dir():
+		return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+	return path.stat().st_size if path.is_file() else 0
+
+def runScenario(name, inputPath, arguments, env, work, compressArguments):
+	logPath = work.joinpath('log.txt')
+	with open(str(logPath), 'a', encoding='utf-8') as log:
+		log.write('\n==== {0} ====\n'.format(name))
+	if not inputPath.exists():
+		return {'error': '{0} does not exist'.format(inputPath)}
+	profilePath = work.joinpath('profile-{0}.json'.format(name))
+	if profilePath.is_file():
+		profilePath.unlink()
+	if arguments == None:
+		command = [sys.executable, str(Path(__file__).resolve().parent.joinpath('blockread.py')), '--json', '--trace', 'random4k', '--cache', '1', '--reads', '2000', str(inputPath)]
+	else:
+		command = [sys.executable, str(repoPath.joinpath('nsz.py'))] + arguments + ['--profile', str(profilePath), str(inputPath)]
+		if '-C' in arguments:
+			command[2:2] = compressArguments
+	returncode, seconds, rss = run(command, env, logPath)
+	result = {'returncode': returncode, 'seconds': round(seconds, 3), 'peak_rss_mib': rss}
+	if arguments == None:
+		lines = logPath.read_text(encoding='utf-8', errors='replace').strip().splitlines()
+		if returncode == 0:
+			result.update(json.loads(lines[-1])[0])
+		return result
+	size = inputSize(inputPath)
+	result['bytes'] = size
+	result['mib_per_s'] = round(size / seconds / 1048576, 2) if seconds > 0 else 0.0
+	if profilePath.is_file():
+		with open(str(profilePath), encoding='utf-8') as f:
+			result['stages'] = json.load(f)['stages']
+	return result
+
+def gitCommit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(repoPath), capture_output=True, text=True).stdout.strip() or None
+	except OSError:
+		return None
+
+def printReport(report, baseline = None):
+	print('{0:<24} {1:>9} {2:>10} {3:>10}{4}'.format('scenario', 'seconds', 'MiB/s', 'RSS MiB', '   vs baseline' if baseline else ''))
+	for name, result in report['scenarios'].items():
+		if 'error' in result or result['returncode'] != 0:
+			print('{0:<24} failed ({1})'.format(name, result.get('error', 'exit code {0}'.format(result.get('returncode')))))
+			continue
+		line = '{0:<24} {1:>9.3f} {2:>10.2f} {3:>10}'.format(name, result['seconds'], result['mib_per_s'], result['peak_rss_mib'] if result['peak_rss_mib'] != None else '-')
+		if 'p50_ms' in result:
+			line += '   p50 {0:.3f} ms p99 {1:.3f} ms'.format(result['p50_ms'], result['p99_ms'])
+		old = baseline['scenarios'].get(name) if baseline else None
+		if old and old.get('mib_per_s'):
+			line += '   {0:+.1f}%'.format((result['mib_per_s'] / old['mib_per_s'] - 1) * 100)
+		print(line)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--work', type=str, default=str(repoPath.joinpath('benchmark', 'work')), help='Directory for fixtures and outputs. Fixtures are reused between runs.')
+	parser.add_argument('--scale', type=float, default=1.0, help='Size factor of the generated NCAs. 1.0 results in about 700 MiB of fixtures.')
+	parser.add_argument('--level', type=int, default=18, help='Passed to nsz as -l for compression')
+	parser.add_argument('--threads', type=int, default=-1, help='Passed to nsz as -t for compression')
+	parser.add_argument('--only', type=str, default='', help='Regex selecting the scenarios to run')
+	parser.add_argument('--json', type=str, default=None, help='Write the report to this file')
+	parser.add_argument('--compare', type=str, default=None, help='Report of an earlier run to compare the throughput with')
+	args = parser.parse_args()
+
+	work = Path(args.work).resolve()
+	work.mkdir(parents=True, exist_ok=True)
+	keysPath = fixtures.writeKeys(work.joinpath('test.keys'))
+	work.joinpath('log.txt').unlink(missing_ok=True)
+	env = dict(os.environ)
+	env['NSZ_TEST_KEYS'] = str(keysPath)
+	#fixtures.py uses the AES-XTS implementation of nsz which loads the keys on import
+	os.environ['NSZ_TEST_KEYS'] = str(keysPath)
+
+	start = time.perf_counter()
+	fixturePaths = fixtures.buildSet(work.joinpath('fixtures-{0}'.format(args.scale)), args.scale)
+	print('Fixtures ready after {0:.1f}s'.format(time.perf_counter() - start))
+
+	report = {
+		'commit': gitCommit(),
+		'python': sys.version.split()[0],
+		'platform': platform.platform(),
+		'cpus': os.cpu_count(),
+		'scale': args.scale,
+		'level': args.level,
+		'threads': args.threads,
+		'fixtures': {name: {'file': path.name, 'bytes': path.stat().st_size} for name, path in fixturePaths.items()},
+		'scenarios': {}
+	}
+	for name, inputPath, arguments in scenarios(fixturePaths, work):
+		if args.only and not re.search(args.only, name):
+			continue
+		print('Running ' + name, flush=True)
+		report['scenarios'][name] = runScenario(name, inputPath, arguments, env, work, ['-l', str(args.level), '-t', str(args.threads)])
+	if 'compress-solid-update' in report['scenarios'] and 'compress-patch-base-update' in report['scenarios']:
+		report['checks'] = {'patch-base-smaller': checkPatchBase(fixturePaths, work)}
+
+	baseline = None
+	if args.compare:
+		with open(args.compare, encoding='utf-8') as f:
+			baseline = json.load(f)
+	printReport(report, baseline)
+	if args.json:
+		with open(args.json, 'w', encoding='utf-8') as f:
+			json.dump(report, f, indent=2)
+	failed = [name for name, check in report.get('checks', {}).items() if check == None or not check['passed']]
+	for name in failed:
+		print('Check {0} failed: {1}'.format(name, report['checks'][name]))
+	if failed:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
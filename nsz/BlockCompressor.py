@@ -1,65 +1,55 @@
 from os import remove
 from nsz.nut import Print
-from time import sleep
 from pathlib import Path
 from traceback import format_exc
 from zstandard import ZstdCompressionParameters, ZstdCompressor
 from nsz.SectionFs import isNcaPacked, sortedFs
-from multiprocessing import Process, Manager
+from nsz.WorkerPool import WorkerPool
+from nsz import Profile
+from nsz.ContentStore import contentHashes, contentHash, blockParams
 from nsz.Fs import Pfs0, Hfs0, Nca, Type, Ticket, Xci, factory
 from nsz.PathTools import *
-import enlighten
 import sys
 
-if hasattr(sys, 'getandroidapilevel'):
-    from nsz.ThreadSafeCounterManager import Counter
-else:
-    from nsz.ThreadSafeCounterSharedMemory import Counter
 
-
-def compressBlockTask(in_queue, out_list, readyForWork, pleaseKillYourself, blockSize):
-	while True:
-		readyForWork.increment()
-		item = in_queue.get()
-		#readyForWork.decrement() # https://github.com/nicoboss/nsz/issues/80
-		if pleaseKillYourself.value() > 0:
-			break
-		buffer, compressionLevel, useLongDistanceMode, chunkRelativeBlockID = item
-		if buffer == 0:
-			return
-		if compressionLevel == 0 and len(buffer) == blockSize: # https://github.com/nicoboss/nsz/issues/79
-			out_list[chunkRelativeBlockID] = buffer
-		else:
-			params = ZstdCompressionParameters.from_level(compressionLevel, enable_ldm=useLongDistanceMode)
-			compressed = ZstdCompressor(compression_params=params).compress(buffer)
-			out_list[chunkRelativeBlockID] = compressed if len(compressed) < len(buffer) else buffer
-
-def blockCompress(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, threads):
+def compressBlockTask(context, buffer, compressionLevel, useLongDistanceMode, blockSize):
+	if compressionLevel == 0 and len(buffer) == blockSize: # https://github.com/nicoboss/nsz/issues/79
+		return buffer
+	token = Profile.start()
+	params = ZstdCompressionParameters.from_level(compressionLevel, enable_ldm=useLongDistanceMode)
+	compressed = ZstdCompressor(compression_params=params).compress(buffer)
+	Profile.stop('compress', token, len(buffer))
+	return compressed if len(compressed) < len(buffer) else buffer
+
+def blockCompress(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, threads, pool = None, store = None):
+	if pool == None:
+		with WorkerPool(queueSize = threads) as temporaryPool:
+			return blockCompress(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, threads, temporaryPool, store)
+	pool.ensureWorkers(threads)
 	if filePath.suffix == '.nsp':
-		return blockCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, threads)
+		return blockCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, pool, store)
 	elif filePath.suffix == '.xci':
-		return blockCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, threads)
+		return blockCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, pool, store)
 
-def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, threads):
+def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, pool, store = None):
+	try:
+		blockCompressContainerFiles(readContainer, writeContainer, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, pool, store)
+	finally:
+		#Leftover results of an aborted NCA must not end up in the next one
+		pool.discardPending()
+
+def blockCompressContainerFiles(readContainer, writeContainer, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, pool, store):
 	CHUNK_SZ = 0x100000
 	UNCOMPRESSABLE_HEADER_SIZE = 0x4000
 	if blockSizeExponent < 14 or blockSizeExponent > 32:
 		raise ValueError("Block size must be between 14 and 32")
 	blockSize = 2**blockSizeExponent
-	manager = Manager()
-	results = manager.list()
-	readyForWork = Counter(manager, 0)
-	pleaseKillYourself = Counter(manager, 0)
 	TasksPerChunk = 209715200//blockSize
-	for i in range(TasksPerChunk):
-		results.append(b"")
-	pool = []
-	work = manager.Queue(threads)
-	
-	for i in range(threads):
-		p = Process(target=compressBlockTask, args=(work, results, readyForWork, pleaseKillYourself, blockSize))
-		p.start()
-		pool.append(p)
+	results = [b""]*TasksPerChunk
+	metrics = pool.context.metrics
+	if store != None:
+		hashes = contentHashes(readContainer)
+		params = blockParams(compressionLevel, useLongDistanceMode, blockSizeExponent)
 
 	for nspf in readContainer:
 		if not keep:
@@ -71,6 +61,11 @@ def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep
 				
 				offsetFirstSection = sortedFs(nspf)[0].offset
 				newFileName = nspf._path[0:-1] + 'z'
+				stored = store.lookup(contentHash(hashes, nspf._path), params) if store != None else None
+				if stored != None:
+					store.writeStored(stored, writeContainer, newFileName)
+					continue
+				Profile.setNca(nspf._path)
 				f = writeContainer.add(newFileName, nspf.size)
 				startPos = f.tell()
 				nspf.seek(0)
@@ -81,9 +76,6 @@ def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep
 					sections += fs.getEncryptionSections()
 
 				if len(sections) == 0:
-					for p in pool:
-						#Process.terminate() might corrupt the datastructure but we do't care
-						p.terminate()
 					raise Exception("NCA can't be decrypted. Outdated keys.txt?")
 				header = b'NCZSECTN'
 				header += len(sections).to_bytes(8, 'little')
@@ -118,6 +110,7 @@ def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep
 				decompressedBytes = UNCOMPRESSABLE_HEADER_SIZE
 				compressedBytes = f.tell()
 				BAR_FMT = u'{desc}{desc_pad}{percentage:3.0f}%|{bar}| {count:{len_total}d}/{total:d} {unit} [{elapsed}<{eta}, {rate:.2f}{unit_pad}{unit}/s]'
+				import enlighten
 				bar = enlighten.Counter(total=nspf.size//1048576, desc='Compressing', unit='MiB', color='cyan', bar_format=BAR_FMT)
 				subBars = bar.add_subcounter('green', all_fields=True)
 				
@@ -136,34 +129,45 @@ def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep
 				subBars.count = f.tell()//1048576
 				bar.refresh()
 				while True:
+					token = Profile.start()
 					buffer = partitions[partNr].read(blockSize)
 					while (len(buffer) < blockSize and partNr < len(partitions)-1):
 						partitions[partNr].close()
 						partitions[partNr] = None
 						partNr += 1
 						buffer += partitions[partNr].read(blockSize - len(buffer))
+					Profile.stop('read', token, len(buffer))
 					if chunkRelativeBlockID >= TasksPerChunk or len(buffer) == 0:
-						while readyForWork.value() < threads:
-							sleep(0.02)
-
-						for i in range(min(TasksPerChunk, blocksToCompress-startChunkBlockID)):
+						token = Profile.start()
+						for i in range(chunkRelativeBlockID):
+							resultBlockID, result = pool.getResult()
+							results[resultBlockID] = result
+							if metrics != None:
+								metrics.setInFlight(0, pool.pending)
+						Profile.stop('wait', token)
+
+						token = Profile.start()
+						for i in range(chunkRelativeBlockID):
 							lenResult = len(results[i])
 							compressedBytes += lenResult
 							compressedblockSizeList[startChunkBlockID+i] = lenResult
 							f.write(results[i])
 							results[i] = b""
+						Profile.stop('write', token, sum(compressedblockSizeList[startChunkBlockID:startChunkBlockID+chunkRelativeBlockID]))
 
 						if len(buffer) == 0:
 							break
 						chunkRelativeBlockID = 0
 						startChunkBlockID = blockID
-					work.put([buffer, compressionLevel, useLongDistanceMode, chunkRelativeBlockID])
-					readyForWork.decrement()
+					pool.submit(chunkRelativeBlockID, compressBlockTask, buffer, compressionLevel, useLongDistanceMode, blockSize)
 					blockID += 1
 					chunkRelativeBlockID += 1
 					decompressedBytes += len(buffer)
 					if decompressedBytes - decompressedBytesOld > 10485760: #Refresh every 10 MB
 						decompressedBytesOld = decompressedBytes
+						if metrics != None:
+							metrics.update(0, decompressedBytes, compressedBytes, nspf.size, 'Compressing')
+							metrics.setInFlight(0, pool.pending)
 						bar.count = decompressedBytes//1048576
 						subBars.count = compressedBytes//1048576
 						bar.refresh()
@@ -183,6 +187,9 @@ def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep
 				f.write(header)
 				f.seek(endPos) #Seek to end of file.
 				Print.info('compressed %d%% %d -> %d  - %s' % (int(written * 100 / nspf.size), decompressedBytes, written, nspf._path))
+				if metrics != None:
+					metrics.reset(0)
+					metrics.event('nca', slot=0, nca=nspf._path, mode='block', read=decompressedBytes, written=written)
 				writeContainer.resize(newFileName, written)
 				continue
 			else:
@@ -193,20 +200,8 @@ def blockCompressContainer(readContainer, writeContainer, compressionLevel, keep
 			buffer = nspf.read(CHUNK_SZ)
 			f.write(buffer)
 
-	#Ensures that all threads are started and compleaded before being requested to quit
-	while readyForWork.value() < threads:
-		sleep(0.02)
-	pleaseKillYourself.increment()
-
-	for i in range(readyForWork.value()):
-		work.put(None)
-		readyForWork.decrement()
-
-	while readyForWork.value() > 0:
-		sleep(0.02)
-
 
-def blockCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, threads):
+def blockCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, pool, store = None):
 	filePath = filePath.resolve()
 	container = factory(filePath)
 	container.open(str(filePath), 'rb')
@@ -216,7 +211,7 @@ def blockCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistan
 	
 	try:
 		with Pfs0.Pfs0Stream(container.getPaddedHeaderSize() if fixPadding else container.getFirstFileOffset(), None if fixPadding else container.getStringTableSize(), str(nszPath)) as nsp:
-			blockCompressContainer(container, nsp, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, threads)
+			blockCompressContainer(container, nsp, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, pool, store)
 	except BaseException as ex:
 		if not ex is KeyboardInterrupt:
 			Print.error(format_exc())
@@ -229,7 +224,7 @@ def blockCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistan
 def allign0x200(n):
 	return 0x200-n%0x200
 
-def blockCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, threads):
+def blockCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, blockSizeExponent, outputDir, pool, store = None):
 	filePath = filePath.resolve()
 	container = factory(filePath)
 	container.open(str(filePath), 'rb')
@@ -244,7 +239,7 @@ def blockCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistan
 				hfsPartitionOut = xci.hfs0.add(partitionIn._path, 0)
 				with Hfs0.Hfs0Stream(hfsPartitionOut, xci.f) as partitionOut:
 					if keep == True or partitionIn._path == 'secure':
-						blockCompressContainer(partitionIn, partitionOut, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, threads)
+						blockCompressContainer(partitionIn, partitionOut, compressionLevel, keep, useLongDistanceMode, blockSizeExponent, pool, store)
 					alignedSize = partitionOut.actualSize + allign0x200(partitionOut.actualSize)
 					xci.hfs0.resize(partitionIn._path, alignedSize)
 					print(f'[RESIZE]     {partitionIn._path} to {hex(alignedSize)}')
@@ -1,13 +1,45 @@
 from zstandard import ZstdDecompressor
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+#Upper bound of the decompressed blocks read ahead by one reader
+MAX_READ_AHEAD_BYTES = 256*1024*1024
+
+class BlockCache:
+	'''LRU cache of decompressed blocks. One instance can be shared by many
+	readers as long as every reader uses its own cacheKey.'''
+
+	def __init__(self, maxBlocks = 1):
+		self.maxBlocks = maxBlocks
+		self.blocks = OrderedDict()
+		self.lock = Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		with self.lock:
+			block = self.blocks.get(key)
+			if block == None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.blocks.move_to_end(key)
+			return block
+
+	def put(self, key, block):
+		with self.lock:
+			self.blocks[key] = block
+			self.blocks.move_to_end(key)
+			while len(self.blocks) > self.maxBlocks:
+				self.blocks.popitem(last=False)
 
 class BlockDecompressorReader:
 	#Position in decompressed data
 	Position = 0
 	BlockHeader = None
-	CurrentBlock = b""
-	CurrentBlockId = -1
 
-	def __init__(self, nspf, BlockHeader):
+	def __init__(self, nspf, BlockHeader, cache = None, cacheKey = None, threads = 1):
 		self.BlockHeader = BlockHeader
 		initialOffset = nspf.tell()
 		self.nspf = nspf
@@ -20,22 +52,64 @@ class BlockDecompressorReader:
 			self.CompressedBlockOffsetList.append(self.CompressedBlockOffsetList[-1] + compressedBlockSize)
 
 		self.CompressedBlockSizeList = BlockHeader.compressedBlockSizeList
+		#Only keeping the current block is enough for sequential reads
+		self.Cache = cache if cache != None else BlockCache(1)
+		self.CacheKey = cacheKey if cacheKey != None else id(self)
+		#Compressed bytes read from nspf. Used to measure the read amplification.
+		self.CompressedBytesRead = 0
+		#With more than one thread the following blocks are decompressed ahead of sequential reads.
+		#Their number is bounded by MAX_READ_AHEAD_BYTES so many cores and big blocks don't exhaust the memory.
+		self.ReadAhead = max(1, min(threads * 2, MAX_READ_AHEAD_BYTES // self.BlockSize))
+		threads = min(threads, self.ReadAhead)
+		self.Executor = ThreadPoolExecutor(threads) if threads > 1 else None
+		self.Pending = {}
 
-	def __decompressBlock(self, blockID):
-		if self.CurrentBlockId == blockID:
-			return self.CurrentBlock
+	def __readBlock(self, blockID):
+		'''Returns (stored data, decompressed size) of a block'''
 		decompressedBlockSize = self.BlockSize
 		if blockID >= len(self.CompressedBlockOffsetList) - 1:
 			if blockID >= len(self.CompressedBlockOffsetList):
 				raise EOFError("BlockID exceeds the amounts of compressed blocks in that file!")
-			decompressedBlockSize = self.BlockHeader.decompressedSize % self.BlockSize
+			#The last block is only smaller if the size isn't a multiple of the block size
+			decompressedBlockSize = self.BlockHeader.decompressedSize % self.BlockSize or self.BlockSize
 		self.nspf.seek(self.CompressedBlockOffsetList[blockID])
+		self.CompressedBytesRead += min(self.CompressedBlockSizeList[blockID], decompressedBlockSize)
 		if self.CompressedBlockSizeList[blockID] < decompressedBlockSize:
-			self.CurrentBlock = ZstdDecompressor().decompress(self.nspf.read(self.CompressedBlockSizeList[blockID]))
+			return (self.nspf.read(self.CompressedBlockSizeList[blockID]), decompressedBlockSize)
+		return (self.nspf.read(decompressedBlockSize), decompressedBlockSize)
+
+	@staticmethod
+	def __decode(data, decompressedBlockSize):
+		#Blocks which didn't get smaller are stored uncompressed
+		if len(data) < decompressedBlockSize:
+			return ZstdDecompressor().decompress(data)
+		return data
+
+	def __decompressBlock(self, blockID):
+		block = self.Cache.get((self.CacheKey, blockID))
+		if block != None:
+			return block
+		if self.Executor == None:
+			block = self.__decode(*self.__readBlock(blockID))
 		else:
-			self.CurrentBlock = self.nspf.read(decompressedBlockSize)
-		self.CurrentBlockId = blockID
-		return self.CurrentBlock
+			future = self.Pending.pop(blockID, None)
+			if future == None:
+				future = self.Executor.submit(self.__decode, *self.__readBlock(blockID))
+			#Blocks behind or far ahead of the current one won't be needed anymore after a seek
+			for pendingID in [pendingID for pendingID in self.Pending if pendingID < blockID or pendingID > blockID + self.ReadAhead]:
+				del self.Pending[pendingID]
+			for nextID in range(blockID + 1, min(blockID + 1 + self.ReadAhead, len(self.CompressedBlockOffsetList))):
+				if not nextID in self.Pending:
+					self.Pending[nextID] = self.Executor.submit(self.__decode, *self.__readBlock(nextID))
+			block = future.result()
+		self.Cache.put((self.CacheKey, blockID), block)
+		return block
+
+	def close(self):
+		if self.Executor != None:
+			self.Pending = {}
+			self.Executor.shutdown()
+			self.Executor = None
 
 	def seek(self, offset, whence = 0):
 		if whence == 0:
@@ -48,18 +122,20 @@ class BlockDecompressorReader:
 			raise ValueError("whence argument must be 0, 1 or 2")
 
 	def read(self, length):
-		buffer = b""
-		blockOffset = self.Position%self.BlockSize
-		blockID = self.Position//self.BlockSize
-
-		while(len(buffer) - blockOffset < length):
+		chunks = []
+		pos = self.Position
+		end = self.Position + length
+		#Only the requested part of every block is copied so small reads from big blocks stay cheap
+		while pos < end:
+			blockID = pos//self.BlockSize
 			if blockID >= len(self.CompressedBlockOffsetList):
 				break
-
-			buffer += self.__decompressBlock(blockID)
-			blockID += 1
-
-		buffer = buffer[blockOffset:blockOffset+length]
+			blockOffset = pos%self.BlockSize
+			chunk = self.__decompressBlock(blockID)[blockOffset:blockOffset+end-pos]
+			if len(chunk) == 0:
+				break
+			chunks.append(chunk)
+			pos += len(chunk)
 		self.Position += length
 
-		return buffer
+		return b"".join(chunks)
@@ -0,0 +1,244 @@
+from pathlib import Path
+from hashlib import sha256
+from base64 import b64encode, b64decode
+from nsz.nut import Print
+from nsz.PathTools import *
+import json
+import os
+
+CHUNK_SZ = 0x100000
+MANIFEST_EXTENSION = '.manifest'
+
+def blockParams(compressionLevel, useLongDistanceMode, blockSizeExponent):
+	return 'block-l{0}-bs{1}{2}'.format(compressionLevel, blockSizeExponent, '-ldm' if useLongDistanceMode else '')
+
+def solidParams(compressionLevel, useLongDistanceMode, threads, frameSizeExponent = None, patchBase = False):
+	#Multithreaded zstd produces different frames than the single threaded one
+	return 'solid-l{0}{1}{2}{3}{4}'.format(compressionLevel, '-mt' if threads > 1 else '', '-ldm' if useLongDistanceMode else '', '-fs{0}'.format(frameSizeExponent) if frameSizeExponent != None else '', '-patch' if patchBase else '')
+
+def contentHashes(container):
+	'''{NCA file name stem: SHA-256 from the CNMT}. NCA names are the first half of their hash.'''
+	from nsz.FileExistingChecks import ExtractHashes
+	return {hash[:32]: hash for hash in ExtractHashes(container)}
+
+def contentHash(hashes, name):
+	return hashes.get(name.split('.')[0].lower())
+
+def absoluteOffset(nspf):
+	offset = 0
+	while getattr(nspf, 'isPartition', False):
+		offset += nspf.offset
+		nspf = nspf.f
+	return offset
+
+def leafFiles(container):
+	if hasattr(container, 'hfs0'):
+		return [nspf for partition in container.hfs0 for nspf in partition]
+	return list(container)
+
+def containerFiles(filePath):
+	'''Returns the CNMT hashes and the sorted (absolute offset, size, name) of
+	every file inside the NSZ/XCZ at filePath'''
+	from nsz.Fs import factory
+	container = factory(filePath)
+	container.open(str(filePath), 'rb')
+	try:
+		hashes = contentHashes(container.hfs0['secure'] if isXciXcz(filePath) else container)
+		files = sorted((absoluteOffset(nspf), nspf.size, nspf._path) for nspf in leafFiles(container))
+	finally:
+		container.close()
+	return (hashes, files)
+
+class ContentStore:
+	'''Content addressed store of the files inside compressed containers.
+	objects/ holds every file once, named by the SHA-256 of its bytes.
+	index/ maps the SHA-256 of an uncompressed NCA plus the compression
+	parameters to the object of its NCZ so compressors can skip NCAs which
+	were already compressed the same way for another container.'''
+
+	def __init__(self, path):
+		self.path = Path(path)
+		self.path.joinpath('objects').mkdir(parents=True, exist_ok=True)
+		self.path.joinpath('index').mkdir(exist_ok=True)
+
+	def objectPath(self, digest):
+		return self.path.joinpath('objects', digest[:2], digest)
+
+	def has(self, digest):
+		return self.objectPath(digest).is_file()
+
+	def put(self, f, size, containerHash = None):
+		'''Stores size bytes read from f and returns their SHA-256'''
+		hash = sha256()
+		tmpPath = self.path.joinpath('objects', 'tmp-{0}-{1}'.format(os.getpid(), id(f)))
+		with open(str(tmpPath), 'wb') as out:
+			while size > 0:
+				buffer = f.read(min(size, CHUNK_SZ))
+				if len(buffer) == 0:
+					raise IOError('Unexpected end of file while storing')
+				hash.update(buffer)
+				if containerHash != None:
+					containerHash.update(buffer)
+				out.write(buffer)
+				size -= len(buffer)
+		digest = hash.hexdigest()
+		if self.has(digest):
+			tmpPath.unlink()
+		else:
+			self.objectPath(digest).parent.mkdir(exist_ok=True)
+			os.replace(str(tmpPath), str(self.objectPath(digest)))
+		return digest
+
+	def chunks(self, digest):
+		with open(str(self.objectPath(digest)), 'rb') as source:
+			while True:
+				buffer = source.read(CHUNK_SZ)
+				if len(buffer) == 0:
+					break
+				yield buffer
+
+	def copyTo(self, digest, f):
+		for buffer in self.chunks(digest):
+			f.write(buffer)
+
+	def lookup(self, ncaHash, params):
+		'''Returns (object digest, size) of the NCZ of ncaHash or None'''
+		if ncaHash == None:
+			return None
+		indexPath = self.path.joinpath('index', '{0}-{1}'.format(ncaHash, params))
+		if not indexPath.is_file():
+			return None
+		digest = indexPath.read_text(encoding='utf-8').strip()
+		if not self.has(digest):
+			return None
+		return (digest, self.objectPath(digest).stat().st_size)
+
+	def remember(self, ncaHash, params, digest):
+		indexPath = self.path.joinpath('index', '{0}-{1}'.format(ncaHash, params))
+		tmpPath = indexPath.with_name(indexPath.name + '.tmp-{0}'.format(os.getpid()))
+		tmpPath.write_text(digest, encoding='utf-8')
+		os.replace(str(tmpPath), str(indexPath))
+
+	def writeStored(self, stored, writeContainer, name):
+		'''Writes the stored NCZ into writeContainer instead of compressing the NCA'''
+		digest, size = stored
+		Print.info('[STORED]     {0} {1}'.format(name, digest))
+		f = writeContainer.add(name, size)
+		self.copyTo(digest, f)
+		return f
+
+	def ingest(self, filePath, params, thin = False):
+		'''Stores every file of the compressed container at filePath and indexes its NCZs.
+		With thin the container is replaced by a manifest. Returns the resulting path.'''
+		filePath = Path(filePath)
+		hashes, files = containerFiles(filePath)
+		ranges = []
+		hash = sha256()
+		pos = 0
+		with open(str(filePath), 'rb') as f:
+			fileSize = os.path.getsize(str(filePath))
+			for offset, size, name in files + [(fileSize, 0, None)]:
+				if offset > pos:
+					#Headers and padding between the files are kept inline
+					f.seek(pos)
+					data = f.read(offset - pos)
+					hash.update(data)
+					ranges.append({'inline': b64encode(data).decode()})
+				if name == None:
+					break
+				f.seek(offset)
+				digest = self.put(f, size, hash)
+				ranges.append({'name': name, 'size': size, 'object': digest})
+				ncaHash = contentHash(hashes, name)
+				if name.endswith('.ncz') and ncaHash != None:
+					self.remember(ncaHash, params, digest)
+				pos = offset + size
+		Print.info('[STORE]      {0} {1} files'.format(filePath.name, len(files)))
+		if not thin:
+			return filePath
+
+		manifestPath = filePath.with_name(filePath.name + MANIFEST_EXTENSION)
+		manifest = {'version': 1, 'name': filePath.name, 'size': fileSize, 'sha256': hash.hexdigest(), 'store': str(self.path.resolve()), 'ranges': ranges}
+		with open(str(manifestPath), 'w', encoding='utf-8') as f:
+			json.dump(manifest, f, indent=1)
+		filePath.unlink()
+		Print.info('[THIN]       {0}'.format(manifestPath))
+		return manifestPath
+
+class OutputCache:
+	'''Remembers where the NCZs compressed during this run were written so an
+	NCA which appears in several input files is only compressed once. Later
+	occurrences copy the NCZ out of the earlier output file. entries is shared
+	by all workers of a run (a Manager dict). Falls back to the persistent
+	store if one is given.'''
+
+	def __init__(self, entries, store = None):
+		self.entries = entries
+		self.store = store
+
+	def register(self, filePath, params):
+		'''Indexes the NCZs of the output at filePath. Failing to do so only
+		means they won't be reused so it doesn't fail the compression.'''
+		filePath = Path(filePath).resolve()
+		if not filePath.is_file():
+			return
+		try:
+			hashes, files = containerFiles(filePath)
+		except Exception as e:
+			Print.warning('Could not index {0} for reuse: {1}'.format(filePath.name, str(e)))
+			return
+		modified = filePath.stat().st_mtime_ns
+		for offset, size, name in files:
+			ncaHash = contentHash(hashes, name)
+			if name.endswith('.ncz') and ncaHash != None:
+				self.entries['{0}-{1}'.format(ncaHash, params)] = (str(filePath), offset, size, modified)
+
+	def lookup(self, ncaHash, params):
+		entry = self.entries.get('{0}-{1}'.format(ncaHash, params)) if ncaHash != None else None
+		#Outputs can be removed or overwritten later on in the same run
+		if entry != None and os.path.isfile(entry[0]) and os.stat(entry[0]).st_mtime_ns == entry[3]:
+			return entry
+		if self.store != None:
+			return self.store.lookup(ncaHash, params)
+		return None
+
+	def writeStored(self, stored, writeContainer, name):
+		if len(stored) == 2:
+			return self.store.writeStored(stored, writeContainer, name)
+		filePath, offset, size, modified = stored
+		Print.info('[REUSED]     {0} from {1}'.format(name, filePath))
+		f = writeContainer.add(name, size)
+		with open(filePath, 'rb') as source:
+			source.seek(offset)
+			while size > 0:
+				buffer = source.read(min(size, CHUNK_SZ))
+				if len(buffer) == 0:
+					raise IOError('Unexpected end of {0}'.format(filePath))
+				f.write(buffer)
+				size -= len(buffer)
+		return f
+
+def materialize(manifestPath, outputDir = None, store = None):
+	'''Rebuilds the container described by a manifest and returns its path'''
+	manifestPath = Path(manifestPath)
+	with open(str(manifestPath), encoding='utf-8') as f:
+		manifest = json.load(f)
+	store = store or ContentStore(manifest['store'])
+	outputDir = Path(outputDir) if outputDir != None else manifestPath.parent
+	outPath = outputDir.joinpath(manifest['name'])
+	Print.info('Materializing {0} -> {1}'.format(manifestPath, outPath))
+	hash = sha256()
+	try:
+		with open(str(outPath), 'wb') as f:
+			for entry in manifest['ranges']:
+				for buffer in [b64decode(entry['inline'])] if 'inline' in entry else store.chunks(entry['object']):
+					hash.update(buffer)
+					f.write(buffer)
+	except BaseException:
+		if outPath.is_file():
+			outPath.unlink()
+		raise
+	if hash.hexdigest() != manifest['sha256']:
+		outPath.unlink()
+		raise IOError('{0} does not match the SHA-256 of its manifest'.format(outPath))
+	return outPath
@@ -1,8 +1,34 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from nsz.nut import Print
-from nsz.Fs import Nsp, factory
+from nsz.Fs.File import File
+from nsz.Fs.Ticket import Ticket
+from nsz.TitleInfo import containerEntries
 from nsz.PathTools import *
 import json
+import os
+
+#Remembers per titledb JSON file which title IDs still lack a key or rights ID
+TITLEDB_INDEX = '.titlekeys-index'
+
+def readTicket(filePath):
+	'''Returns (rightsId, titleKey) of the first ticket of the NSP/NSZ at filePath
+	or None if it has none. Only the PFS0 file table and the ticket are read.'''
+	f = File(str(filePath), 'rb')
+	try:
+		for name, offset, size in containerEntries(f, 0x0):
+			if name.endswith('.tik'):
+				ticket = f.partition(offset, size, Ticket())
+				return (format(ticket.getRightsId(), 'x').zfill(32), format(ticket.getTitleKeyBlock(), 'x').zfill(32))
+	finally:
+		f.close()
+	return None
+
+def readTicketOrError(filePath):
+	try:
+		return (readTicket(filePath), None)
+	except BaseException as e:
+		return (None, e)
 
 def extractTitlekeys(argsFile):
 	titlekeysDict = {}
@@ -12,27 +38,23 @@ def extractTitlekeys(argsFile):
 				(rightsId, titleKey, name) = line.rstrip().split('|')
 				titlekeysDict[rightsId[0:16]] = (rightsId, titleKey, name)
 				#Print.info("Read: {0}|{1}|{2}".format(rightsId, titleKey, name))
-	for f_str in argsFile:
-		for filePath in expandFiles(Path(f_str)):
-			if not isNspNsz(filePath):
-				continue
-			f = factory(filePath)
-			f.open(str(filePath), 'rb')
-			ticket = f.ticket()
-			if ticket is None:
-				# This ticket conditional was added to prevent the following exception from occurring when parsing a ticketless dump file:
-				# nut exception: 'NoneType' object has no attribute 'getRightsId'
+	filePaths = [filePath for f_str in argsFile for filePath in expandFiles(Path(f_str)) if isNspNsz(filePath)]
+	#Tickets are tiny so reading them is dominated by file access latency which threads overlap
+	with ThreadPoolExecutor() as executor:
+		for filePath, (ticket, error) in zip(filePaths, executor.map(readTicketOrError, filePaths)):
+			if error != None:
+				Print.error("Error while reading the ticket of {0}: {1}".format(filePath, error))
+			elif ticket is None:
+				# Ticketless dump files are skipped
 				Print.info("Skipped ticketless {0}".format(filePath.stem))
 			else:
-				rightsId = format(ticket.getRightsId(), 'x').zfill(32)
+				rightsId, titleKey = ticket
 				titleId = rightsId[0:16]
 				if not titleId in titlekeysDict:
-					titleKey = format(ticket.getTitleKeyBlock(), 'x').zfill(32)
 					titlekeysDict[titleId] = (rightsId, titleKey, filePath.stem)
 					Print.info("Found: {0}|{1}|{2}".format(rightsId, titleKey, filePath.stem))
 				else:
 					Print.info("Skipped already existing {0}".format(rightsId))
-			f.close()
 	Print.info("\ntitlekeys.txt:")
 	with open('titlekeys.txt', 'w', encoding="utf-8") as titlekeysFile:
 		for titleId in sorted(titlekeysDict.keys()):
@@ -44,35 +66,67 @@ def extractTitlekeys(argsFile):
 		return
 	Print.info("\n\ntitledb:")
 	Print.info("========")
-	titleDbPath = Path("titledb").resolve()
+	updateTitledb(Path("titledb").resolve(), titlekeysDict)
+
+def missingTitleIds(data):
+	'''Title IDs of a titledb JSON file without key or rights ID'''
+	return sorted(set(value["id"] for value in data.values() if value["id"] != None and (value["key"] == None or value["rightsId"] == None)))
+
+def loadTitledbIndex(titleDbPath):
+	try:
+		with open(str(titleDbPath.joinpath(TITLEDB_INDEX)), encoding="utf-8") as indexFile:
+			return json.load(indexFile)
+	except (OSError, ValueError):
+		return {}
+
+def saveTitledbIndex(titleDbPath, index):
+	indexPath = titleDbPath.joinpath(TITLEDB_INDEX)
+	tmpPath = indexPath.with_name(indexPath.name + '.tmp')
+	with open(str(tmpPath), 'w', encoding="utf-8") as indexFile:
+		json.dump(index, indexFile)
+	os.replace(str(tmpPath), str(indexPath))
+
+def updateTitledb(titleDbPath, titlekeysDict):
+	'''Adds the keys and rights IDs of titlekeysDict to the titledb JSON files
+	lacking them. Files are only parsed if they changed since they were last
+	indexed or if the index lists one of the title IDs of titlekeysDict.'''
 	excludeJson = {"cheats.json", "cnmts.json", "languages.json", "ncas.json", "versions.json"}
+	oldIndex = loadTitledbIndex(titleDbPath)
+	index = {}
 	for filePath in expandFiles(titleDbPath):
-		if filePath.suffix == '.json':
-			fileName = filePath.name
-			if fileName in excludeJson:
+		if filePath.suffix != '.json':
+			continue
+		fileName = filePath.name
+		if fileName in excludeJson:
+			continue
+		stat = filePath.stat()
+		entry = oldIndex.get(fileName)
+		if entry != None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns and not any(titleId in titlekeysDict for titleId in entry["missing"]):
+			index[fileName] = entry
+			continue
+		saveTrigger = False
+		Print.info("Reading {0}".format(fileName))
+		with open(str(filePath)) as json_file:
+			data = json.load(json_file)
+		for key, value in data.items():
+			titleId = value["id"]
+			if titleId == None:
 				continue
-			saveTrigger = False
-			Print.info("Reading {0}".format(fileName))
-			with open(str(filePath)) as json_file:
-				data = json.load(json_file)
-			for key, value in data.items():
-				titleId = value["id"]
-				if titleId == None:
-					continue
-				if titleId in titlekeysDict:
-					(rightsId, titleKey, name) = titlekeysDict[titleId]
-					if value["rightsId"] == None:
-						value["rightsId"] = rightsId
-						saveTrigger=True
-					#elif value["rightsId"] != rightsId:
-					#	Print.info("Warn: {0} != {1}".format(value["rightsId"], rightsId))
-					if value["key"] == None:
-						Print.info("{0}: Writing key to {1}".format(fileName, titleId))
-						value["key"] = titleKey
-						saveTrigger=True
-			if saveTrigger == True:
-				Print.info("Saving {0}".format(fileName))
-				with open(str(filePath), 'w') as outfile:
-					json.dump(data, outfile, indent=4, sort_keys=True)
-				Print.info("{0} saved!".format(fileName))
-			Print.info("")
+			if titleId in titlekeysDict:
+				(rightsId, titleKey, name) = titlekeysDict[titleId]
+				if value["rightsId"] == None:
+					value["rightsId"] = rightsId
+					saveTrigger=True
+				if value["key"] == None:
+					Print.info("{0}: Writing key to {1}".format(fileName, titleId))
+					value["key"] = titleKey
+					saveTrigger=True
+		if saveTrigger == True:
+			Print.info("Saving {0}".format(fileName))
+			with open(str(filePath), 'w') as outfile:
+				json.dump(data, outfile, indent=4, sort_keys=True)
+			Print.info("{0} saved!".format(fileName))
+			stat = filePath.stat()
+		index[fileName] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "missing": missingTitleIds(data)}
+		Print.info("")
+	saveTitledbIndex(titleDbPath, index)
@@ -5,6 +5,7 @@ from pathlib import Path
 from re import search
 from nsz.nut import Print
 from nsz.PathTools import *
+from nsz.TitleInfo import cnmtSummary
 import os
 
 def ExtractHashes(container):
@@ -33,21 +34,14 @@ def ExtractTitleIDAndVersion(gamePath, args = None):
 			return(titleId, version)
 		elif args != None and not args.parseCnmt:
 			return None
-	gamePath = Path(gamePath).resolve()
-	container = factory(gamePath)
-	container.open(str(gamePath), 'rb')
-	if isXciXcz(gamePath):
-		container = container.hfs0['secure']
+	#Only the file table and the CNMT NCA are read instead of opening every NCA
 	try:
-		for nspf in container:
-			if isinstance(nspf, Nca.Nca) and nspf.header.contentType == Type.Content.META:
-				for section in nspf:
-					if isinstance(section, Pfs0.Pfs0):
-						Cnmt = section.getCnmt()
-						titleId = Cnmt.titleId.upper()
-						version = Cnmt.version
-	finally:
-		container.close()
+		titleId, version, hashes = cnmtSummary(Path(gamePath).resolve())
+	except KeyboardInterrupt:
+		raise
+	except BaseException as e:
+		Print.error('Failed to read the Cnmt of {0}: {1}'.format(Path(gamePath).name, str(e)))
+		return None
 	if titleId != "" and version > -1 and version%65536 == 0:
 		return(titleId, version)
 	return None
@@ -133,6 +127,16 @@ def AllowedToWriteOutfile(filePath, targetFileExtension, targetDict, args):
 	
 	return fileNameCheck(filePath, targetFileExtension, filesAtTarget, args.rm_old_version, args.overwrite)
 
+def AddToTargetDict(filePath, targetDict, args):
+	'''Records a file written into the target folder after CreateTargetDict scanned it'''
+	(filesAtTarget, alreadyExists) = targetDict
+	filesAtTarget[filePath.name.lower()] = str(filePath)
+	extractedIdVersion = ExtractTitleIDAndVersion(filePath, args)
+	if extractedIdVersion == None:
+		return
+	titleID, version = extractedIdVersion
+	alreadyExists.setdefault(titleID, {}).setdefault(version, []).append(str(filePath))
+
 def fileNameCheck(filePath, targetFileExtension, filesAtTarget, removeOld, overwrite):
 	outFile = str(Path(changeExtension(filePath, targetFileExtension)).name).lower()
 	filePath = filesAtTarget.get(outFile)
@@ -4,12 +4,14 @@ from binascii import hexlify as hx, unhexlify as uhx
 from struct import pack as pk, unpack as upk
 from nsz.Fs.File import File, MemoryFile
 from hashlib import sha256
+from bisect import bisect_right
 import os
 import re
 import pathlib
 from nsz.nut import Keys, Print
 
 MEDIA_SIZE = 0x200
+BUCKET_SIZE = 0x4000
 
 
 
@@ -77,18 +79,18 @@ class BktrBucket:
 		self.entryCount = f.readInt32()
 		self.endOffset = f.readInt64()
 		self.entries = []
+		#Virtual offsets of the entries, sorted like the entries themselves
+		self.offsets = []
 		
+	def getEntryIndex(self, offset):
+		return max(0, bisect_right(self.offsets, offset) - 1)
+
 	def getEntry(self, offset):
-		index = 0
-		last = self.entries[index]
-		for entry in self.entries:
-			if entry.virtualOffset > offset:
-				break
-				
-			last = self.entries[index]
-			index += 1
-			
-		return last
+		return self.entries[self.getEntryIndex(offset)]
+
+	def getEntryEnd(self, index):
+		'''Virtual offset the entry at index ends at'''
+		return self.offsets[index + 1] if index + 1 < len(self.offsets) else self.endOffset
 
 			
 	def printInfo(self, maxDepth = 3, indent = 0):
@@ -106,6 +108,7 @@ class BktrSubsectionBucket(BktrBucket):
 		
 		for i in range(self.entryCount):
 			self.entries.append(BktrSubsectionEntry(f))
+		self.offsets = [entry.virtualOffset for entry in self.entries]
 			
 			
 class BktrRelocationBucket(BktrBucket):
@@ -117,11 +120,14 @@ class BktrRelocationBucket(BktrBucket):
 			
 		for i in range(self.entryCount):
 			self.entries.append(BktrRelocationEntry(f))
+		self.offsets = [entry.virtualOffset for entry in self.entries]
 			
 		
 class Bktr(Header):
 	def __init__(self, path = None, mode = None, cryptoType = -1, cryptoKey = -1, cryptoCounter = -1, nca = None):
 		self.basePhysicalOffsets  = []
+		self.bucketOffsets = []
+		self.bucketCount = 0
 		super(Bktr, self).__init__(path, mode, cryptoType, cryptoKey, cryptoCounter, nca)
 		
 		
@@ -136,28 +142,27 @@ class Bktr(Header):
 			self.basePhysicalOffsets = []
 			for i in range(int(0x3FF0 / 8)):
 				self.basePhysicalOffsets.append(self.nca.readInt64())
+			#Virtual offset every bucket starts at
+			self.bucketOffsets = self.basePhysicalOffsets[:self.bucketCount]
+
+	def readBuckets(self, bucketClass):
+		'''Decodes the buckets following the table header. Each one takes BUCKET_SIZE bytes.'''
+		buckets = []
+		for i in range(self.bucketCount):
+			self.nca.seek(self.bktr_offset + BUCKET_SIZE * (i + 1))
+			buckets.append(bucketClass(File(MemoryFile(self.nca.read(BUCKET_SIZE)), 'rb')))
+		return buckets
 				
 	def isValid(self):
 		return True if self.bktr_size > 0 else False
 				
+	def getBucketIndex(self, offset):
+		return min(len(self.buckets) - 1, max(0, bisect_right(self.bucketOffsets, offset) - 1))
+
 	def getBucket(self, offset):
 		if len(self.buckets) == 0:
 			return None
-			
-		index = 0
-		last = self.buckets[0]
-		
-		for virtualOffset in self.basePhysicalOffsets:
-			if index >= len(self.buckets):
-				break
-				
-			if offset > virtualOffset:
-				break
-				
-			last = self.buckets[index]
-			index += 1
-			
-		return last
+		return self.buckets[self.getBucketIndex(offset)]
 
 	def printInfo(self, maxDepth = 3, indent = 0):
 		super(Bktr, self).printInfo(maxDepth, indent)
@@ -176,45 +181,64 @@ class Bktr(Header):
 class Bktr1(Bktr):
 	def __init__(self, path = None, mode = None, cryptoType = -1, cryptoKey = -1, cryptoCounter = -1, nca = None):
 		self.buckets = []
+		self.loaded = False
 		super(Bktr1, self).__init__(path, mode, cryptoType, cryptoKey, cryptoCounter, nca)
 		
 	def open(self, file = None, mode = 'rb', cryptoType = -1, cryptoKey = -1, cryptoCounter = -1):
 		super(Bktr1, self).open(file, mode, cryptoType, cryptoKey, cryptoCounter)
 		
 		self.buckets = []
-		
-		#if self.bktr_size:
-		#	for i in range(self.bucketCount):
-		#		self.buckets.append(BktrRelocationBucket(self.nca))
+		self.loaded = False
+
+	def load(self):
+		'''The relocation table is only needed for reads through the patch so it is decoded on first use'''
+		if self.loaded:
+			return
+		if self.bktr_size:
+			self.buckets = self.readBuckets(BktrRelocationBucket)
+		self.loaded = True
 				
 	def getRelocationEntry(self, offset):
-		if len(self.buckets) == 0:
+		self.load()
+		bucket = self.getBucket(offset)
+		if bucket is None or len(bucket.entries) == 0:
 			return None
+		return bucket.getEntry(offset)
 
-		bucket = self.buckets[0]		
+	def getRelocations(self, offset, size):
+		'''Maps the virtual range [offset, offset + size) of the patched section to
+		a list of (physical offset, size, isPatch) ranges of the patch and base section'''
+		self.load()
+		result = []
+		end = offset + size
+		while offset < end:
+			bucketIndex = self.getBucketIndex(offset)
+			bucket = self.buckets[bucketIndex] if len(self.buckets) > 0 else None
+			if bucket is None or len(bucket.entries) == 0 or offset >= bucket.endOffset:
+				raise IOError('BKTR offset %x is not relocated' % offset)
+			index = bucket.getEntryIndex(offset)
+			entry = bucket.entries[index]
+			length = min(end, bucket.getEntryEnd(index)) - offset
+			result.append((entry.physicalOffset + offset - entry.virtualOffset, length, entry.isPatch != 0))
+			offset += length
+		return result
 
-		index = 0
-		for virtualOffset in self.basePhysicalOffsets:
-
-			if virtualOffset > offset or index >= len(self.buckets):
-				break
-
-			bucket = self.buckets[index]
-			index += 1
-			
-		result = bucket.entries[0]
-		for entry in bucket.entries:
-			if offset > entry.virtualOffset:
-				break
-			result = entry
-			
-		return entry
+	def readVirtual(self, offset, size, patch, base):
+		'''Reads size bytes at the virtual offset of the patched section. patch and
+		base are the decrypted patch and base sections.'''
+		chunks = []
+		for physicalOffset, length, isPatch in self.getRelocations(offset, size):
+			source = patch if isPatch else base
+			source.seek(physicalOffset)
+			chunks.append(source.read(length))
+		return b''.join(chunks)
 			
 		
 	def printInfo(self, maxDepth = 3, indent = 0):
 		super(Bktr1, self).printInfo(maxDepth, indent)
 		tabs = '\t' * indent
 
+		self.load()
 		for bucket in self.buckets:
 			bucket.printInfo(maxDepth, indent+1)
 		
@@ -229,15 +253,21 @@ class Bktr2(Bktr):
 		self.buckets = []
 		
 		if self.bktr_size:
-			for i in range(self.bucketCount):
-				self.buckets.append(BktrSubsectionBucket(self.nca))
+			self.buckets = self.readBuckets(BktrSubsectionBucket)
 		
 	def getEntries(self, offset, size):
+		'''Subsection entries overlapping [offset, offset + size)'''
 		entries = []
+		end = offset + max(size or 0, 1)
 		
-		bucket = self.getBucket(offset)
-		if bucket is not None:
-			entries.append(bucket.getEntry(offset))		
+		if len(self.buckets) == 0:
+			return entries
+		for bucket in self.buckets[self.getBucketIndex(offset):]:
+			for entry in bucket.entries[bucket.getEntryIndex(offset):]:
+				#The entry offset lies in is always returned
+				if entry.virtualOffset >= end and len(entries) > 0:
+					return entries
+				entries.append(entry)
 		
 		return entries
 		
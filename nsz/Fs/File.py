@@ -4,6 +4,7 @@ from nsz.nut import aes128,Print, Hex
 from binascii import hexlify as hx, unhexlify as uhx
 import hashlib
 import os.path
+from nsz import Profile
 
 class BaseFile:
 	def __init__(self, path = None, mode = None, cryptoType = -1, cryptoKey = -1, cryptoCounter = -1):
@@ -431,7 +432,9 @@ class File(BufferedFile):
 			else:
 				pass
 				#Print.info('reading from ' + hex(self._bufferOffset))
+			token = Profile.start()
 			self._buffer = self.crypto.decrypt(self._buffer)
+			Profile.stop('decrypt', token, len(self._buffer))
 		return self._buffer
 
 class MemoryFile(File):
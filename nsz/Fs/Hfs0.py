@@ -16,6 +16,36 @@ from nsz import Fs
 
 MEDIA_SIZE = 0x200
 
+def hfs0Header(files):
+	'''HFS0 header of files, a list of {'name', 'size', 'offset'} with offsets relative to the start of the partition'''
+	stringTable = '\x00'.join(file['name'] for file in files)+'\x00'
+	
+	headerSize = 0x10 + len(files) * 0x40 + len(stringTable)
+
+	h = b''
+	h += b'HFS0'
+	h += len(files).to_bytes(4, byteorder='little')
+	h += (len(stringTable)).to_bytes(4, byteorder='little')
+	h += b'\x00\x00\x00\x00'
+	
+	stringOffset = 0
+
+	for f in files:
+		sizeOfHashedRegion = 0 #0x200 if 0x200 < f['size'] else f['size']
+
+		h += (f['offset'] - headerSize).to_bytes(8, byteorder='little')
+		h += f['size'].to_bytes(8, byteorder='little')
+		h += stringOffset.to_bytes(4, byteorder='little')
+		h += sizeOfHashedRegion.to_bytes(4, byteorder='little')
+		h += b'\x00' * 8
+		h += b'\x00' * 0x20 # sha256 hash of region
+		
+		stringOffset += len(f['name']) + 1
+		
+	h += stringTable.encode()
+	
+	return h
+
 class Hfs0Stream(BaseFile):
 	def __init__(self, f, mode = 'wb'):
 		super(Hfs0Stream, self).__init__(f, mode)
@@ -39,11 +69,11 @@ class Hfs0Stream(BaseFile):
 		if pos > self.actualSize:
 			self.actualSize = pos
 
-	def add(self, name, size, pleaseNoPrint = None):
+	def add(self, name, size):
 		if self.written:
 			self.addpos = self.tell()
 			self.written = False
-		Print.info(f'[ADDING]     {name} {hex(size)} bytes to HFS0 at {hex(self.addpos)}', pleaseNoPrint)
+		Print.info(f'[ADDING]     {name} {hex(size)} bytes to HFS0 at {hex(self.addpos)}')
 		partition = self.partition(self.addpos, size, n = BaseFile())
 		self.files.append({'name': name, 'size': size, 'offset': self.addpos, 'partition': partition})
 		self.addpos += size
@@ -75,33 +105,7 @@ class Hfs0Stream(BaseFile):
 		pass
 
 	def getHeader(self):
-		stringTable = '\x00'.join(file['name'] for file in self.files)+'\x00'
-		
-		headerSize = 0x10 + len(self.files) * 0x40 + len(stringTable)
-	
-		h = b''
-		h += b'HFS0'
-		h += len(self.files).to_bytes(4, byteorder='little')
-		h += (len(stringTable)).to_bytes(4, byteorder='little')
-		h += b'\x00\x00\x00\x00'
-		
-		stringOffset = 0
-
-		for f in self.files:
-			sizeOfHashedRegion = 0 #0x200 if 0x200 < f['size'] else f['size']
-
-			h += (f['offset'] - headerSize).to_bytes(8, byteorder='little')
-			h += f['size'].to_bytes(8, byteorder='little')
-			h += stringOffset.to_bytes(4, byteorder='little')
-			h += sizeOfHashedRegion.to_bytes(4, byteorder='little')
-			h += b'\x00' * 8
-			h += b'\x00' * 0x20 # sha256 hash of region
-			
-			stringOffset += len(f['name']) + 1
-			
-		h += stringTable.encode()
-		
-		return h
+		return hfs0Header(self.files)
 
 class Hfs0(Pfs0):
 	def __init__(self, buffer, path = None, mode = None, cryptoType = -1, cryptoKey = -1, cryptoCounter = -1):
@@ -136,7 +140,7 @@ class Hfs0(Pfs0):
 			nameOffset = self.readInt32() # just the offset
 			name = stringTable[nameOffset:stringEndOffset].decode('utf-8').rstrip(' \t\r\n\0')
 			stringEndOffset = nameOffset
-			Print.info(f'[OPEN  ]     {name} {hex(size)} bytes at {hex(offset)}')
+			Print.verbose(f'[OPEN  ]     {name} {hex(size)} bytes at {hex(offset)}')
 
 			self.readInt32() # junk data
 
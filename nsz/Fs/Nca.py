@@ -15,6 +15,7 @@ from nsz.Fs.Rom import Rom
 from nsz.Fs.Pfs0 import Pfs0
 from nsz.Fs.BaseFs import BaseFs
 from nsz.nut import Titles
+from nsz import HeaderCache
 
 MEDIA_SIZE = 0x200
 
@@ -61,6 +62,9 @@ class NcaHeader(File):
 		self.masterKey = None
 		self.sectionTables = []
 		self.keys = []
+		#Decrypted header from the HeaderCache used instead of decrypting it again
+		self.plaintext = None
+		self.cacheKey = None
 		
 		super(NcaHeader, self).__init__(path, mode, cryptoType, cryptoKey, cryptoCounter)
 		
@@ -126,8 +130,9 @@ class NcaHeader(File):
 		if self.hasTitleRights():
 			titleRightsTitleId = self.rightsId.decode()[0:16].upper()
 
-			if titleRightsTitleId in Titles.keys() and Titles.get(titleRightsTitleId).key:
-				self.titleKeyDec = Keys.decryptTitleKey(uhx(Titles.get(titleRightsTitleId).key), self.masterKey)
+			titleKey = Titles.titleKey(titleRightsTitleId)
+			if titleKey:
+				self.titleKeyDec = Keys.decryptTitleKey(uhx(titleKey), self.masterKey)
 			else:
 				Print.info('could not find title key %s!' % titleRightsTitleId)
 		else:
@@ -135,6 +140,18 @@ class NcaHeader(File):
 
 		return True
 
+	def pageRefreshed(self):
+		if self.plaintext != None and self._bufferOffset + len(self._buffer) <= len(self.plaintext):
+			self._buffer = self.plaintext[self._bufferOffset:self._bufferOffset + len(self._buffer)]
+			return self._buffer
+		return super(NcaHeader, self).pageRefreshed()
+
+	def flushBuffer(self):
+		if self._bufferDirty:
+			self.plaintext = None
+			HeaderCache.drop(self.cacheKey)
+		super(NcaHeader, self).flushBuffer()
+
 	def realTitleId(self):
 		if not self.hasTitleRights():
 			return self.titleId
@@ -211,8 +228,14 @@ class Nca(File):
 	def open(self, file = None, mode = 'rb', cryptoType = -1, cryptoKey = -1, cryptoCounter = -1):
 		super(Nca, self).open(file, mode, cryptoType, cryptoKey, cryptoCounter)
 
+		headerKey = uhx(Keys.get('header_key'))
 		self.header = NcaHeader()
-		self.partition(0x0, 0xC00, self.header, Fs.Type.Crypto.XTS, uhx(Keys.get('header_key')))
+		self.header.cacheKey = HeaderCache.cacheKey(self, headerKey)
+		self.header.plaintext = HeaderCache.get(self.header.cacheKey)
+		self.partition(0x0, 0xC00, self.header, Fs.Type.Crypto.XTS, headerKey)
+		if self.header.plaintext == None:
+			self.header.seek(0x0)
+			HeaderCache.put(self.header.cacheKey, self.header.read(0xC00))
 		#Print.info('partition complete, seeking')
 		self.header.seek(0x400)
 		#Print.info('reading')
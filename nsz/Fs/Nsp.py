@@ -13,10 +13,8 @@ from nsz.nut import Print
 from nsz.Fs.Pfs0 import Pfs0
 from nsz.Fs.Ticket import Ticket
 from nsz.Fs.Nca import Nca
-import enlighten
 import shutil
 from nsz.nut import Titles
-from nsz.nut.Titles import Title
 from nsz.PathTools import *
 
 MEDIA_SIZE = 0x200
@@ -84,13 +82,7 @@ class Nsp(Pfs0):
 		if not self.titleId:
 			raise IOError('NSP no titleId set')
 			
-		if self.titleId in Titles.keys():
-			return Titles.get(self.titleId)
-			
-		t = Title.Title()
-		t.setId(self.titleId)
-		Titles.data()[self.titleId] = t
-		return t
+		return Titles.add(self.titleId)
 
 	def unpack(self, path, extractregex=r"*"):
 		os.makedirs(str(path), exist_ok=True)
@@ -382,6 +374,7 @@ class Nsp(Pfs0):
 			Print.info('\t\tRepack %s is already complete!' % self.path)
 			return
 			
+		import enlighten
 		t = enlighten.Counter(total=totalSize, unit='B', desc=os.path.basename(self.path), leave=False)
 		
 		Print.info('\t\tWriting header...')
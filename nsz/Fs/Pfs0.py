@@ -41,11 +41,11 @@ class Pfs0Stream(BaseFile):
 		if pos > self.actualSize:
 			self.actualSize = pos
 
-	def add(self, name, size, pleaseNoPrint = None):
+	def add(self, name, size):
 		if self.written:
 			self.addpos = self.tell()
 			self.written = False
-		Print.info(f'[ADDING]     {name} {hex(size)} bytes to PFS0 at {hex(self.addpos)}', pleaseNoPrint)
+		Print.info(f'[ADDING]     {name} {hex(size)} bytes to PFS0 at {hex(self.addpos)}')
 		partition = self.partition(self.addpos, size, n = BaseFile())
 		self.files.append({'name': name, 'size': size, 'offset': self.addpos, 'partition': partition})
 		self.addpos += size
@@ -138,8 +138,8 @@ class Pfs0VerifyStream():
 	def tell(self):
 		return self.pos
 
-	def add(self, name, size, pleaseNoPrint = None):
-		Print.info(f'[ADDING]     {name} {hex(size)} bytes to PFS0 at {hex(self.addpos)}', pleaseNoPrint)
+	def add(self, name, size):
+		Print.info(f'[ADDING]     {name} {hex(size)} bytes to PFS0 at {hex(self.addpos)}')
 		self.files.append({'name': name, 'size': size, 'offset': self.addpos})
 		self.addpos += size
 		return self
@@ -169,6 +169,10 @@ class Pfs0VerifyStream():
 		return hexHash
 
 	def updateHashHeader(self):
+		self.binhash.update(self.getHeader())
+
+	def getHeader(self):
+		'''Header including the padding up to the first file'''
 		stringTableNonPadded = '\x00'.join(file['name'] for file in self.files)+'\x00'
 		stringTableSizePadded = self.getStringTableSize()
 		stringTable = stringTableNonPadded + ('\x00'*(stringTableSizePadded-len(stringTableNonPadded)))
@@ -192,9 +196,7 @@ class Pfs0VerifyStream():
 			if self.files[0]['offset'] - headerSize > 0:
 				stringTable += '\x00' * (self.files[0]['offset'] - headerSize)
 		h += stringTable.encode()
-		
-		headerHex = h.hex()
-		self.binhash.update(h)
+		return h
 		
 
 
@@ -257,7 +259,7 @@ class Pfs0(BaseFs):
 			nameOffset = self.readInt32() # just the offset
 			name = stringTable[nameOffset:stringEndOffset].decode('utf-8').rstrip(' \t\r\n\0')
 			stringEndOffset = nameOffset
-			Print.info(f'[OPEN  ]     {name} {hex(size)} bytes at {hex(offset)}')
+			Print.verbose(f'[OPEN  ]     {name} {hex(size)} bytes at {hex(offset)}')
 
 			self.readInt32() # junk data
 
@@ -278,7 +280,7 @@ class Pfs0(BaseFs):
 			#key = format(ticket.getTitleKeyBlock(), 'X').zfill(32)
 			
 			if ticket.titleKey() != ('0' * 32):
-				Titles.get(ticket.titleId()).key = ticket.titleKey()
+				Titles.setKey(ticket.titleId(), ticket.titleKey())
 		except:
 			pass
 
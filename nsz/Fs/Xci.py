@@ -57,8 +57,8 @@ class XciStream(BaseFile):
 	def __exit__(self, type, value, traceback):
 		self.close()
 
-	def add(self, name, size, pleaseNoPrint = None):
-		Print.info(f'[ADDING]     {name} {hex(size)} bytes to XCI at {hex(self.f.tell())}', pleaseNoPrint)
+	def add(self, name, size):
+		Print.info(f'[ADDING]     {name} {hex(size)} bytes to XCI at {hex(self.f.tell())}')
 		partition = self.partition(self.f.tell(), size, n = BaseFile())
 		self.files.append({'name': name, 'size': size, 'offset': self.f.tell(), 'partition': partition})
 		self.addpos += size
@@ -24,4 +24,11 @@ class Block:
 		self.blockSizeExponent = f.readInt8()
 		self.numberOfBlocks = f.readInt32()
 		self.decompressedSize = f.readInt64()
-		self.compressedBlockSizeList = [f.readInt32() for _ in range(self.numberOfBlocks)]
\ No newline at end of file
+		self.compressedBlockSizeList = [f.readInt32() for _ in range(self.numberOfBlocks)]
+
+class Reference:
+	def __init__(self, f):
+		self.f = f
+		self.magic = f.read(8)
+		self.hash = f.read(32)
+		self.size = f.readInt64()
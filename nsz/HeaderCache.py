@@ -0,0 +1,91 @@
+from pathlib import Path
+from hashlib import sha256
+import os
+
+HEADER_SIZE = 0xC00
+#Entries kept in memory. An entry is one decrypted NCA header.
+MAX_ENTRIES = 1024
+
+#Decrypted 0xC00 byte NCA headers by cache key. Decrypting them with the pure
+#Python XTS takes longer than parsing everything else of the NCA header.
+entries = {}
+#Directory keeping the entries between runs or None
+path = None
+
+def setPath(cachePath):
+	global path
+	path = Path(cachePath) if cachePath != None else None
+	if path != None:
+		path.mkdir(parents=True, exist_ok=True)
+
+def cacheKey(nca, headerKey):
+	'''Key of the header of nca made of its NCA ID, its offset inside the
+	container and the path, size and mtime of the container, or None if nca
+	isn't backed by a file on disk'''
+	offset = 0
+	f = nca
+	while getattr(f, 'isPartition', False):
+		offset += f.offset
+		f = f.f
+	containerPath = getattr(f, '_path', None)
+	if not isinstance(containerPath, str):
+		return None
+	try:
+		stat = os.stat(containerPath)
+	except OSError:
+		return None
+	ncaId = str(nca._path).split('.')[0] if nca._path else ''
+	#The header key is part of the key as other keys decrypt to other headers
+	fingerprint = '{0}|{1}|{2}|{3}|{4}'.format(os.path.realpath(containerPath), stat.st_size, stat.st_mtime_ns, offset, sha256(headerKey).hexdigest())
+	return '{0}-{1}'.format(ncaId, sha256(fingerprint.encode('utf-8')).hexdigest()[:32])
+
+def entryPath(key):
+	return path.joinpath(key + '.hdr')
+
+def isHeader(plaintext):
+	return plaintext != None and len(plaintext) == HEADER_SIZE and plaintext[0x200:0x204] in (b'NCA3', b'NCA2')
+
+def get(key):
+	'''Decrypted header cached for key or None'''
+	if key == None:
+		return None
+	plaintext = entries.get(key)
+	if plaintext == None and path != None:
+		try:
+			with open(str(entryPath(key)), 'rb') as f:
+				plaintext = f.read()
+		except OSError:
+			return None
+		if not isHeader(plaintext):
+			return None
+		remember(key, plaintext)
+	return plaintext
+
+def remember(key, plaintext):
+	if len(entries) >= MAX_ENTRIES:
+		del entries[next(iter(entries))]
+	entries[key] = plaintext
+
+def put(key, plaintext):
+	if key == None or not isHeader(plaintext) or entries.get(key) == plaintext:
+		return
+	remember(key, plaintext)
+	if path != None:
+		tmpPath = path.joinpath('tmp-{0}-{1}'.format(os.getpid(), key))
+		try:
+			with open(str(tmpPath), 'wb') as f:
+				f.write(plaintext)
+			os.replace(str(tmpPath), str(entryPath(key)))
+		except OSError:
+			pass
+
+def drop(key):
+	'''Forgets the header of key after it was modified'''
+	if key == None:
+		return
+	entries.pop(key, None)
+	if path != None:
+		try:
+			os.remove(str(entryPath(key)))
+		except OSError:
+			pass
@@ -0,0 +1,140 @@
+from multiprocessing import Array, Lock, Queue
+from threading import Thread, Event
+from queue import Empty
+import json
+import time
+import sys
+
+STEPS = ['Idle', 'Compressing', 'Decompress', 'Verifying']
+READ, WRITTEN, TOTAL, STEP, IN_FLIGHT, STEP_START = range(6)
+FIELD_COUNT = 6
+
+class Metrics:
+	'''Progress of every worker slot is kept in a flat shared-memory array so
+	updating it is a memory write instead of a round trip to a Manager process.
+	Everything which isn't a counter (finished NCAs, failed verifications, ...)
+	is sent as a small dict over the event queue.'''
+
+	def __init__(self, slots, manager = None, recordEvents = False):
+		self.slots = slots
+		#Events are only queued if someone drains them
+		self.recordEvents = recordEvents
+		#Shared memory isn't available on Android
+		if manager != None and hasattr(sys, 'getandroidapilevel'):
+			self.values = manager.Array('q', [0] * (slots * FIELD_COUNT))
+			self.stepTimes = manager.Array('d', [0.0] * (slots * len(STEPS)))
+			self.lock = manager.Lock()
+			self.events = manager.Queue()
+		else:
+			self.values = Array('q', slots * FIELD_COUNT, lock=False)
+			self.stepTimes = Array('d', slots * len(STEPS), lock=False)
+			self.lock = Lock()
+			self.events = Queue()
+
+	def __setStep(self, id, step, restart):
+		base = id * FIELD_COUNT
+		now = time.monotonic_ns()
+		oldStep = self.values[base + STEP]
+		if restart or oldStep != step or self.values[base + STEP_START] == 0:
+			if self.values[base + STEP_START] != 0:
+				self.stepTimes[id * len(STEPS) + oldStep] += (now - self.values[base + STEP_START]) / 1e9
+			self.values[base + STEP] = step
+			self.values[base + STEP_START] = now
+
+	def update(self, id, read, written, total, step):
+		base = id * FIELD_COUNT
+		with self.lock:
+			#A smaller read counter means the slot started on the next file
+			self.__setStep(id, STEPS.index(step), read < self.values[base + READ])
+			self.values[base + READ] = read
+			self.values[base + WRITTEN] = written
+			self.values[base + TOTAL] = total
+
+	def add(self, id, read = 0, written = 0):
+		base = id * FIELD_COUNT
+		with self.lock:
+			self.values[base + READ] += read
+			self.values[base + WRITTEN] += written
+
+	def setInFlight(self, id, blocks):
+		with self.lock:
+			self.values[id * FIELD_COUNT + IN_FLIGHT] = blocks
+
+	def reset(self, id):
+		self.update(id, 0, 0, 0, 'Idle')
+		self.setInFlight(id, 0)
+
+	def snapshot(self, id):
+		base = id * FIELD_COUNT
+		with self.lock:
+			read, written, total, step, inFlight, stepStart = self.values[base:base + FIELD_COUNT]
+			stepTimes = self.stepTimes[id * len(STEPS):(id + 1) * len(STEPS)]
+		elapsed = (time.monotonic_ns() - stepStart) / 1e9 if stepStart != 0 else 0.0
+		stepSeconds = {}
+		for i, name in enumerate(STEPS):
+			seconds = stepTimes[i] + (elapsed if i == step else 0.0)
+			if seconds > 0 and name != 'Idle':
+				stepSeconds[name] = round(seconds, 3)
+		return {
+			'slot': id,
+			'step': STEPS[step],
+			'read': read,
+			'written': written,
+			'total': total,
+			'in_flight': inFlight,
+			'step_seconds': stepSeconds,
+			'mib_per_s': round(read / elapsed / 1048576, 2) if elapsed > 0 else 0.0
+		}
+
+	def event(self, type, **fields):
+		if not self.recordEvents:
+			return
+		fields['type'] = type
+		fields['time'] = time.time()
+		self.events.put(fields)
+
+	def drainEvents(self):
+		events = []
+		while True:
+			try:
+				events.append(self.events.get(False))
+			except Empty:
+				return events
+
+class MetricsJsonWriter(Thread):
+	'''Writes a progress record per busy slot every interval and every event
+	as JSON lines so runs can be monitored without parsing the console.'''
+
+	def __init__(self, metrics, path, interval = 1.0):
+		super(MetricsJsonWriter, self).__init__(daemon=True)
+		self.metrics = metrics
+		self.interval = interval
+		self.stopped = Event()
+		self.f = sys.stdout if path == '-' else open(path, 'a', encoding='utf-8')
+
+	def writeRecord(self, record):
+		self.f.write(json.dumps(record, default=str) + '\n')
+
+	def flush(self):
+		for event in self.metrics.drainEvents():
+			self.writeRecord(event)
+		now = time.time()
+		for id in range(self.metrics.slots):
+			record = self.metrics.snapshot(id)
+			if record['step'] == 'Idle':
+				continue
+			record['type'] = 'progress'
+			record['time'] = now
+			self.writeRecord(record)
+		self.f.flush()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.flush()
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+		self.flush()
+		if self.f != sys.stdout:
+			self.f.close()
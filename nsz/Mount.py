@@ -0,0 +1,82 @@
+from fuse import FUSE, FuseOSError, Operations
+from threading import Lock
+from pathlib import Path
+from nsz.nut import Print
+from nsz.PathTools import *
+from nsz.BlockDecompressorReader import BlockCache
+from nsz.VirtualContainer import VirtualContainer
+import errno
+import stat
+import os
+
+class CompressedLibrary(Operations):
+	'''Read-only file system showing every NSZ/XCZ as the NSP/XCI it
+	decompresses to. Reads are served by block decompression so containers
+	with solid compressed NCZs are left out.'''
+
+	def __init__(self, paths, cacheBlocks = 64):
+		self.cache = BlockCache(cacheBlocks)
+		self.files = {}
+		self.lock = Lock()
+		for path in paths:
+			for filePath in expandFiles(Path(path)):
+				if not filePath.is_file() or not isCompressedGame(filePath):
+					continue
+				try:
+					container = VirtualContainer(filePath, self.cache)
+				except ValueError as e:
+					Print.warning('[SKIPPED]    {0}: {1}'.format(filePath.name, e))
+					continue
+				if container.name in self.files:
+					Print.warning('[SKIPPED]    {0}: {1} is already mounted'.format(filePath, container.name))
+					container.close()
+					continue
+				self.files[container.name] = container
+				Print.info('[MOUNTED]    {0} -> {1}'.format(filePath.name, container.name))
+
+	def container(self, path):
+		container = self.files.get(path.lstrip('/'))
+		if container == None:
+			raise FuseOSError(errno.ENOENT)
+		return container
+
+	def getattr(self, path, fh = None):
+		if path == '/':
+			return {'st_mode': stat.S_IFDIR | 0o555, 'st_nlink': 2}
+		container = self.container(path)
+		source = os.stat(str(container.filePath))
+		return {
+			'st_mode': stat.S_IFREG | 0o444,
+			'st_nlink': 1,
+			'st_size': container.size,
+			'st_atime': source.st_atime,
+			'st_mtime': source.st_mtime,
+			'st_ctime': source.st_ctime
+		}
+
+	def readdir(self, path, fh):
+		if path != '/':
+			raise FuseOSError(errno.ENOTDIR)
+		return ['.', '..'] + sorted(self.files)
+
+	def open(self, path, flags):
+		if flags & (os.O_WRONLY | os.O_RDWR):
+			raise FuseOSError(errno.EROFS)
+		self.container(path)
+		return 0
+
+	def read(self, path, size, offset, fh):
+		return self.container(path).read(offset, size)
+
+	def statfs(self, path):
+		return {'f_bsize': 0x1000, 'f_frsize': 0x1000, 'f_blocks': sum(container.size for container in self.files.values()) // 0x1000, 'f_bfree': 0, 'f_bavail': 0, 'f_namemax': 255}
+
+	def destroy(self, path):
+		for container in self.files.values():
+			container.close()
+
+def mount(paths, mountPoint, cacheBlocks = 64):
+	'''Mounts the NSZ/XCZ files in paths at mountPoint until it gets unmounted'''
+	library = CompressedLibrary(paths, cacheBlocks)
+	Print.info('[MOUNT]      {0} files at {1}'.format(len(library.files), mountPoint))
+	FUSE(library, str(mountPoint), foreground=True, ro=True, nothreads=False)
@@ -0,0 +1,84 @@
+from nsz.nut import aes128
+from nsz import Header, BlockDecompressorReader
+
+UNCOMPRESSABLE_HEADER_SIZE = 0x4000
+
+class NczReader:
+	'''Random access to the original NCA of a block compressed NCZ. Reads are
+	decompressed through BlockDecompressorReader and re-encrypted with the
+	AES-CTR key of the section they fall into. Solid NCZs can only be
+	decompressed as a whole and raise a ValueError.'''
+
+	def __init__(self, nspf, cache = None, cacheKey = None):
+		self.nspf = nspf
+		nspf.seek(0)
+		self.header = nspf.read(UNCOMPRESSABLE_HEADER_SIZE)
+		if nspf.read(8) != b'NCZSECTN':
+			raise ValueError('No NCZSECTN found! Is this really a .ncz file?')
+		sectionCount = nspf.readInt64()
+		self.sections = [Header.Section(nspf) for _ in range(sectionCount)]
+		if self.sections[0].offset > UNCOMPRESSABLE_HEADER_SIZE:
+			self.sections.insert(0, Header.FakeSection(UNCOMPRESSABLE_HEADER_SIZE, self.sections[0].offset - UNCOMPRESSABLE_HEADER_SIZE))
+		self.size = max(UNCOMPRESSABLE_HEADER_SIZE, self.sections[-1].offset + self.sections[-1].size)
+		pos = nspf.tell()
+		if nspf.read(8) != b'NCZBLOCK':
+			raise ValueError('{0} is solid compressed and has no random read access'.format(nspf._path))
+		nspf.seek(pos)
+		blockHeader = Header.Block(nspf)
+		#The decompressed data starts right after the uncompressable header
+		self.reader = BlockDecompressorReader.BlockDecompressorReader(nspf, blockHeader, cache, cacheKey)
+		self.crypto = {}
+		self.Position = 0
+
+	def seek(self, offset, whence = 0):
+		if whence == 0:
+			self.Position = offset
+		elif whence == 1:
+			self.Position += offset
+		elif whence == 2:
+			self.Position = self.size + offset
+		else:
+			raise ValueError("whence argument must be 0, 1 or 2")
+
+	def tell(self):
+		return self.Position
+
+	def section(self, offset):
+		for s in self.sections:
+			if s.offset <= offset < s.offset + s.size:
+				return s
+		return None
+
+	def readSection(self, s, offset, end):
+		'''Reads [offset, end) which has to be inside the section s'''
+		if not s.cryptoType in (3, 4):
+			self.reader.seek(offset - UNCOMPRESSABLE_HEADER_SIZE)
+			return self.reader.read(end - offset)
+		#AES-CTR can only be seeked to a multiple of the block size
+		alignedOffset = max(offset & ~0xF, UNCOMPRESSABLE_HEADER_SIZE)
+		self.reader.seek(alignedOffset - UNCOMPRESSABLE_HEADER_SIZE)
+		data = self.reader.read(end - alignedOffset)
+		crypto = self.crypto.get(s.offset)
+		if crypto == None:
+			crypto = self.crypto[s.offset] = aes128.AESCTR(s.cryptoKey, s.cryptoCounter)
+		crypto.seek(alignedOffset)
+		return crypto.encrypt(data)[offset - alignedOffset:]
+
+	def read(self, length = None):
+		end = self.size if length == None else min(self.size, self.Position + length)
+		chunks = []
+		offset = self.Position
+		if offset < UNCOMPRESSABLE_HEADER_SIZE:
+			chunks.append(self.header[offset:end])
+			offset = min(end, UNCOMPRESSABLE_HEADER_SIZE)
+		while offset < end:
+			s = self.section(offset)
+			if s == None:
+				raise EOFError('Offset {0} of {1} is not inside any NCZ section'.format(hex(offset), self.nspf._path))
+			data = self.readSection(s, offset, min(end, s.offset + s.size))
+			if len(data) == 0:
+				break
+			chunks.append(data)
+			offset += len(data)
+		self.Position = max(self.Position, offset)
+		return b''.join(chunks)
@@ -3,33 +3,34 @@ from traceback import format_exc
 from hashlib import sha256
 from nsz.nut import Print, aes128
 from zstandard import ZstdDecompressor
+from multiprocessing import cpu_count
 from nsz.Fs import factory, Type, Pfs0, Hfs0, Nca, Xci
 from nsz.PathTools import *
-from nsz import Header, BlockDecompressorReader, FileExistingChecks
-import os, enlighten
+from nsz import Header, BlockDecompressorReader, FileExistingChecks, Profile, PatchBase
+import os
 
 class VerificationException(Exception):
 	pass
 
-def decompress(filePath, outputDir, fixPadding, statusReportInfo, pleaseNoPrint = None):
+def decompress(filePath, outputDir, fixPadding, statusReportInfo):
 	if isNspNsz(filePath):
-		__decompressNsz(filePath, outputDir, fixPadding, True, False, False, statusReportInfo, None, pleaseNoPrint)
+		__decompressNsz(filePath, outputDir, fixPadding, True, False, False, statusReportInfo, None)
 	elif isXciXcz(filePath):
-		__decompressXcz(filePath, outputDir, fixPadding, True, False, False, statusReportInfo, None, pleaseNoPrint)
+		__decompressXcz(filePath, outputDir, fixPadding, True, False, False, statusReportInfo, None)
 	elif isCompressedGameFile(filePath):
 		filePathNca = changeExtension(filePath, '.nca')
 		outPath = filePathNca if outputDir == None else str(Path(outputDir).joinpath(Path(filePathNca).name))
-		Print.info('Decompressing %s -> %s' % (filePath, outPath), pleaseNoPrint)
+		Print.info('Decompressing %s -> %s' % (filePath, outPath))
 		try:
 			inFile = factory(filePath)
 			inFile.open(str(filePath), 'rb')
 			with open(outPath, 'wb') as outFile:
-				written, hexHash = __decompressNcz(inFile, outFile, statusReportInfo, pleaseNoPrint)
+				written, hexHash = __decompressNcz(inFile, outFile, statusReportInfo)
 				fileNameHash = Path(filePath).stem.lower()
 				if hexHash[:32] == fileNameHash:
-					Print.info('[VERIFIED]   {0}'.format(filePathNca), pleaseNoPrint)
+					Print.info('[VERIFIED]   {0}'.format(filePathNca))
 				else:
-					Print.info('[MISMATCH]   Filename startes with {0} but {1} was expected - hash verified failed!'.format(fileNameHash, hexHash[:32]), pleaseNoPrint)
+					Print.info('[MISMATCH]   Filename startes with {0} but {1} was expected - hash verified failed!'.format(fileNameHash, hexHash[:32]))
 		except BaseException as ex:
 			if not ex is KeyboardInterrupt:
 				Print.error(format_exc())
@@ -41,67 +42,74 @@ def decompress(filePath, outputDir, fixPadding, statusReportInfo, pleaseNoPrint
 		raise NotImplementedError("Can't decompress {0} as that file format isn't implemented!".format(filePath))
 
 
-def verify(filePath, fixPadding, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo, pleaseNoPrint):
+def verify(filePath, fixPadding, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo):
 	if isNspNsz(filePath):
-		__decompressNsz(filePath, None, fixPadding, False, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo, pleaseNoPrint)
+		__decompressNsz(filePath, None, fixPadding, False, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo)
 	elif isXciXcz(filePath):
-		__decompressXcz(filePath, None, fixPadding, False, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo, pleaseNoPrint)
+		__decompressXcz(filePath, None, fixPadding, False, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo)
 
 
-def __decompressContainer(readContainer, writeContainer, fileHashes, write, raiseVerificationException, raisePfs0Exception, statusReportInfo, pleaseNoPrint):
+def __decompressContainer(readContainer, writeContainer, fileHashes, write, raiseVerificationException, raisePfs0Exception, statusReportInfo):
 	CHUNK_SZ = 0x100000
 	if write:
 		for nspf in readContainer:
 			if not nspf._path.endswith('.ncz'):
-				writeContainer.add(nspf._path, nspf.size, pleaseNoPrint)
+				writeContainer.add(nspf._path, nspf.size)
 			else:
 				newFileName = Path(nspf._path).stem + '.nca'
 				nca_size = __getDecompressedNczSize(nspf)
-				writeContainer.add(newFileName, nca_size, pleaseNoPrint)
+				writeContainer.add(newFileName, nca_size)
 		writeContainer.updateHashHeader()
 	for nspf in readContainer:
-		Print.info('[EXISTS]     {0}'.format(nspf._path), pleaseNoPrint)
+		Print.info('[EXISTS]     {0}'.format(nspf._path))
 		if not nspf._path.endswith('.ncz'):
 			verifyFile = nspf._path.endswith('.nca') and not nspf._path.endswith('.cnmt.nca')
 			hash = sha256()
 			nspf.seek(0)
+			Profile.setNca(nspf._path)
 			while not nspf.eof():
+				token = Profile.start()
 				inputChunk = nspf.read(CHUNK_SZ)
+				Profile.stop('read', token, len(inputChunk))
+				token = Profile.start()
 				hash.update(inputChunk)
+				Profile.stop('hash', token, len(inputChunk))
 				if write:
+					token = Profile.start()
 					writeContainer.get(nspf._path).write(inputChunk)
+					Profile.stop('write', token, len(inputChunk))
 			if verifyFile:
 				hashHexdigest = hash.hexdigest()
 				if hasattr(nspf.f, 'ticketless'):
 					# This ticket conditional was added to prevent the following exception from occurring when processing a ticketless dump file:
 					# nut exception: Verification detected hash mismatch
-					Print.info('[TICKETLESS] {0}'.format(nspf._path), pleaseNoPrint)
+					Print.info('[TICKETLESS] {0}'.format(nspf._path))
 				else:
 					if hashHexdigest in fileHashes:
-						Print.info(f'[NCA HASH]   {hashHexdigest}', pleaseNoPrint)
-						Print.info(f'[VERIFIED]   {nspf._path} {hashHexdigest}', pleaseNoPrint)
+						Print.info(f'[NCA HASH]   {hashHexdigest}')
+						Print.info(f'[VERIFIED]   {nspf._path} {hashHexdigest}')
 					else:
-						Print.info(f'[NCA HASH]   {hashHexdigest}', pleaseNoPrint)
-						Print.info(f'[CORRUPTED]  {nspf._path} {hashHexdigest}', pleaseNoPrint)
+						Print.info(f'[NCA HASH]   {hashHexdigest}')
+						Print.info(f'[CORRUPTED]  {nspf._path} {hashHexdigest}')
 						if raiseVerificationException:
 							raise VerificationException("Verification detected hash mismatch!")
 			continue
 		newFileName = Path(nspf._path).stem + '.nca'
 		if write:
-			written, hexHash = __decompressNcz(nspf, writeContainer.get(newFileName), statusReportInfo, pleaseNoPrint)
+			written, hexHash = __decompressNcz(nspf, writeContainer.get(newFileName), statusReportInfo)
 		else:
-			written, hexHash = __decompressNcz(nspf, None, statusReportInfo, pleaseNoPrint)
+			written, hexHash = __decompressNcz(nspf, None, statusReportInfo)
 		if hasattr(nspf.f, 'ticketless'):
 			# This ticket conditional was added to prevent the following exception from occurring when processing a ticketless dump file:
 			# nut exception: Verification detected hash mismatch
-			Print.info('[TICKETLESS] {0}'.format(nspf._path), pleaseNoPrint)
+			Print.info('[TICKETLESS] {0}'.format(nspf._path))
 		else:
 			if hexHash in fileHashes:
-				Print.info(f'[NCA HASH]   {hexHash}', pleaseNoPrint)
-				Print.info(f'[VERIFIED]   {nspf._path}', pleaseNoPrint)
+				Print.info(f'[NCA HASH]   {hexHash}')
+				Print.info(f'[VERIFIED]   {nspf._path}')
 			else:
-				Print.info(f'[NCA HASH]   {hexHash}', pleaseNoPrint)
-				Print.info(f'[CORRUPTED]  {nspf._path}', pleaseNoPrint)
+				Print.info(f'[NCA HASH]   {hexHash}')
+				Print.info(f'[CORRUPTED]  {nspf._path}')
 				if raiseVerificationException:
 					raise VerificationException("Verification detected hash mismatch")
 
@@ -124,9 +132,10 @@ def __getDecompressedNczSize(nspf):
 	return nca_size
 
 
-def __decompressNcz(nspf, f, statusReportInfo, pleaseNoPrint):
+def __decompressNcz(nspf, f, statusReportInfo):
 	UNCOMPRESSABLE_HEADER_SIZE = 0x4000
 	blockID = 0
+	Profile.setNca(nspf._path)
 	nspf.seek(0)
 	header = nspf.read(UNCOMPRESSABLE_HEADER_SIZE)
 	currentStep = 'Decompress' if f != None else 'Verifying'
@@ -151,22 +160,31 @@ def __decompressNcz(nspf, f, statusReportInfo, pleaseNoPrint):
 	if useBlockCompression:
 		Print.info(f'[NCZBLOCK]   Using Block decompression for {nspf._path}')
 		BlockHeader = Header.Block(nspf)
-		blockDecompressorReader = BlockDecompressorReader.BlockDecompressorReader(nspf, BlockHeader)
+		#zstd releases the GIL so the following blocks are decompressed by other threads meanwhile
+		blockDecompressorReader = BlockDecompressorReader.BlockDecompressorReader(nspf, BlockHeader, threads=cpu_count())
+	elif blockMagic == PatchBase.REFERENCE_MAGIC:
+		reference = Header.Reference(nspf)
+		Print.info(f'[NCZREFER]   Using base NCA {reference.hash.hex()} to decompress {nspf._path}')
+		dictionary = PatchBase.reference(reference.hash.hex(), reference.size)
 	pos = nspf.tell()
 	if not useBlockCompression:
-		decompressor = ZstdDecompressor().stream_reader(nspf)
+		if blockMagic == PatchBase.REFERENCE_MAGIC:
+			decompressor = ZstdDecompressor(dict_data=dictionary, max_window_size=2**PatchBase.MAX_WINDOW_LOG).stream_reader(nspf)
+		else:
+			decompressor = ZstdDecompressor().stream_reader(nspf)
 	hash = sha256()
 	
 	if statusReportInfo == None:
 		BAR_FMT = u'{desc}{desc_pad}{percentage:3.0f}%|{bar}| {count:{len_total}d}/{total:d} {unit} [{elapsed}<{eta}, {rate:.2f}{unit_pad}{unit}/s]'
+		import enlighten
 		bar = enlighten.Counter(total=nca_size//1048576, desc='Decompress', unit="MiB", color='red', bar_format=BAR_FMT)
 	decompressedBytes = len(header)
 	decompressedBytesOld = decompressedBytes
 	if f != None:
 		f.write(header)
 	if statusReportInfo != None:
-		statusReport, id = statusReportInfo
-		statusReport[id] = [len(header), 0, nca_size, currentStep]
+		metrics, id = statusReportInfo
+		metrics.update(id, len(header), 0, nca_size, currentStep)
 	else:
 		bar.count = decompressedBytes//1048576
 		bar.refresh()
@@ -188,27 +206,37 @@ def __decompressNcz(nspf, f, statusReportInfo, pleaseNoPrint):
 			if useCrypto:
 				crypto.seek(i)
 			chunkSz = 0x10000 if end - i > 0x10000 else end - i
+			token = Profile.start()
 			if useBlockCompression:
 				inputChunk = blockDecompressorReader.read(chunkSz)
 			else:
 				inputChunk = decompressor.read(chunkSz)
+			Profile.stop('decompress', token, len(inputChunk))
 			if not len(inputChunk):
 				break
 			if useCrypto:
+				token = Profile.start()
 				inputChunk = crypto.encrypt(inputChunk)
+				Profile.stop('encrypt', token, len(inputChunk))
 			if f != None:
+				token = Profile.start()
 				f.write(inputChunk)
+				Profile.stop('write', token, len(inputChunk))
+			token = Profile.start()
 			hash.update(inputChunk)
+			Profile.stop('hash', token, len(inputChunk))
 			lenInputChunk = len(inputChunk)
 			i += lenInputChunk
 			decompressedBytes += lenInputChunk
 			if statusReportInfo != None:
-				statusReport[id] = [statusReport[id][0]+chunkSz, statusReport[id][1], nca_size, currentStep]
+				metrics.add(id, read=chunkSz)
 			elif decompressedBytes - decompressedBytesOld > 52428800: #Refresh every 50 MB
 				decompressedBytesOld = decompressedBytes
 				bar.count = decompressedBytes//1048576
 				bar.refresh()
 
+	if useBlockCompression:
+		blockDecompressorReader.close()
 	if statusReportInfo == None:
 		bar.count = decompressedBytes//1048576
 		bar.close()
@@ -223,7 +251,7 @@ def __decompressNcz(nspf, f, statusReportInfo, pleaseNoPrint):
 	return (0, hexHash)
 
 
-def __decompressNsz(filePath, outputDir, fixPadding, write, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo, pleaseNoPrint):
+def __decompressNsz(filePath, outputDir, fixPadding, write, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo):
 	container = factory(filePath)
 	container.open(str(filePath), 'rb')
 	fileHashes = FileExistingChecks.ExtractHashes(container)
@@ -232,12 +260,12 @@ def __decompressNsz(filePath, outputDir, fixPadding, write, raiseVerificationExc
 		if write:
 			filePathNsp = changeExtension(filePath, '.nsp')
 			outPath = filePathNsp if outputDir == None else str(Path(outputDir).joinpath(Path(filePathNsp).name))
-			Print.info('Decompressing %s -> %s' % (filePath, outPath), pleaseNoPrint)
+			Print.info('Decompressing %s -> %s' % (filePath, outPath))
 			with Pfs0.Pfs0Stream(container.getPaddedHeaderSize() if fixPadding else container.getFirstFileOffset(), None if fixPadding else container.getStringTableSize(), outPath) as nsp:
-				__decompressContainer(container, nsp, fileHashes, True, raiseVerificationException, raisePfs0Exception, statusReportInfo, pleaseNoPrint)
+				__decompressContainer(container, nsp, fileHashes, True, raiseVerificationException, raisePfs0Exception, statusReportInfo)
 		else:
 			with Pfs0.Pfs0VerifyStream(container.getPaddedHeaderSize() if fixPadding else container.getFirstFileOffset(), None if fixPadding else container.getStringTableSize()) as nsp:
-				__decompressContainer(container, nsp, fileHashes, True, raiseVerificationException, raisePfs0Exception, statusReportInfo, pleaseNoPrint)
+				__decompressContainer(container, nsp, fileHashes, True, raiseVerificationException, raisePfs0Exception, statusReportInfo)
 				Print.info("[NSP SHA256] " + nsp.getHash())
 				if originalFilePath != None: 
 					originalContainer = factory(originalFilePath)
@@ -246,21 +274,27 @@ def __decompressNsz(filePath, outputDir, fixPadding, write, raiseVerificationExc
 					filesize = os.path.getsize(str(originalFilePath))
 					if statusReportInfo == None:
 						BAR_FMT = u'{desc}{desc_pad}{percentage:3.0f}%|{bar}| {count:{len_total}d}/{total:d} {unit} [{elapsed}<{eta}, {rate:.2f}{unit_pad}{unit}/s]'
+						import enlighten
 						bar = enlighten.Counter(total=filesize//CHUNK_SZ, desc='Verifying', unit="MiB", color='yellow', bar_format=BAR_FMT)
 					blockCount = 0
+					Profile.setNca(Path(originalFilePath).name)
 					with open(str(originalFilePath), 'rb') as f:
 						while True:
+							token = Profile.start()
 							data = f.read(CHUNK_SZ)
+							Profile.stop('read', token, len(data))
 							blockCount += 1
 							if statusReportInfo != None:
-								statusReport, id = statusReportInfo
-								statusReport[id] = [blockCount, 0, filesize, 'Verifying']
+								metrics, id = statusReportInfo
+								metrics.update(id, blockCount*CHUNK_SZ, 0, filesize, 'Verifying')
 							else:
 								bar.count = blockCount
 								bar.refresh()
 							if not data:
 								break
+							token = Profile.start()
 							originalHash.update(data)
+							Profile.stop('hash', token, len(data))
 					originalHashHex = originalHash.hexdigest()
 					if statusReportInfo == None:
 						bar.close()
@@ -277,24 +311,24 @@ def __decompressNsz(filePath, outputDir, fixPadding, write, raiseVerificationExc
 		container.close()
 
 
-def __decompressXcz(filePath, outputDir, fixPadding, write, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo, pleaseNoPrint):
+def __decompressXcz(filePath, outputDir, fixPadding, write, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo):
 	container = factory(filePath)
 	container.open(str(filePath), 'rb')
 	
 	if write:
 		filePathXci = changeExtension(filePath, '.xci')
 		outPath = filePathXci if outputDir == None else str(Path(outputDir).joinpath(Path(filePathXci).name))
-		Print.info('Decompressing %s -> %s' % (filePath, outPath), pleaseNoPrint)
+		Print.info('Decompressing %s -> %s' % (filePath, outPath))
 		with Xci.XciStream(outPath, originalXciPath = filePath) as xci: # need filepath to copy XCI container settings
 			for partitionIn in container.hfs0:
 				fileHashes = FileExistingChecks.ExtractHashes(partitionIn)
-				hfsPartitionIn = xci.hfs0.add(partitionIn._path, 0x200, pleaseNoPrint)
+				hfsPartitionIn = xci.hfs0.add(partitionIn._path, 0x200)
 				with Hfs0.Hfs0Stream(hfsPartitionIn, xci.f.tell()) as partitionOut:
-					__decompressContainer(partitionIn, partitionOut, fileHashes, write, raiseVerificationException, raisePfs0Exception, statusReportInfo, pleaseNoPrint)
+					__decompressContainer(partitionIn, partitionOut, fileHashes, write, raiseVerificationException, raisePfs0Exception, statusReportInfo)
 				xci.hfs0.resize(partitionIn._path, partitionOut.actualSize)
 	else:
 		for partitionIn in container.hfs0:
 			fileHashes = FileExistingChecks.ExtractHashes(partitionIn)
-			__decompressContainer(partitionIn, None, fileHashes, write, raiseVerificationException, raisePfs0Exception, statusReportInfo, pleaseNoPrint)
+			__decompressContainer(partitionIn, None, fileHashes, write, raiseVerificationException, raisePfs0Exception, statusReportInfo)
 
 	container.close()
@@ -2,7 +2,7 @@ from argparse import ArgumentParser
 
 class ParseArguments:
 	@staticmethod
-	def parse():
+	def parse(argv = None):
 		parser = ArgumentParser()
 		parser.add_argument('file',nargs='*')
 		parser.add_argument('-C', action="store_true", help='Compress NSP/XCI')
@@ -11,6 +11,8 @@ class ParseArguments:
 		parser.add_argument('-L', '--long', action="store_true", default=False, help='Enables zStandard long distance mode for even better compression')
 		parser.add_argument('-B', '--block', action="store_true", default=False, help="Use block compression option. This mode allows highly multi-threaded compression/decompression with random read access allowing compressed games to be played without decompression in the future however this comes with a slightly lower compression ratio cost. This is the default option for XCZ.")
 		parser.add_argument('-S', '--solid', action="store_true", default=False, help="Use solid compression option. Slightly higher compression ratio but won't allow for random read access. File compressed this way will never be mountable (have to be installed or decompressed first to run). This is the default option for NSZ.")
+		parser.add_argument('--seekable', type=int, nargs='?', const=24, default=None, metavar='EXP', help='Solid compression only: splits every NCA into independent zstd frames of 2^EXP bytes (default: 24 => 16 MiB) listed in an NCZBLOCK header. Keeps most of the solid compression ratio while allowing random read access and parallel decompression.')
+		parser.add_argument('--patch-base', type=str, action='append', default=None, metavar='PATH', help='Solid compression only: NSP/NSZ/XCI/XCZ file or directory containing base titles. NCAs of updates are compressed using the matching NCA of their base title as reference which makes them a lot smaller. Such NCZs can only be decompressed or verified with the same base passed to --patch-base. Can be used multiple times.')
 		parser.add_argument('-s', '--bs', type=int, default=20, help='Block Size for random read access 2^x while x between 14 and 32. Default: 20 => 1 MB')
 		parser.add_argument('-V', '--verify', action="store_true", default=False, help='Verifies files after compression raising an unhandled exception on hash mismatch and verify existing NSP and NSZ files when given as parameter. Requires --keep when used during compression.')
 		parser.add_argument('-Q', '--quick-verify', action="store_true", default=False, help='Same as --verify but skips the NSP SHA256 hash verification and only verifies NCA hashes. Does not require --keep when used during compression.')
@@ -20,11 +22,26 @@ class ParseArguments:
 		parser.add_argument('-P', '--alwaysParseCnmt', action="store_true", default=False, help='Always extract TitleId/Version from Cnmt and never trust filenames')
 		parser.add_argument('-t', '--threads', type=int, default=-1, help='Number of threads to compress with. Numbers < 1 corresponds to the number of logical CPU cores for block compression and 3 for solid compression')
 		parser.add_argument('-m', '--multi', type=int, default=4, help='Executes multiple compression tasks in parallel. Take a look at available RAM especially if compression level is over 18.')
+		parser.add_argument('--metrics-json', type=str, default=None, help='Writes progress of every compression task and events like finished NCAs as JSON lines to the specified file ("-" for stdout)')
+		parser.add_argument('--log-level', choices=['debug', 'verbose', 'info', 'warning', 'error'], default='verbose', help='Only print messages of this level or above. "info" hides the [OPEN  ] line printed for every file opened inside a container')
+		parser.add_argument('--profile', nargs='?', const='nsz-profile.json', default=None, help='Measures the time spent reading, decrypting, compressing, decompressing, encrypting, hashing and writing per NCA and worker. Prints a summary at the end and writes the full report as JSON to the specified file (default: nsz-profile.json)')
 		parser.add_argument('-o', '--output', nargs='?', help='Directory to save the output NSZ files')
+		parser.add_argument('--store', type=str, default=None, help='Content addressed store directory. Every file of the compressed output is stored there once and NCAs already compressed with the same settings for another file are copied from the store instead of being compressed again.')
+		parser.add_argument('--reuse', action='store_true', default=False, help='NCAs which appear in several input files of this run are only compressed once. Later files copy the NCZ out of the output file written first. Costs an extra pass over the CNMT of every input and output file.')
+		parser.add_argument('--store-thin', action='store_true', default=False, help='Used with --store: replaces every compressed file by a small .manifest referencing the store')
+		parser.add_argument('--header-cache', type=str, default=None, metavar='DIR', help='Directory caching the decrypted NCA headers of the opened files so following runs like --verify, --info or a repeated compression of the same files skip decrypting them again. Entries are keyed by NCA ID plus the path, size and modification time of the file containing it. Decrypted NCA keys are never written there.')
+		parser.add_argument('--materialize', action='store_true', default=False, help='Rebuilds the NSZ/XCZ files described by the given .manifest files (or directories containing them)')
+		parser.add_argument('--watch', type=str, default=None, metavar='DIR', help='Runs until interrupted and compresses every NSP/XCI which is copied into DIR as soon as its upload finished. Compression, output and --rm-old-version/--rm-source options apply to every file.')
+		parser.add_argument('--watch-settle', type=float, default=5.0, metavar='SECONDS', help='Used with --watch: a file counts as completely uploaded once its size did not change for this long. Default: 5')
+		parser.add_argument('--watch-poll', type=float, default=10.0, metavar='SECONDS', help='Used with --watch: directory polling interval if inotify is unavailable and interval of the queue/throughput status lines. Default: 10')
+		parser.add_argument('--serve', type=str, default=None, metavar='[HOST:]PORT', help='Serves the files inside the given NSZ/XCZ/NSP/XCI files or directories over HTTP with Range support. Block compressed NCZs are served as their original NCA. GET / lists the containers and /<container>/ its files.')
+		parser.add_argument('--mount', type=str, default=None, metavar='MOUNTPOINT', help='Mounts the given NSZ/XCZ files or directories read-only at MOUNTPOINT showing them as the NSP/XCI they decompress to. Requires fusepy. Files containing solid compressed NCZs are left out.')
+		parser.add_argument('--block-cache', type=int, default=64, metavar='BLOCKS', help='Used with --serve and --mount: number of decompressed blocks cached for all readers together. Default: 64')
 		parser.add_argument('-w', '--overwrite', action="store_true", default=False, help='Continues even if there already is a file with the same name or title id inside the output directory')
 		parser.add_argument('-r', '--rm-old-version', action="store_true", default=False, help='Removes older versions if found')
 		parser.add_argument('--rm-source', action='store_true', default=False, help="Deletes source file/s after compressing/decompressing. It's recommended to only use this in combination with --verify")
 		parser.add_argument('-i', '--info', action='store_true', default=False, help='Show info about title or file')
+		parser.add_argument('--json', action='store_true', default=False, help='With --info: print a JSON line per file containing its TitleID, version, content entries, sizes, key generation and compression mode. Only the CNMT is read which makes this fast enough to use on large collections.')
 		parser.add_argument('--depth', type=int, default=1, help='Max depth for file info and extraction')
 		parser.add_argument('-x', '--extract', action="store_true", help='Extract a NSP/XCI/NSZ/XCZ/NSPZ')
 		parser.add_argument('--extractregex', type=str, default="", help=r'Regex specifying which files inside the container should be extracted. Example: "^.*\.(cert|tik)$"')
@@ -39,5 +56,5 @@ class ParseArguments:
 		parser.add_argument('--undupe-old-versions',action="store_true", default=False, help='Removes every old version as long there is a newer one of the same titleID.')
 		parser.add_argument('-c', '--create', help='Inverse of --extract. Repacks files/folders to an NSP. Example: --create out.nsp .\\in')
 	
-		args = parser.parse_args()
+		args = parser.parse_args(argv)
 		return args
@@ -0,0 +1,206 @@
+from pathlib import Path
+from zstandard import ZstdCompressionDict, ZstdCompressionParameters, ZstdDecompressor, DICT_TYPE_RAWCONTENT
+from nsz.nut import Print
+from nsz.PathTools import *
+from nsz.SectionFs import sortedFs
+from nsz import Header, BlockDecompressorReader
+import math
+
+UNCOMPRESSABLE_HEADER_SIZE = 0x4000
+CHUNK_SZ = 0x1000000
+REFERENCE_MAGIC = b'NCZREFER'
+#Largest zstd window on 64-bit platforms
+MAX_WINDOW_LOG = 31
+#Bigger base NCAs can't be reached by the window and would only waste memory
+MAX_REFERENCE_SIZE = 2**MAX_WINDOW_LOG
+#Largest match finder hash table used for references (4 bytes per entry)
+MAX_HASH_LOG = 27
+PATCH_TYPE = 0x81
+
+#Set by enable(): BaseLibrary used to compress updates against their base title
+library = None
+
+def enable(paths):
+	global library
+	if library == None or library.paths != list(paths):
+		library = BaseLibrary(paths)
+
+def restore(index):
+	'''Uses the index() of the library built by the main process in a worker'''
+	global library
+	if library == None or library.index() != index:
+		library = BaseLibrary(index[0], index[1], index[2])
+
+def windowLog(compressionLevel, referenceSize, size):
+	'''zstd window needed to match the whole reference while compressing size bytes'''
+	levelWindowLog = ZstdCompressionParameters.from_level(compressionLevel).window_log
+	return min(MAX_WINDOW_LOG, max(levelWindowLog, math.ceil(math.log2(referenceSize + size))))
+
+def compressionParams(compressionLevel, referenceSize, size, threads):
+	'''Parameters to compress size bytes against a reference of referenceSize bytes.
+	zstd only indexes the part of a dictionary its hash table can hold so the
+	table is sized for the reference. Long distance matching is left off as it
+	doesn't see the dictionary and with threads it even stops zstd from using it.'''
+	levelParams = ZstdCompressionParameters.from_level(compressionLevel)
+	hashLog = max(levelParams.hash_log, min(MAX_HASH_LOG, math.ceil(math.log2(referenceSize + size)) - 1))
+	return ZstdCompressionParameters.from_level(compressionLevel, threads=threads if threads > 1 else 0, window_log=windowLog(compressionLevel, referenceSize, size), hash_log=hashLog)
+
+def cnmtOf(container):
+	from nsz.Fs import Nca, Pfs0, Type
+	for nspf in container:
+		if isinstance(nspf, Nca.Nca) and nspf.header.contentType == Type.Content.META:
+			for section in nspf:
+				if isinstance(section, Pfs0.Pfs0):
+					return section.getCnmt()
+	return None
+
+def decryptedData(nspf):
+	'''The data an NCZ stores compressed: the decrypted NCA after its header'''
+	from nsz.Fs import Type
+	if nspf._path.endswith('.ncz'):
+		return decompressedNcz(nspf)
+	sections = []
+	for fs in sortedFs(nspf):
+		sections += fs.getEncryptionSections()
+	offsetFirstSection = sortedFs(nspf)[0].offset
+	partitions = []
+	if offsetFirstSection-UNCOMPRESSABLE_HEADER_SIZE > 0:
+		partitions.append(nspf.partition(offset = UNCOMPRESSABLE_HEADER_SIZE, size = offsetFirstSection-UNCOMPRESSABLE_HEADER_SIZE, cryptoType = Type.Crypto.CTR.NONE, autoOpen = True))
+	for section in sections:
+		partitions.append(nspf.partition(offset = section.offset, size = section.size, cryptoType = section.cryptoType, cryptoKey = section.cryptoKey, cryptoCounter = bytearray(section.cryptoCounter), autoOpen = True))
+	if UNCOMPRESSABLE_HEADER_SIZE-offsetFirstSection > 0:
+		partitions[0].seek(UNCOMPRESSABLE_HEADER_SIZE-offsetFirstSection)
+	#Appended in place as joining chunks would need twice the size of the NCA
+	data = bytearray()
+	for partition in partitions:
+		while True:
+			buffer = partition.read(CHUNK_SZ)
+			if len(buffer) == 0:
+				break
+			data += buffer
+		partition.close()
+	return data
+
+def decompressedNcz(nspf):
+	nspf.seek(UNCOMPRESSABLE_HEADER_SIZE)
+	if nspf.read(8) != b'NCZSECTN':
+		raise ValueError("No NCZSECTN found! Is this really a .ncz file?")
+	sectionCount = nspf.readInt64()
+	for _ in range(sectionCount):
+		Header.Section(nspf)
+	pos = nspf.tell()
+	magic = nspf.read(8)
+	nspf.seek(pos)
+	if magic == REFERENCE_MAGIC:
+		raise ValueError('{0} is itself compressed against a base and can\'t be used as one'.format(nspf._path))
+	if magic == b'NCZBLOCK':
+		blockHeader = Header.Block(nspf)
+		return BlockDecompressorReader.BlockDecompressorReader(nspf, blockHeader).read(blockHeader.decompressedSize)
+	data = bytearray()
+	reader = ZstdDecompressor().stream_reader(nspf)
+	while True:
+		buffer = reader.read(CHUNK_SZ)
+		if len(buffer) == 0:
+			break
+		data += buffer
+	return data
+
+class BaseLibrary:
+	'''Index of the NSP/NSZ/XCI/XCZ files given with --patch-base by title ID
+	and by the SHA-256 of their NCAs. The decrypted NCA of a base title is used
+	as zstd dictionary to compress the matching NCA of an update, which then
+	can only be decompressed if the same base is in the library.'''
+
+	def __init__(self, paths, titles = None, contents = None):
+		self.paths = list(paths)
+		#{title ID: (container path, [(NCA ID, content type, SHA-256, size)])}
+		self.titles = titles if titles != None else {}
+		#{SHA-256: (container path, NCA ID)}
+		self.contents = contents if contents != None else {}
+		#Only the last reference is kept since it can be as big as the NCA
+		self.loaded = (None, None, 0)
+		if titles == None:
+			self.scan()
+
+	def scan(self):
+		from nsz.Fs.File import File
+		from nsz.TitleInfo import openCnmt
+		for path in self.paths:
+			for filePath in expandFiles(Path(path)):
+				if not filePath.is_file() or not isGame(filePath):
+					continue
+				#Only the file table and the CNMT NCA are read
+				try:
+					f = File(str(filePath), 'rb')
+					try:
+						entries, nca, cnmt = openCnmt(f, filePath)
+					finally:
+						f.close()
+				except BaseException as e:
+					Print.warning('[PATCH BASE] Skipped {0}: {1}'.format(filePath.name, e))
+					continue
+				contentEntries = [(entry.ncaId, entry.type, entry.hash.hex(), entry.size) for entry in cnmt.contentEntries]
+				self.titles[cnmt.titleId.upper()] = (str(filePath), contentEntries)
+				for ncaId, type, hash, size in contentEntries:
+					self.contents[hash] = (str(filePath), ncaId)
+		Print.info('[PATCH BASE] {0} titles indexed'.format(len(self.titles)))
+
+	def index(self):
+		'''Everything but the loaded reference to hand the library to worker processes'''
+		return (self.paths, self.titles, self.contents)
+
+	def load(self, hash):
+		'''Returns (zstd dictionary, size) of the decrypted NCA with the given SHA-256'''
+		from nsz.Fs.File import File
+		from nsz.Fs import Nca
+		from nsz.TitleInfo import containerEntries, secureEntries
+		if self.loaded[0] == hash:
+			return self.loaded[1:]
+		#The previous reference is released before the next one is read
+		self.loaded = (None, None, 0)
+		filePath, ncaId = self.contents[hash]
+		f = File(filePath, 'rb')
+		try:
+			entries = secureEntries(f) if isXciXcz(Path(filePath)) else containerEntries(f, 0x0)
+			name, offset, size = next(entry for entry in entries if entry[0].split('.')[0] == ncaId)
+			nspf = Nca.Nca() if name.endswith('.nca') else File()
+			nspf._path = name
+			nspf = f.partition(offset, size, nspf)
+			Print.info('[PATCH BASE] Loading {0} from {1}'.format(name, Path(filePath).name))
+			data = decryptedData(nspf)
+		finally:
+			f.close()
+		self.loaded = (hash, ZstdCompressionDict(data, dict_type=DICT_TYPE_RAWCONTENT), len(data))
+		return self.loaded[1:]
+
+	def referenceFor(self, container, nspf):
+		'''Returns (SHA-256 of the base NCA, dictionary, size) to compress nspf of the
+		update container with or None. NCAs are matched by their content type
+		and their position among the NCAs of that type.'''
+		cnmt = cnmtOf(container)
+		if cnmt == None or cnmt.titleType != PATCH_TYPE:
+			return None
+		ncaId = nspf._path.split('.')[0]
+		entry = next((entry for entry in cnmt.contentEntries if entry.ncaId == ncaId), None)
+		base = self.titles.get(cnmt.titleId.upper()[:-3] + '000')
+		if entry == None or base == None:
+			return None
+		sameType = [e for e in cnmt.contentEntries if e.type == entry.type]
+		baseSameType = [e for e in base[1] if e[1] == entry.type]
+		index = sameType.index(entry)
+		if index >= len(baseSameType):
+			return None
+		baseNcaId, type, hash, size = baseSameType[index]
+		if size - UNCOMPRESSABLE_HEADER_SIZE > MAX_REFERENCE_SIZE:
+			Print.warning('[PATCH BASE] Base NCA {0} is larger than the zstd window, {1} is compressed without it'.format(baseNcaId, nspf._path))
+			return None
+		return (hash,) + self.load(hash)
+
+def reference(hash, size):
+	'''Returns the dictionary an NCZ with a NCZREFER header was compressed with'''
+	if library == None or not hash in library.contents:
+		raise IOError('Base NCA {0} is required to decompress this update. Use --patch-base with the directory containing the base title.'.format(hash))
+	result, resultSize = library.load(hash)
+	if resultSize != size:
+		raise IOError('Base NCA {0} has {1} bytes instead of {2}'.format(hash, resultSize, size))
+	return result
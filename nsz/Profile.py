@@ -0,0 +1,119 @@
+from time import perf_counter
+from nsz.nut import Print
+import json
+
+STAGES = ['read', 'decrypt', 'compress', 'decompress', 'encrypt', 'hash', 'write', 'wait']
+
+enabled = False
+worker = 'main'
+currentNca = None
+#(worker, nca, stage) => [seconds, bytes]
+records = {}
+#Sum of all time recorded so far. Used to make nested measurements exclusive
+#so the time spent decrypting inside a read is only counted as decrypt.
+accounted = 0.0
+
+def enable(workerName = None):
+	global enabled, worker
+	enabled = True
+	if workerName != None:
+		worker = workerName
+		#A forked worker inherits the records of the main process
+		records.clear()
+
+def setNca(name):
+	global currentNca
+	currentNca = name
+
+def start():
+	if not enabled:
+		return None
+	return (perf_counter(), accounted)
+
+def stop(stage, token, size = 0):
+	global accounted
+	if token == None:
+		return
+	startTime, accountedAtStart = token
+	exclusive = perf_counter() - startTime - (accounted - accountedAtStart)
+	accounted += exclusive
+	record = records.setdefault((worker, currentNca, stage), [0.0, 0])
+	record[0] += exclusive
+	record[1] += size
+
+def take():
+	global records
+	taken = records
+	records = {}
+	return taken
+
+def merge(otherRecords):
+	for (otherWorker, nca, stage), (seconds, size) in otherRecords.items():
+		record = records.setdefault((otherWorker, nca or currentNca, stage), [0.0, 0])
+		record[0] += seconds
+		record[1] += size
+
+class ProfiledWriter:
+	'''Accounts the time spent in write() of the wrapped file to the write stage.
+	Used where the writes are done by zstandard instead of our own code.'''
+
+	def __init__(self, f):
+		self.f = f
+
+	def write(self, data):
+		token = start()
+		written = self.f.write(data)
+		stop('write', token, len(data))
+		return written
+
+	def __getattr__(self, name):
+		return getattr(self.f, name)
+
+def wrapWriter(f):
+	return ProfiledWriter(f) if enabled else f
+
+def __sum(keyIndex):
+	sums = {}
+	for key, (seconds, size) in records.items():
+		entry = sums.setdefault(key[keyIndex], {}).setdefault(key[2], [0.0, 0])
+		entry[0] += seconds
+		entry[1] += size
+	return sums
+
+def report():
+	stages = {}
+	for (w, nca, stage), (seconds, size) in records.items():
+		entry = stages.setdefault(stage, [0.0, 0])
+		entry[0] += seconds
+		entry[1] += size
+	def toDict(values):
+		return {stage: {'seconds': round(seconds, 6), 'bytes': size} for stage, (seconds, size) in values.items()}
+	return {
+		'stages': toDict(stages),
+		'workers': {w: toDict(values) for w, values in __sum(0).items()},
+		#Anything measured before the first NCA (parsing the container) is listed as other
+		'ncas': {nca if nca != None else 'other': toDict(values) for nca, values in __sum(1).items()}
+	}
+
+def printSummary(profileReport):
+	Print.info('')
+	Print.info('Profile         seconds        MiB      MiB/s   share')
+	stages = profileReport['stages']
+	total = sum(entry['seconds'] for entry in stages.values())
+	for stage in STAGES:
+		if not stage in stages:
+			continue
+		seconds = stages[stage]['seconds']
+		mib = stages[stage]['bytes'] / 1048576
+		rate = mib / seconds if seconds > 0 else 0.0
+		share = seconds * 100 / total if total > 0 else 0.0
+		Print.info('{0:<12} {1:>10.3f} {2:>10.1f} {3:>10.1f} {4:>6.1f}%'.format(stage, seconds, mib, rate, share))
+	Print.info('')
+	for w in sorted(profileReport['workers']):
+		busy = ['{0} {1:.3f}s'.format(stage, entry['seconds']) for stage, entry in profileReport['workers'][w].items()]
+		Print.info('{0:<12} {1}'.format(w, ', '.join(busy)))
+
+def writeReport(profileReport, path):
+	with open(path, 'w', encoding='utf-8') as f:
+		json.dump(profileReport, f, indent=2)
+	Print.info('Profile written to {0}'.format(path))
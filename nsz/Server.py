@@ -0,0 +1,202 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote
+from threading import Lock
+from pathlib import Path
+from nsz.nut import Print
+from nsz.PathTools import *
+from nsz.BlockDecompressorReader import BlockCache
+from nsz.NczReader import NczReader
+import json
+import re
+
+CHUNK_SZ = 0x100000
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class ServedFile:
+	'''A file inside a container as it is served. Block compressed NCZs are
+	served as their original NCA, everything else as it is stored.'''
+
+	def __init__(self, nspf, cache, cacheKey):
+		self.nspf = nspf
+		self.reader = None
+		self.name = nspf._path
+		self.size = nspf.size
+		if nspf._path.endswith('.ncz'):
+			try:
+				self.reader = NczReader(nspf, cache, cacheKey)
+				self.name = nspf._path[:-1] + 'a'
+				self.size = self.reader.size
+			except ValueError:
+				pass
+
+	def read(self, offset, length):
+		if self.reader != None:
+			self.reader.seek(offset)
+			return self.reader.read(length)
+		self.nspf.seek(offset)
+		return self.nspf.read(length)
+
+class OpenContainer:
+	def __init__(self, filePath, cache):
+		from nsz.Fs import factory
+		self.container = factory(filePath)
+		self.container.open(str(filePath), 'rb')
+		if hasattr(self.container, 'hfs0'):
+			files = [nspf for partition in self.container.hfs0 for nspf in partition]
+		else:
+			files = list(self.container)
+		self.files = {}
+		for nspf in files:
+			served = ServedFile(nspf, cache, (str(filePath), nspf._path))
+			self.files[served.name] = served
+
+	def close(self):
+		self.container.close()
+
+class Library:
+	'''The served containers. Open containers are pooled so concurrent
+	requests never share a file position and repeated requests don't parse
+	the container again. All readers share one block cache.'''
+
+	def __init__(self, paths, cacheBlocks = 64, maxIdle = 4):
+		self.cache = BlockCache(cacheBlocks)
+		self.maxIdle = maxIdle
+		self.containers = {}
+		for path in paths:
+			for filePath in expandFiles(Path(path)):
+				if not filePath.is_file() or not (isCompressedGame(filePath) or isUncompressedGame(filePath)):
+					continue
+				#Containers are served by file name so the first one of a name wins like with --mount
+				if filePath.name in self.containers:
+					Print.warning('[SKIPPED]    {0}: {1} is already served'.format(filePath, self.containers[filePath.name]))
+					continue
+				self.containers[filePath.name] = filePath
+		self.idle = {}
+		self.lock = Lock()
+
+	def acquire(self, name):
+		filePath = self.containers[name]
+		with self.lock:
+			idle = self.idle.get(name)
+			if idle:
+				return idle.pop()
+		return OpenContainer(filePath, self.cache)
+
+	def release(self, name, container):
+		with self.lock:
+			idle = self.idle.setdefault(name, [])
+			if len(idle) < self.maxIdle:
+				idle.append(container)
+				return
+		container.close()
+
+	def close(self):
+		with self.lock:
+			for idle in self.idle.values():
+				for container in idle:
+					container.close()
+			self.idle = {}
+
+def parseRange(header, size):
+	'''Returns (start, end) with end exclusive, None for the whole file or
+	raises ValueError if the range can't be satisfied'''
+	if header == None:
+		return None
+	match = RANGE_PATTERN.match(header.strip())
+	if match == None:
+		#Multiple ranges aren't supported, answering with the whole file is allowed
+		return None
+	first, last = match.groups()
+	if first == '' and last == '':
+		raise ValueError(header)
+	if first == '':
+		start, end = max(0, size - int(last)), size
+	else:
+		start, end = int(first), size if last == '' else min(size, int(last) + 1)
+	if start >= end:
+		raise ValueError(header)
+	return (start, end)
+
+class RequestHandler(BaseHTTPRequestHandler):
+	library = None
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, format, *args):
+		Print.debug('[HTTP]       {0} {1}'.format(self.address_string(), format % args))
+
+	def sendJson(self, value):
+		body = json.dumps(value, indent=1).encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		if self.command != 'HEAD':
+			self.wfile.write(body)
+
+	def do_HEAD(self):
+		self.do_GET()
+
+	def do_GET(self):
+		parts = [unquote(part) for part in self.path.split('?')[0].split('/') if part != '']
+		if len(parts) == 0:
+			self.sendJson([{'name': name, 'url': '/' + quote(name) + '/'} for name in sorted(self.library.containers)])
+			return
+		if not parts[0] in self.library.containers or len(parts) > 2:
+			self.send_error(404)
+			return
+		container = self.library.acquire(parts[0])
+		try:
+			if len(parts) == 1:
+				self.sendJson([{'name': f.name, 'size': f.size, 'url': '/' + quote(parts[0]) + '/' + quote(f.name)} for f in container.files.values()])
+				return
+			served = container.files.get(parts[1])
+			if served == None:
+				self.send_error(404)
+				return
+			self.sendFile(served)
+		finally:
+			self.library.release(parts[0], container)
+
+	def sendFile(self, served):
+		try:
+			requested = parseRange(self.headers.get('Range'), served.size)
+		except ValueError:
+			self.send_response(416)
+			self.send_header('Content-Range', 'bytes */{0}'.format(served.size))
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		start, end = requested if requested != None else (0, served.size)
+		self.send_response(206 if requested != None else 200)
+		self.send_header('Content-Type', 'application/octet-stream')
+		self.send_header('Accept-Ranges', 'bytes')
+		self.send_header('Content-Length', str(end - start))
+		if requested != None:
+			self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end - 1, served.size))
+		self.end_headers()
+		if self.command == 'HEAD':
+			return
+		pos = start
+		while pos < end:
+			buffer = served.read(pos, min(CHUNK_SZ, end - pos))
+			if len(buffer) == 0:
+				raise IOError('Unexpected end of {0}'.format(served.name))
+			self.wfile.write(buffer)
+			pos += len(buffer)
+
+def serve(paths, address, cacheBlocks = 64):
+	'''Serves the files inside the NSZ/XCZ/NSP/XCI files in paths over HTTP
+	until interrupted. address is [host:]port.'''
+	host, _, port = address.rpartition(':')
+	library = Library(paths, cacheBlocks)
+	handler = type('Handler', (RequestHandler,), {'library': library})
+	server = ThreadingHTTPServer((host or '0.0.0.0', int(port)), handler)
+	server.daemon_threads = True
+	Print.info('[SERVE]      {0} containers on http://{1}:{2}/'.format(len(library.containers), host or '0.0.0.0', port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		library.close()
@@ -6,30 +6,42 @@ from nsz.SectionFs import isNcaPacked, sortedFs
 from nsz.Fs import factory, Ticket, Pfs0, Hfs0, Nca, Type, Xci
 from zstandard import FLUSH_FRAME, COMPRESSOBJ_FLUSH_FINISH, ZstdCompressionParameters, ZstdCompressor
 from nsz.PathTools import *
+from nsz import Profile, PatchBase
+from nsz.ContentStore import contentHashes, contentHash, solidParams
 
 UNCOMPRESSABLE_HEADER_SIZE = 0x4000
 CHUNK_SZ = 0x1000000
 
 
-def solidCompress(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, statusReport, id, pleaseNoPrint):
+def solidCompress(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, metrics, id, store = None, frameSizeExponent = None):
 	if filePath.suffix == '.nsp':
-		return solidCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, statusReport, id, pleaseNoPrint)
+		return solidCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, metrics, id, store, frameSizeExponent)
 	elif filePath.suffix == '.xci':
-		return solidCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, statusReport, id, pleaseNoPrint)
+		return solidCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, metrics, id, store, frameSizeExponent)
 		
-def processContainer(readContainer, writeContainer, compressionLevel, keep, useLongDistanceMode, threads, statusReport, id, pleaseNoPrint):
+def processContainer(readContainer, writeContainer, compressionLevel, keep, useLongDistanceMode, threads, metrics, id, store = None, frameSizeExponent = None):
+	if store != None:
+		hashes = contentHashes(readContainer)
+		storeParams = solidParams(compressionLevel, useLongDistanceMode, threads, frameSizeExponent, PatchBase.library != None)
+	if frameSizeExponent != None and (frameSizeExponent < 14 or frameSizeExponent > 32):
+		raise ValueError("Frame size must be between 14 and 32")
 	for nspf in readContainer:
 		if not keep:
 			if isinstance(nspf, Nca.Nca) and nspf.header.contentType == Type.Content.DATA:
-				Print.info('[SKIPPED]    Delta fragment {0}'.format(nspf._path), pleaseNoPrint)
+				Print.info('[SKIPPED]    Delta fragment {0}'.format(nspf._path))
 				continue
 		if isinstance(nspf, Nca.Nca) and (nspf.header.contentType == Type.Content.PROGRAM or nspf.header.contentType == Type.Content.PUBLICDATA) and nspf.size > UNCOMPRESSABLE_HEADER_SIZE:
 			if isNcaPacked(nspf):
 				
 				offsetFirstSection = sortedFs(nspf)[0].offset
 				newFileName = nspf._path[0:-1] + 'z'
+				stored = store.lookup(contentHash(hashes, nspf._path), storeParams) if store != None else None
+				if stored != None:
+					store.writeStored(stored, writeContainer, newFileName).close()
+					continue
+				Profile.setNca(nspf._path)
 		
-				with writeContainer.add(newFileName, nspf.size, pleaseNoPrint) as f:
+				with writeContainer.add(newFileName, nspf.size) as f:
 					start = f.tell()
 		
 					nspf.seek(0)
@@ -57,80 +69,128 @@ def processContainer(readContainer, writeContainer, compressionLevel, keep, useL
 			
 					f.write(header)
 		
-					blockID = 0
-					chunkRelativeBlockID = 0
-					startChunkBlockID = 0
+					reference = None
+					if PatchBase.library != None and frameSizeExponent == None:
+						reference = PatchBase.library.referenceFor(readContainer, nspf)
+					if reference != None:
+						referenceHash, dictionary, referenceSize = reference
+						Print.info('[NCZREFER]   Compressing {0} against base NCA {1}'.format(nspf._path, referenceHash))
+						f.write(PatchBase.REFERENCE_MAGIC + bytes.fromhex(referenceHash) + referenceSize.to_bytes(8, 'little'))
+		
 					blocksHeaderFilePos = f.tell()
-					compressedblockSizeList = []
+					readSize = CHUNK_SZ
+					frameSizeList = None
+					if frameSizeExponent != None:
+						#Independent frames listed in an NCZBLOCK header so the NCZ can be read like a block compressed one
+						readSize = 2**frameSizeExponent
+						bytesToCompress = nspf.size - UNCOMPRESSABLE_HEADER_SIZE
+						framesToCompress = bytesToCompress//readSize + (bytesToCompress%readSize > 0)
+						frameSizeList = []
+						header = b'NCZBLOCK' #Magic
+						header += b'\x02' #Version
+						header += b'\x01' #Type
+						header += b'\x00' #Unused
+						header += frameSizeExponent.to_bytes(1, 'little') #blockSizeExponent in bits: 2^x
+						header += framesToCompress.to_bytes(4, 'little') #Amount of Blocks
+						header += bytesToCompress.to_bytes(8, 'little') #Decompressed Size
+						header += b'\x00' * (framesToCompress*4)
+						f.write(header)
 		
 					decompressedBytes = UNCOMPRESSABLE_HEADER_SIZE
 					
 					
-					statusReport[id] = [0, 0, nspf.size, 'Compressing']
+					metrics.update(id, 0, 0, nspf.size, 'Compressing')
 					
 					partitions = []
 					if offsetFirstSection-UNCOMPRESSABLE_HEADER_SIZE > 0:
 						partitions.append(nspf.partition(offset = UNCOMPRESSABLE_HEADER_SIZE, size = offsetFirstSection-UNCOMPRESSABLE_HEADER_SIZE, cryptoType = Type.Crypto.CTR.NONE, autoOpen = True))
 					for section in sections:
-						#Print.info('offset: %x\t\tsize: %x\t\ttype: %d\t\tiv%s' % (section.offset, section.size, section.cryptoType, str(hx(section.cryptoCounter))), pleaseNoPrint)
+						#Print.info('offset: %x\t\tsize: %x\t\ttype: %d\t\tiv%s' % (section.offset, section.size, section.cryptoType, str(hx(section.cryptoCounter))))
 						partitions.append(nspf.partition(offset = section.offset, size = section.size, cryptoType = section.cryptoType, cryptoKey = section.cryptoKey, cryptoCounter = bytearray(section.cryptoCounter), autoOpen = True))
 					if UNCOMPRESSABLE_HEADER_SIZE-offsetFirstSection > 0:
 						partitions[0].seek(UNCOMPRESSABLE_HEADER_SIZE-offsetFirstSection)
 					
 					partNr = 0
-					statusReport[id] = [nspf.tell(), f.tell(), nspf.size, 'Compressing']
-					if threads > 1:
+					metrics.update(id, nspf.tell(), f.tell(), nspf.size, 'Compressing')
+					if reference != None:
+						#The window has to reach back over the whole base NCA for matches against it to be found
+						params = PatchBase.compressionParams(compressionLevel, referenceSize, nspf.size, threads)
+						cctx = ZstdCompressor(dict_data=dictionary, compression_params=params)
+					elif threads > 1:
 						params = ZstdCompressionParameters.from_level(compressionLevel, enable_ldm=useLongDistanceMode, threads=threads)
 						cctx = ZstdCompressor(compression_params=params)
 					else:
 						params = ZstdCompressionParameters.from_level(compressionLevel, enable_ldm=useLongDistanceMode)
 						cctx = ZstdCompressor(compression_params=params)
-					compressor = cctx.stream_writer(f)
+					compressor = cctx.stream_writer(Profile.wrapWriter(f)) if frameSizeList == None else None
 					while True:
 			
-						buffer = partitions[partNr].read(CHUNK_SZ)
-						while (len(buffer) < CHUNK_SZ and partNr < len(partitions)-1):
+						token = Profile.start()
+						buffer = partitions[partNr].read(readSize)
+						while (len(buffer) < readSize and partNr < len(partitions)-1):
 							partitions[partNr].close()
 							partitions[partNr] = None
 							partNr += 1
-							buffer += partitions[partNr].read(CHUNK_SZ - len(buffer))
+							buffer += partitions[partNr].read(readSize - len(buffer))
+						Profile.stop('read', token, len(buffer))
 						if len(buffer) == 0:
 							break
-						compressor.write(buffer)
+						token = Profile.start()
+						if frameSizeList != None:
+							frame = cctx.compress(buffer)
+							if len(frame) >= len(buffer):
+								frame = buffer
+							Profile.stop('compress', token, len(buffer))
+							token = Profile.start()
+							f.write(frame)
+							frameSizeList.append(len(frame))
+							Profile.stop('write', token, len(frame))
+						else:
+							compressor.write(buffer)
+							Profile.stop('compress', token, len(buffer))
 				
 						decompressedBytes += len(buffer)
-						statusReport[id] = [nspf.tell(), f.tell(), nspf.size, 'Compressing']
+						metrics.update(id, nspf.tell(), f.tell(), nspf.size, 'Compressing')
 					partitions[partNr].close()
 					partitions[partNr] = None
 		
-					compressor.flush(FLUSH_FRAME)
-					statusReport[id] = [nspf.tell(), f.tell(), nspf.size, 'Compressing']
+					if frameSizeList != None:
+						endPos = f.tell()
+						f.seek(blocksHeaderFilePos + 24)
+						f.write(b''.join(frameSize.to_bytes(4, 'little') for frameSize in frameSizeList))
+						f.seek(endPos)
+					else:
+						token = Profile.start()
+						compressor.flush(FLUSH_FRAME)
+						Profile.stop('compress', token)
+					metrics.update(id, nspf.tell(), f.tell(), nspf.size, 'Compressing')
 		
 					written = f.tell() - start
-					Print.info('Compressed {0}% {1} -> {2}  - {3}'.format(written * 100 / nspf.size, decompressedBytes, written, nspf._path), pleaseNoPrint)
+					Print.info('Compressed {0}% {1} -> {2}  - {3}'.format(written * 100 / nspf.size, decompressedBytes, written, nspf._path))
+					metrics.event('nca', slot=id, nca=nspf._path, mode='solid', read=decompressedBytes, written=written)
 					writeContainer.resize(newFileName, written)
 					continue
 			else:
 				Print.info('Skipping not packed {0}'.format(nspf._path))
 
-		with writeContainer.add(nspf._path, nspf.size, pleaseNoPrint) as f:
+		with writeContainer.add(nspf._path, nspf.size) as f:
 			nspf.seek(0)
 			while not nspf.eof():
 				buffer = nspf.read(CHUNK_SZ)
 				f.write(buffer)
 
 
-def solidCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, statusReport, id, pleaseNoPrint):
+def solidCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, metrics, id, store = None, frameSizeExponent = None):
 	filePath = filePath.resolve()
 	container = factory(filePath)
 	container.open(str(filePath), 'rb')
 	nszPath = outputDir.joinpath(filePath.stem + '.nsz')
 
-	Print.info(f'Solid compressing (level {compressionLevel}{" ldm" if useLongDistanceMode else ""}) {filePath} -> {nszPath}', pleaseNoPrint)
+	Print.info(f'Solid compressing (level {compressionLevel}{" ldm" if useLongDistanceMode else ""}) {filePath} -> {nszPath}')
 	
 	try:
 		with Pfs0.Pfs0Stream(container.getPaddedHeaderSize() if fixPadding else container.getFirstFileOffset(), None if fixPadding else container.getStringTableSize(), str(nszPath)) as nsp:
-			processContainer(container, nsp, compressionLevel, keep, useLongDistanceMode, threads, statusReport, id, pleaseNoPrint)
+			processContainer(container, nsp, compressionLevel, keep, useLongDistanceMode, threads, metrics, id, store, frameSizeExponent)
 	except BaseException as ex:
 		if not ex is KeyboardInterrupt:
 			Print.error(format_exc())
@@ -143,22 +203,22 @@ def solidCompressNsp(filePath, compressionLevel, keep, fixPadding, useLongDistan
 def allign0x200(n):
 	return 0x200-n%0x200	
 
-def solidCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, statusReport, id, pleaseNoPrint):
+def solidCompressXci(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threads, metrics, id, store = None, frameSizeExponent = None):
 	filePath = filePath.resolve()
 	container = factory(filePath)
 	container.open(str(filePath), 'rb')
 	xczPath = outputDir.joinpath(filePath.stem + '.xcz')
 
-	Print.info(f'Solid compressing (level {compressionLevel}{" ldm" if useLongDistanceMode else ""}) {filePath} -> {xczPath}', pleaseNoPrint)
+	Print.info(f'Solid compressing (level {compressionLevel}{" ldm" if useLongDistanceMode else ""}) {filePath} -> {xczPath}')
 	
 	try:
 		with Xci.XciStream(str(xczPath), originalXciPath = filePath) as xci: # need filepath to copy XCI container settings
 			for partitionIn in container.hfs0:
 				xci.hfs0.written = False
-				hfsPartitionOut = xci.hfs0.add(partitionIn._path, 0, pleaseNoPrint)
+				hfsPartitionOut = xci.hfs0.add(partitionIn._path, 0)
 				with Hfs0.Hfs0Stream(hfsPartitionOut, xci.f) as partitionOut:
 					if keep == True or partitionIn._path == 'secure':
-						processContainer(partitionIn, partitionOut, compressionLevel, keep, useLongDistanceMode, threads, statusReport, id, pleaseNoPrint)
+						processContainer(partitionIn, partitionOut, compressionLevel, keep, useLongDistanceMode, threads, metrics, id, store, frameSizeExponent)
 					alignedSize = partitionOut.actualSize + allign0x200(partitionOut.actualSize)
 					xci.hfs0.resize(partitionIn._path, alignedSize)
 					print(f'[RESIZE]     {partitionIn._path} to {hex(alignedSize)}')
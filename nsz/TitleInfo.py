@@ -0,0 +1,139 @@
+from pathlib import Path
+from nsz.Fs.File import File
+from nsz.nut import Print
+from nsz.PathTools import *
+import os
+
+UNCOMPRESSABLE_HEADER_SIZE = 0x4000
+
+TITLE_TYPES = {0x01: 'SystemProgram', 0x02: 'SystemData', 0x03: 'SystemUpdate', 0x04: 'BootImagePackage', 0x05: 'BootImagePackageSafe', 0x80: 'Application', 0x81: 'Patch', 0x82: 'AddOnContent', 0x83: 'Delta', 0x84: 'DataPatch'}
+CONTENT_TYPES = {0: 'Meta', 1: 'Program', 2: 'Data', 3: 'Control', 4: 'HtmlDocument', 5: 'LegalInformation', 6: 'DeltaFragment'}
+
+def readInt(f, size):
+	return int.from_bytes(f.read(size), byteorder='little')
+
+def containerEntries(f, offset):
+	'''Returns the [(name, absolute offset, size)] of the PFS0 or HFS0 at offset
+	by reading only its file table'''
+	f.seek(offset)
+	magic = f.read(4)
+	if magic == b'PFS0':
+		entrySize = 0x18
+	elif magic == b'HFS0':
+		entrySize = 0x40
+	else:
+		raise IOError('No PFS0/HFS0 found at {0}'.format(hex(offset)))
+	fileCount = readInt(f, 4)
+	stringTableSize = readInt(f, 4)
+	f.read(4) # junk data
+	table = f.read(fileCount * entrySize)
+	stringTable = f.read(stringTableSize)
+	headerSize = 0x10 + fileCount * entrySize + stringTableSize
+	entries = []
+	for i in range(fileCount):
+		entry = table[i * entrySize:(i + 1) * entrySize]
+		entryOffset = int.from_bytes(entry[0x0:0x8], byteorder='little')
+		size = int.from_bytes(entry[0x8:0x10], byteorder='little')
+		nameOffset = int.from_bytes(entry[0x10:0x14], byteorder='little')
+		name = stringTable[nameOffset:].split(b'\0')[0].decode('utf-8')
+		entries.append((name, offset + headerSize + entryOffset, size))
+	return entries
+
+def secureEntries(f):
+	'''File table of the secure partition of an XCI/XCZ'''
+	f.seek(0x100)
+	headerOffset = 0x0 if f.read(4) == b'HEAD' else 0x1000
+	f.seek(headerOffset + 0x130)
+	hfs0Offset = readInt(f, 8) + headerOffset
+	for name, offset, size in containerEntries(f, hfs0Offset):
+		if name == 'secure':
+			return containerEntries(f, offset)
+	raise IOError('No secure partition found')
+
+def compressionOf(f, offset, name):
+	'''Compression mode of the NCZ at offset. NCZs with independent frames
+	(--seekable) share the NCZBLOCK header and are reported as block.'''
+	if not name.endswith('.ncz'):
+		return None
+	f.seek(offset + UNCOMPRESSABLE_HEADER_SIZE)
+	if f.read(8) != b'NCZSECTN':
+		raise IOError('No NCZSECTN found in {0}'.format(name))
+	sectionCount = readInt(f, 8)
+	f.seek(offset + UNCOMPRESSABLE_HEADER_SIZE + 0x10 + sectionCount * 0x40)
+	magic = f.read(8)
+	if magic == b'NCZBLOCK':
+		return 'block'
+	if magic == b'NCZREFER':
+		return 'patch'
+	return 'solid'
+
+def readCnmt(f, entries):
+	'''Opens only the META NCA of entries and returns (Nca, Cnmt). The NCA
+	named *.cnmt.nca is tried first, the others only if none of those has
+	the META content type.'''
+	from nsz.Fs import Nca, Pfs0, Type
+	ncas = [entry for entry in entries if entry[0].endswith('.nca')]
+	ncas.sort(key = lambda entry: not entry[0].endswith('.cnmt.nca'))
+	for name, offset, size in ncas:
+		nca = Nca.Nca()
+		nca._path = name
+		nca = f.partition(offset, size, nca)
+		if nca.header.contentType != Type.Content.META:
+			continue
+		for section in nca:
+			if isinstance(section, Pfs0.Pfs0):
+				return (nca, section.getCnmt())
+	raise IOError('No CNMT found')
+
+def openCnmt(f, filePath):
+	'''Returns (file table, CNMT Nca, Cnmt) of the container at filePath opened as f'''
+	entries = secureEntries(f) if isXciXcz(filePath) else containerEntries(f, 0x0)
+	nca, cnmt = readCnmt(f, entries)
+	return (entries, nca, cnmt)
+
+def cnmtSummary(filePath):
+	'''Returns (TitleID, version, set of the SHA-256 of every content) of the
+	NSP/NSZ/XCI/XCZ at filePath reading only its file table and CNMT NCA'''
+	f = File(str(filePath), 'rb')
+	try:
+		entries, nca, cnmt = openCnmt(f, Path(filePath))
+		return (cnmt.titleId.upper(), cnmt.version, set(entry.hash.hex() for entry in cnmt.contentEntries))
+	finally:
+		f.close()
+
+def titleInfo(filePath):
+	'''Metadata of the NSP/NSZ/XCI/XCZ at filePath read from its CNMT without
+	opening any other NCA. Returns a dict which can be serialized as JSON.'''
+	filePath = Path(filePath).resolve()
+	f = File(str(filePath), 'rb')
+	try:
+		entries, nca, cnmt = openCnmt(f, filePath)
+		stored = {name.split('.')[0]: (name, offset, size) for name, offset, size in entries}
+		contents = []
+		compressions = set()
+		for entry in cnmt.contentEntries:
+			content = {'ncaId': entry.ncaId, 'type': CONTENT_TYPES.get(entry.type, entry.type), 'size': entry.size, 'sha256': entry.hash.hex()}
+			if entry.ncaId in stored:
+				name, offset, size = stored[entry.ncaId]
+				content['name'] = name
+				content['storedSize'] = size
+				content['compression'] = compressionOf(f, offset, name)
+				compressions.add(content['compression'])
+			else:
+				content['name'] = None
+			contents.append(content)
+		compressions.discard(None)
+		return {
+			'path': str(filePath),
+			'name': filePath.name,
+			'size': os.path.getsize(str(filePath)),
+			'container': getExtensionName(filePath).lower(),
+			'titleId': cnmt.titleId.upper(),
+			'version': cnmt.version,
+			'titleType': TITLE_TYPES.get(cnmt.titleType, cnmt.titleType),
+			'keyGeneration': nca.masterKey(),
+			'compression': compressions.pop() if len(compressions) == 1 else ('mixed' if compressions else None),
+			'contents': contents,
+		}
+	finally:
+		f.close()
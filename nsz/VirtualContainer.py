@@ -0,0 +1,127 @@
+from bisect import bisect_right
+from threading import Lock
+from pathlib import Path
+from nsz.Fs import Pfs0, Hfs0, factory
+from nsz.NczReader import NczReader
+from nsz.PathTools import *
+
+XCI_HEADER_SIZE = 0x200
+XCI_ROOT_HFS0_OFFSET = 0xF000
+HFS0_HEADER_SIZE = 0x8000
+
+class RawReader:
+	def __init__(self, nspf):
+		self.nspf = nspf
+		self.size = nspf.size
+
+	def seek(self, offset):
+		self.nspf.seek(offset)
+
+	def read(self, length):
+		return self.nspf.read(length)
+
+def fileReaders(container, cache, cacheKey):
+	'''[(name after decompression, reader)] of every file of a PFS0/HFS0'''
+	result = []
+	for nspf in container:
+		if nspf._path.endswith('.ncz'):
+			result.append((Path(nspf._path).stem + '.nca', NczReader(nspf, cache, (cacheKey, nspf._path))))
+		else:
+			result.append((nspf._path, RawReader(nspf)))
+	return result
+
+def padded(data, size):
+	return data + b'\x00' * (size - len(data))
+
+class VirtualContainer:
+	'''The NSP/XCI an NSZ/XCZ decompresses to, readable at any offset without
+	decompressing it first. The layout is the one -D writes without
+	--fix-padding. Every NCZ has to be block compressed.'''
+
+	def __init__(self, filePath, cache = None):
+		self.filePath = Path(filePath).resolve()
+		self.name = Path(targetExtension(self.filePath)).name
+		self.cache = cache
+		self.container = factory(self.filePath)
+		self.container.open(str(self.filePath), 'rb')
+		#[(offset, size, bytes or reader)] sorted by offset without gaps
+		self.segments = []
+		self.lock = Lock()
+		try:
+			if isXciXcz(self.filePath):
+				self.__layoutXci()
+			else:
+				self.__layoutNsp()
+		except BaseException:
+			self.container.close()
+			raise
+		self.offsets = [segment[0] for segment in self.segments]
+		self.size = self.segments[-1][0] + self.segments[-1][1] if len(self.segments) > 0 else 0
+
+	def __add(self, offset, data):
+		size = len(data) if isinstance(data, bytes) else data.size
+		if size > 0:
+			self.segments.append((offset, size, data))
+
+	def __layoutNsp(self):
+		files = fileReaders(self.container, self.cache, str(self.filePath))
+		stream = Pfs0.Pfs0VerifyStream(self.container.getFirstFileOffset(), self.container.getStringTableSize())
+		for name, reader in files:
+			stream.files.append({'name': name, 'size': reader.size, 'offset': stream.addpos})
+			stream.addpos += reader.size
+		header = stream.getHeader()
+		self.__add(0, padded(header, stream.files[0]['offset']) if len(files) > 0 else header)
+		for f, (name, reader) in zip(stream.files, files):
+			self.__add(f['offset'], reader)
+
+	def __layoutXci(self):
+		self.container.seek(0)
+		self.__add(0, padded(self.container.read(XCI_HEADER_SIZE), XCI_ROOT_HFS0_OFFSET))
+		rootFiles = []
+		partitions = []
+		offset = HFS0_HEADER_SIZE
+		for partition in self.container.hfs0:
+			files = fileReaders(partition, self.cache, str(self.filePath))
+			innerFiles = []
+			innerOffset = HFS0_HEADER_SIZE
+			for name, reader in files:
+				innerFiles.append({'name': name, 'size': reader.size, 'offset': innerOffset})
+				innerOffset += reader.size
+			innerHeader = Hfs0.hfs0Header(innerFiles)
+			#An empty partition only consists of its header
+			size = innerOffset if len(files) > 0 else len(innerHeader)
+			rootFiles.append({'name': partition._path, 'size': size, 'offset': offset})
+			partitions.append((offset, innerHeader, innerFiles, files))
+			offset += size
+		self.__add(XCI_ROOT_HFS0_OFFSET, padded(Hfs0.hfs0Header(rootFiles), HFS0_HEADER_SIZE))
+		for offset, innerHeader, innerFiles, files in partitions:
+			base = XCI_ROOT_HFS0_OFFSET + offset
+			self.__add(base, padded(innerHeader, HFS0_HEADER_SIZE) if len(files) > 0 else innerHeader)
+			for f, (name, reader) in zip(innerFiles, files):
+				self.__add(base + f['offset'], reader)
+
+	def read(self, offset, length):
+		end = min(self.size, offset + length)
+		chunks = []
+		with self.lock:
+			i = bisect_right(self.offsets, offset) - 1
+			while offset < end and i < len(self.segments):
+				segmentOffset, size, data = self.segments[i]
+				if offset >= segmentOffset + size:
+					i += 1
+					continue
+				length = min(end, segmentOffset + size) - offset
+				if isinstance(data, bytes):
+					chunk = data[offset - segmentOffset:offset - segmentOffset + length]
+				else:
+					data.seek(offset - segmentOffset)
+					chunk = data.read(length)
+				if len(chunk) != length:
+					raise IOError('Short read at {0} of {1}'.format(hex(offset), self.filePath))
+				chunks.append(chunk)
+				offset += length
+				i += 1
+		return b''.join(chunks)
+
+	def close(self):
+		self.container.close()
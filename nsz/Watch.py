@@ -0,0 +1,271 @@
+from collections import deque
+from pathlib import Path
+from traceback import format_exc
+from nsz.nut import Print
+from nsz.PathTools import *
+import struct
+import select
+import time
+import sys
+import os
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+def inotifyInit(directory):
+	'''Returns a non-blocking inotify file descriptor watching directory'''
+	import ctypes
+	libc = ctypes.CDLL(None, use_errno=True)
+	fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+	if fd < 0:
+		raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+	if libc.inotify_add_watch(fd, os.fsencode(str(directory)), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+		errno = ctypes.get_errno()
+		os.close(fd)
+		raise OSError(errno, 'inotify_add_watch failed for {0}'.format(directory))
+	return fd
+
+class DirectoryWatcher:
+	'''Reports files of a directory which might have been created or changed.
+	Uses inotify on Linux and falls back to listing the directory every
+	pollInterval seconds everywhere else.'''
+
+	def __init__(self, directory, pollInterval = 10.0):
+		self.directory = Path(directory).resolve()
+		self.pollInterval = pollInterval
+		self.fd = None
+		self.lastScan = 0.0
+		if sys.platform.startswith('linux'):
+			try:
+				self.fd = inotifyInit(self.directory)
+			except (OSError, AttributeError) as e:
+				Print.warning('inotify unavailable ({0}), polling {1} every {2}s'.format(e, self.directory, pollInterval))
+
+	def scan(self):
+		self.lastScan = time.monotonic()
+		return [filePath for filePath in expandFiles(self.directory) if filePath.is_file()]
+
+	def wait(self, timeout):
+		'''Blocks for up to timeout seconds and returns the paths which changed'''
+		if self.fd == None:
+			remaining = self.lastScan + self.pollInterval - time.monotonic()
+			if remaining > 0:
+				time.sleep(min(timeout, remaining))
+				if timeout < remaining:
+					return []
+			return self.scan()
+		readable, _, _ = select.select([self.fd], [], [], timeout)
+		if len(readable) == 0:
+			return []
+		paths = set()
+		while True:
+			try:
+				data = os.read(self.fd, 0x10000)
+			except BlockingIOError:
+				break
+			pos = 0
+			while pos < len(data):
+				wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, pos)
+				name = data[pos + INOTIFY_EVENT.size:pos + INOTIFY_EVENT.size + length].rstrip(b'\0')
+				pos += INOTIFY_EVENT.size + length
+				if mask & IN_Q_OVERFLOW:
+					#Events were dropped by the kernel
+					return self.scan()
+				if len(name) > 0:
+					paths.add(self.directory.joinpath(os.fsdecode(name)))
+		return list(paths)
+
+	def close(self):
+		if self.fd != None:
+			os.close(self.fd)
+			self.fd = None
+
+class StabilityTracker:
+	'''An upload is considered complete once its size and modification time
+	didn't change for settleSeconds.'''
+
+	def __init__(self, settleSeconds):
+		self.settleSeconds = settleSeconds
+		#{path: ((size, mtime), monotonic time this state was first seen)}
+		self.pending = {}
+		#{path: (size, mtime)} of files already handed out
+		self.done = {}
+
+	def add(self, filePath):
+		if isUncompressedGame(filePath) and not filePath in self.pending:
+			self.pending[filePath] = (None, 0.0)
+
+	def ready(self):
+		result = []
+		now = time.monotonic()
+		for filePath, (state, since) in list(self.pending.items()):
+			try:
+				stat = filePath.stat()
+			except OSError:
+				del self.pending[filePath]
+				continue
+			newState = (stat.st_size, stat.st_mtime_ns)
+			if self.done.get(filePath) == newState:
+				del self.pending[filePath]
+			elif newState != state:
+				self.pending[filePath] = (newState, now)
+			elif now - since >= self.settleSeconds:
+				del self.pending[filePath]
+				self.done[filePath] = newState
+				result.append(filePath)
+		return sorted(result)
+
+class WatchStatus:
+	def __init__(self):
+		self.started = time.monotonic()
+		self.busySeconds = 0.0
+		self.lastTick = None
+		self.done = 0
+		self.failed = 0
+		self.bytesDone = 0
+
+	def tick(self, busy):
+		now = time.monotonic()
+		#The time since the last busy tick was spent working
+		if self.lastTick != None:
+			self.busySeconds += now - self.lastTick
+		self.lastTick = now if busy else None
+
+	def throughput(self):
+		'''MiB of input compressed per second spent busy'''
+		return self.bytesDone / self.busySeconds / 1048576 if self.busySeconds > 0 else 0.0
+
+def watch(args, directory, argOutFolder = None):
+	'''Compresses every NSP/XCI which is dropped into directory until interrupted.
+	Files are queued once their upload is complete and compressed by a worker
+	pool which stays alive for the whole time.'''
+	from nsz import compress, solidCompressTask, VerificationFailed, useBlockCompression
+	from nsz.FileExistingChecks import CreateTargetDict, AllowedToWriteOutfile, AddToTargetDict, delete_source_file
+	from nsz.WorkerPool import WorkerPool, WorkerException
+	from nsz.Metrics import Metrics, MetricsJsonWriter
+	from multiprocessing import cpu_count, Manager
+
+	directory = Path(directory).resolve()
+	if not directory.is_dir():
+		Print.error('Error: Watch directory "{0}" does not exist!'.format(directory))
+		return
+	parallelTasks = args.multi if args.multi > 0 else 4
+	poolManager = Manager()
+	metrics = Metrics(parallelTasks, poolManager, args.metrics_json != None)
+	metricsWriter = None
+	if args.metrics_json != None:
+		metricsWriter = MetricsJsonWriter(metrics, args.metrics_json)
+		metricsWriter.start()
+	pool = WorkerPool(poolManager, metrics, args.threads if args.threads > 0 else cpu_count())
+	pool.ensureWorkers(parallelTasks)
+	watcher = DirectoryWatcher(directory, args.watch_poll)
+	tracker = StabilityTracker(args.watch_settle)
+	status = WatchStatus()
+	targetDicts = {}
+	queue = deque()
+	#{slot: (filePath, outFolder)} of the running solid compression jobs
+	running = {}
+	freeSlots = list(range(parallelTasks))
+	lastStatus = 0.0
+
+	def report(force = False):
+		nonlocal lastStatus
+		if not force and time.monotonic() - lastStatus < args.watch_poll:
+			return
+		lastStatus = time.monotonic()
+		Print.info('[WATCH]      queue {0}, running {1}, done {2} ({3:.1f} MiB), failed {4}, {5:.2f} MiB/s'.format(len(queue), len(running), status.done, status.bytesDone / 1048576, status.failed, status.throughput()))
+		metrics.event('watch_status', queued=len(queue), running=len(running), done=status.done, failed=status.failed, bytes=status.bytesDone, mib_per_s=round(status.throughput(), 2))
+
+	def finished(filePath, outFolder, problem = None):
+		if problem != None:
+			status.failed += 1
+			Print.error('Error while compressing file: %s' % filePath)
+			metrics.event('error', file=filePath, error=str(problem))
+			report(True)
+			return
+		outFile = Path(targetExtension(outFolder.joinpath(filePath.name)))
+		if outFile.is_file():
+			AddToTargetDict(outFile, targetDicts[(outFolder, outFile.suffix)], args)
+		status.done += 1
+		try:
+			status.bytesDone += filePath.stat().st_size
+		except OSError:
+			pass
+		if args.rm_source:
+			delete_source_file(filePath, outFolder)
+		report(True)
+
+	Print.info('[WATCH]      {0} ({1})'.format(directory, 'inotify' if watcher.fd != None else 'polling'))
+	for filePath in watcher.scan():
+		tracker.add(filePath)
+	try:
+		while True:
+			for filePath in watcher.wait(1.0 if len(tracker.pending) > 0 or len(running) > 0 else args.watch_poll):
+				tracker.add(filePath)
+			for filePath in tracker.ready():
+				Print.info('[QUEUED]     {0}'.format(filePath))
+				metrics.event('watch_queued', file=filePath)
+				queue.append(filePath)
+
+			while len(queue) > 0 and len(freeSlots) > 0:
+				filePath = queue[0]
+				blockMode = useBlockCompression(filePath, args)
+				#Block compression uses all workers and reads every result so it can't overlap with solid jobs
+				if blockMode and len(running) > 0:
+					break
+				queue.popleft()
+				if not filePath.is_file():
+					continue
+				outFolder = argOutFolder if argOutFolder else filePath.parent.absolute()
+				extension = '.xcz' if filePath.suffix == '.xci' else '.nsz'
+				if not (outFolder, extension) in targetDicts:
+					targetDicts[(outFolder, extension)] = CreateTargetDict(outFolder, args, extension, {}, {})
+				try:
+					if not AllowedToWriteOutfile(filePath, extension, targetDicts[(outFolder, extension)], args):
+						continue
+					solidJobs = []
+					status.tick(True)
+					compress(filePath, outFolder, args, pool, solidJobs)
+				except KeyboardInterrupt:
+					raise
+				except BaseException:
+					finished(filePath, outFolder, format_exc())
+					continue
+				if len(solidJobs) == 0:
+					status.tick(True)
+					finished(filePath, outFolder)
+					continue
+				slot = freeSlots.pop(0)
+				metrics.update(slot, 0, 0, 0, 'Compressing')
+				running[slot] = (filePath, outFolder)
+				pool.submit((slot, filePath), solidCompressTask, slot, *solidJobs[0])
+
+			while len(running) > 0:
+				try:
+					result = pool.getResult(False)
+					if result == None:
+						break
+					(slot, filePath), problem = result
+					problem = problem.exception if isinstance(problem, VerificationFailed) else problem
+				except WorkerException as e:
+					(slot, filePath), problem = e.tag, str(e)
+				metrics.reset(slot)
+				freeSlots.append(slot)
+				finished(filePath, running.pop(slot)[1], problem)
+
+			status.tick(len(queue) > 0 or len(running) > 0)
+			if len(queue) > 0 or len(running) > 0:
+				report()
+	except KeyboardInterrupt:
+		Print.info('[WATCH]      Stopping, {0} files were still queued'.format(len(queue)))
+	finally:
+		report(True)
+		watcher.close()
+		pool.close()
+		if metricsWriter != None:
+			metricsWriter.stop()
+		poolManager.shutdown()
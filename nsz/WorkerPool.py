@@ -0,0 +1,138 @@
+from multiprocessing import Process, Manager, Queue
+from traceback import format_exc
+from queue import Empty
+from nsz.nut import Print, Titles
+from nsz import Profile, HeaderCache
+import sys
+
+class WorkerContext:
+	def __init__(self, metrics = None, logQueue = None, logLevel = Print.INFO):
+		self.metrics = metrics
+		self.logQueue = logQueue
+		self.logLevel = logLevel
+		self.profile = Profile.enabled
+		#Title keys of the main process so workers don't read titlekeys.txt again
+		self.titleKeys = None
+		#Keys the main process already derived
+		self.derivedKeys = None
+		self.headerCachePath = HeaderCache.path
+		#{NCA hash-compression parameters: where its NCZ was written} of the whole run
+		self.nczCache = None
+		self.id = None
+
+	def takeSnapshot(self):
+		'''Copies the keys known to the main process right before a worker is
+		started. Keys isn't imported here as that loads the keys file.'''
+		self.titleKeys = Titles.snapshot()
+		Keys = sys.modules.get('nsz.nut.Keys')
+		self.derivedKeys = Keys.snapshot() if Keys != None else None
+
+class WorkerException(Exception):
+	def __init__(self, tag, error):
+		super(WorkerException, self).__init__(error)
+		self.tag = tag
+
+def workerTask(work, results, context, id):
+	context.id = id
+	Print.setQueue(context.logQueue)
+	Print.setLevel(context.logLevel)
+	Titles.restore(context.titleKeys)
+	if context.derivedKeys != None:
+		from nsz.nut import Keys
+		Keys.restore(context.derivedKeys)
+	HeaderCache.setPath(context.headerCachePath)
+	if context.profile:
+		Profile.enable('worker-%d' % id)
+	while True:
+		try:
+			item = work.get()
+		except KeyboardInterrupt:
+			#Ctrl+C reaches the whole process group and the main process shuts the pool down
+			break
+		if item == None:
+			break
+		tag, function, args = item
+		try:
+			result = function(context, *args)
+			results.put((tag, result, None, Profile.take()))
+		except KeyboardInterrupt:
+			results.put((tag, None, 'KeyboardInterrupt', Profile.take()))
+			break
+		except BaseException:
+			results.put((tag, None, format_exc(), Profile.take()))
+
+class WorkerPool:
+	'''Long-lived pool of worker processes shared by every file of a run.
+	Jobs are (tag, function, args) tuples. The function is called as
+	function(context, *args) inside a worker and its return value is handed
+	back together with the tag by getResult(). Processes are only spawned
+	on demand by ensureWorkers() so the pool is cheap to create.'''
+
+	def __init__(self, manager = None, metrics = None, queueSize = 0):
+		self.ownsManager = manager == None
+		self.manager = Manager() if self.ownsManager else manager
+		#Shared memory isn't available on Android
+		logQueue = self.manager.Queue() if hasattr(sys, 'getandroidapilevel') else Queue()
+		self.logWriter = Print.LogWriter(logQueue)
+		self.logWriter.start()
+		self.context = WorkerContext(metrics, logQueue, Print.level)
+		self.context.nczCache = self.manager.dict()
+		self.work = self.manager.Queue(queueSize)
+		self.results = self.manager.Queue()
+		self.processes = []
+		self.pending = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def size(self):
+		return len(self.processes)
+
+	def ensureWorkers(self, amount):
+		while len(self.processes) < amount:
+			self.context.takeSnapshot()
+			p = Process(target=workerTask, args=(self.work, self.results, self.context, len(self.processes)), daemon=True)
+			p.start()
+			self.processes.append(p)
+
+	def submit(self, tag, function, *args):
+		if len(self.processes) == 0:
+			self.ensureWorkers(1)
+		self.pending += 1
+		self.work.put((tag, function, args))
+
+	def getResult(self, block = True):
+		try:
+			tag, result, error, profile = self.results.get(block)
+		except Empty:
+			return None
+		self.pending -= 1
+		Profile.merge(profile)
+		if error != None:
+			raise WorkerException(tag, error)
+		return (tag, result)
+
+	def discardPending(self):
+		while self.pending > 0:
+			try:
+				self.getResult()
+			except WorkerException:
+				pass
+
+	def close(self):
+		for p in self.processes:
+			self.work.put(None)
+		for p in self.processes:
+			p.join(5)
+			if p.is_alive():
+				p.terminate()
+		self.processes = []
+		if self.logWriter != None:
+			self.logWriter.stop()
+			self.logWriter = None
+		if self.ownsManager:
+			self.manager.shutdown()
+			self.ownsManager = False
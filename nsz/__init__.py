@@ -8,64 +8,73 @@ from sys import argv
 from nsz.nut import Print
 from os import listdir, _exit, remove
 from time import sleep
-from nsz.Fs import Nsp, Hfs0, factory
-from nsz.BlockCompressor import blockCompress
-from nsz.SolidCompressor import solidCompress
+from nsz.WorkerPool import WorkerPool, WorkerException
+from nsz.Metrics import Metrics, MetricsJsonWriter
+from nsz import Profile, HeaderCache
 from traceback import print_exc, format_exc
-from nsz.NszDecompressor import verify as NszVerify, decompress as NszDecompress, VerificationException
-from multiprocessing import cpu_count, freeze_support, Process, Manager
-from nsz.FileExistingChecks import CreateTargetDict, AllowedToWriteOutfile, delete_source_file
+from multiprocessing import cpu_count, freeze_support, Manager
 from nsz.ParseArguments import *
 from nsz.PathTools import *
-from nsz.ExtractTitlekeys import *
-from nsz.undupe import undupe
-import enlighten
 import time
 import sys
+import json
 
 class VerificationFailed:
     def __init__(self, exception, in_file):
         self.exception=exception
         self.in_file=in_file
 
-if hasattr(sys, 'getandroidapilevel'):
-    from nsz.ThreadSafeCounterManager import Counter
-else:
-    from nsz.ThreadSafeCounterSharedMemory import Counter
 
+#Subsystems like the container parsers, zstandard and enlighten are only imported
+#by the commands which need them so workers and commands like --info start fast.
 
-def solidCompressTask(in_queue, statusReport, readyForWork, pleaseNoPrint, pleaseKillYourself, id, problemQueue):
-	while True:
-		readyForWork.increment()
-		item = in_queue.get()
-		readyForWork.decrement()
-		if pleaseKillYourself.value() > 0:
-			break
+def solidCompressTask(context, id, filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threadsToUse, verifyArg, quickVerify, storePath, storeThin, frameSizeExponent, patchBase, reuse):
+	from nsz.SolidCompressor import solidCompress
+	from nsz.NszDecompressor import VerificationException
+	from nsz.ContentStore import ContentStore, OutputCache, solidParams
+	from nsz import PatchBase
+	metrics = context.metrics
+	if patchBase != None:
+		#The library is indexed once by the main process
+		PatchBase.restore(patchBase)
+	store = ContentStore(storePath) if storePath != None else None
+	outputCache = OutputCache(context.nczCache, store) if reuse else None
+	params = solidParams(compressionLevel, useLongDistanceMode, threadsToUse, frameSizeExponent, patchBase != None)
+	outFile = solidCompress(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threadsToUse, metrics, id, outputCache if reuse else store, frameSizeExponent)
+	if verifyArg:
+		Print.info("[VERIFY NSZ] {0}".format(outFile))
 		try:
-			filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threadsToUse, verifyArg, quickVerify = item
-			outFile = solidCompress(filePath, compressionLevel, keep, fixPadding, useLongDistanceMode, outputDir, threadsToUse, statusReport, id, pleaseNoPrint)
-			if verifyArg:
-				Print.info("[VERIFY NSZ] {0}".format(outFile))
-				try:
-					verify(outFile, fixPadding, True, keep, None if quickVerify else filePath, [statusReport, id], pleaseNoPrint)
-				except VerificationException as e:
-					Print.error("[BAD VERIFY] {0}".format(outFile))
-					Print.error("[DELETE NSZ] {0}".format(outFile))
-					remove(outFile)
-					problemQueue.put(VerificationFailed(exception=e, in_file=filePath))
-					continue
-		except KeyboardInterrupt:
-			Print.info('Keyboard exception')
-		except BaseException as e:
-			Print.info('nut exception: {0}'.format(str(e)))
-			raise
+			verify(outFile, fixPadding, True, keep, None if quickVerify else filePath, [metrics, id])
+		except VerificationException as e:
+			Print.error("[BAD VERIFY] {0}".format(outFile))
+			Print.error("[DELETE NSZ] {0}".format(outFile))
+			remove(outFile)
+			metrics.event('verify_failed', slot=id, file=filePath, error=str(e))
+			return VerificationFailed(exception=e, in_file=filePath)
+	if outputCache != None:
+		outputCache.register(outFile, params)
+	if store != None:
+		outFile = store.ingest(outFile, params, storeThin)
+	metrics.event('file_done', slot=id, file=filePath, output=outFile, mode='solid')
+	return None
 
-def compress(filePath, outputDir, args, work, amountOfTastkQueued):
+def useBlockCompression(filePath, args):
+	return filePath.suffix == ".xci" and not args.solid or args.block
+
+def compress(filePath, outputDir, args, pool, solidJobs):
+	from nsz.BlockCompressor import blockCompress
+	from nsz.NszDecompressor import VerificationException
+	from nsz.ContentStore import ContentStore, OutputCache, blockParams
+	from nsz import PatchBase
 	compressionLevel = 18 if args.level is None else args.level
 	
-	if filePath.suffix == ".xci" and not args.solid or args.block:
+	if useBlockCompression(filePath, args):
 		threadsToUseForBlockCompression = args.threads if args.threads > 0 else cpu_count()
-		outFile = blockCompress(filePath, compressionLevel, args.keep, args.fix_padding, args.long, args.bs, outputDir, threadsToUseForBlockCompression)
+		store = ContentStore(args.store) if args.store != None else None
+		outputCache = OutputCache(pool.context.nczCache, store) if args.reuse else None
+		params = blockParams(compressionLevel, args.long, args.bs)
+		pool.context.metrics.event('file_started', slot=0, file=filePath, mode='block')
+		outFile = blockCompress(filePath, compressionLevel, args.keep, args.fix_padding, args.long, args.bs, outputDir, threadsToUseForBlockCompression, pool, outputCache if args.reuse else store)
 		if args.verify:
 			Print.info("[VERIFY NSZ] {0}".format(outFile))
 			try:
@@ -75,25 +84,34 @@ def compress(filePath, outputDir, args, work, amountOfTastkQueued):
 				Print.error("[DELETE NSZ] {0}".format(outFile))
 				remove(outFile)
 				raise
+		if outputCache != None:
+			outputCache.register(outFile, params)
+		if store != None:
+			outFile = store.ingest(outFile, params, args.store_thin)
+		pool.context.metrics.event('file_done', slot=0, file=filePath, output=outFile, mode='block')
 	else:
 		threadsToUseForSolidCompression = args.threads if args.threads > 0 else 3
-		work.put([filePath, compressionLevel, args.keep, args.fix_padding, args.long, outputDir, threadsToUseForSolidCompression, args.verify, args.quick_verify])
-		amountOfTastkQueued.increment()
+		solidJobs.append([filePath, compressionLevel, args.keep, args.fix_padding, args.long, outputDir, threadsToUseForSolidCompression, args.verify, args.quick_verify, args.store, args.store_thin, args.seekable, PatchBase.library.index() if args.patch_base else None, args.reuse])
 
 
 def decompress(filePath, outputDir, fixPadding, statusReportInfo = None):
+	from nsz.NszDecompressor import decompress as NszDecompress
 	NszDecompress(filePath, outputDir, fixPadding, statusReportInfo)
 
-def verify(filePath, fixPadding, raiseVerificationException, raisePfs0Exception, originalFilePath = None, statusReportInfo = None, pleaseNoPrint = None):
-	NszVerify(filePath, fixPadding, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo, pleaseNoPrint)
+def verify(filePath, fixPadding, raiseVerificationException, raisePfs0Exception, originalFilePath = None, statusReportInfo = None):
+	from nsz.NszDecompressor import verify as NszVerify
+	NszVerify(filePath, fixPadding, raiseVerificationException, raisePfs0Exception, originalFilePath, statusReportInfo)
 
 err = []
 
-def main():
+def main(arguments = None):
+	'''Runs nsz with the given command line arguments or the ones of the process'''
 	global err
+	err = []
+	interactive = arguments == None and len(argv) <= 1
 	try:
-		if len(argv) > 1:
-			args = ParseArguments.parse()
+		if not interactive:
+			args = ParseArguments.parse(arguments)
 		else:
 			kivyConfigPathObj = Path.home().joinpath('.kivy').joinpath('config.ini')
 			if kivyConfigPathObj.exists():
@@ -121,6 +139,17 @@ def main():
 
 		if args.quick_verify:
 			args.verify = True
+		Print.setLevel(args.log_level)
+		#Only the JSON objects go to stdout so it can be parsed as JSON lines. Set on
+		#every call as the GUI runs main() for one job after the other in a process.
+		Print.setOutput(sys.stderr if args.info and args.json else None)
+		if args.profile:
+			Profile.enable()
+		if args.patch_base:
+			from nsz import PatchBase
+			PatchBase.enable(args.patch_base)
+		if args.header_cache:
+			HeaderCache.setPath(args.header_cache)
 		
 		if args.output:
 			argOutFolderToPharse = args.output
@@ -142,23 +171,15 @@ def main():
 		Print.info('                `"\'')
 		Print.info('')
 		
-		barManager = enlighten.get_manager()
-		poolManager = Manager()
-		statusReport = poolManager.list()
-		readyForWork = Counter(poolManager, 0)
-		pleaseNoPrint = Counter(poolManager, 0)
-		pleaseKillYourself = Counter(poolManager, 0)
-		pool = []
-		work = poolManager.Queue()
-		problems = poolManager.Queue()
-		amountOfTastkQueued = Counter(poolManager, 0)
 		targetDictNsz = dict()
 		targetDictXcz = dict()
 		
 		if args.titlekeys:
+			from nsz.ExtractTitlekeys import extractTitlekeys
 			extractTitlekeys(args.file)
 		
 		if args.extract:
+			from nsz.Fs import factory
 			for f_str in args.file:
 				for filePath in expandFiles(Path(f_str)):
 					filePath_str = str(filePath)
@@ -175,21 +196,37 @@ def main():
 					container.close()
 
 		if args.undupe or args.undupe_dryrun:
+			from nsz.undupe import undupe
 			undupe(args, argOutFolder);
 
 		if args.create:
+			from nsz.Fs import Nsp
 			Print.info('Creating "{0}"'.format(args.create))
 			nsp = Nsp.Nsp(None, None)
 			nsp.path = args.create
 			nsp.pack(args.file)
 
-		if args.C:
+		if args.C or args.watch:
 			if args.verify and not args.quick_verify and not args.keep:
 				Print.info("Warning: --verify requires --keep when used during compression or it will detect removed NDV0 fragments as errors. For compatibility reasons --quick-verify will be automatically used instead to match the command line argument behavior prior to NSZ v4.3.0.")
 				args.quick_verify = True
 			if args.verify and not args.quick_verify and args.fix_padding:
 				Print.info("Warning: --verify and --fix-padding are incompatible with each others. For compatibility reasons --quick-verify will be automatically used instead to match the command line argument behavior prior to NSZ v4.6.0.")
 				args.quick_verify = True
+
+		if args.C:
+			from nsz.FileExistingChecks import CreateTargetDict, AllowedToWriteOutfile, delete_source_file
+			import enlighten
+			barManager = enlighten.get_manager()
+			poolManager = Manager()
+			metrics = Metrics(args.multi if args.multi > 0 else 4, poolManager, args.metrics_json != None)
+			metricsWriter = None
+			if args.metrics_json != None:
+				metricsWriter = MetricsJsonWriter(metrics, args.metrics_json)
+				metricsWriter.start()
+			#One pool for the whole run: block compression of every file and all solid compression jobs share the same worker processes
+			pool = WorkerPool(poolManager, metrics, args.threads if args.threads > 0 else cpu_count())
+			solidJobs = []
 			sourceFileToDelete = []
 			for f_str in args.file:
 				for filePath in expandFiles(Path(f_str)):
@@ -207,7 +244,7 @@ def main():
 								targetDictXcz[outFolder] = CreateTargetDict(outFolder, args, ".xcz")
 							if not AllowedToWriteOutfile(filePath, ".xcz", targetDictXcz[outFolder], args):
 								continue
-						compress(filePath, outFolder, args, work, amountOfTastkQueued)
+						compress(filePath, outFolder, args, pool, solidJobs)
 						if args.rm_source:
 							sourceFileToDelete.append(filePath)
 					except KeyboardInterrupt:
@@ -220,41 +257,50 @@ def main():
 			bars = []
 			compressedSubBars = []
 			BAR_FMT = u'{desc}{desc_pad}{percentage:3.0f}%|{bar}| {count:{len_total}d}/{total:d} {unit} [{elapsed}<{eta}, {rate:.2f}{unit_pad}{unit}/s]'
-			parallelTasks = min(args.multi, amountOfTastkQueued.value())
-			if parallelTasks < 0:
-				parallelTasks = 4
-			for i in range(parallelTasks):
-				statusReport.append([0, 0, 100, 'Compressing'])
-				p = Process(target=solidCompressTask, args=(work, statusReport, readyForWork, pleaseNoPrint, pleaseKillYourself, i, problems))
-				p.start()
-				pool.append(p)
+			parallelTasks = min(args.multi if args.multi > 0 else 4, len(solidJobs))
+			pool.ensureWorkers(parallelTasks)
 			for i in range(parallelTasks):
 				bar = barManager.counter(total=100, desc='Compressing', unit='MiB', color='cyan', bar_format=BAR_FMT)
 				compressedSubBars.append(bar.add_subcounter('green'))
 				bars.append(bar)
-			#Ensures that all threads are started and compleaded before being requested to quit
-			while readyForWork.value() < parallelTasks:
-				sleep(0.2)
-				if pleaseNoPrint.value() > 0:
+			freeSlots = list(range(parallelTasks))
+			solidJobs.reverse()
+			while len(solidJobs) > 0 or len(freeSlots) < parallelTasks:
+				while len(solidJobs) > 0 and len(freeSlots) > 0:
+					slot = freeSlots.pop(0)
+					metrics.update(slot, 0, 0, 0, 'Compressing')
+					job = solidJobs.pop()
+					metrics.event('file_started', slot=slot, file=job[0], mode='solid')
+					pool.submit((slot, job[0]), solidCompressTask, slot, *job)
+				try:
+					result = pool.getResult(False)
+					if result != None:
+						(slot, filePath), problem = result
+						metrics.reset(slot)
+						freeSlots.append(slot)
+						if problem != None:
+							err.append(problem)
+						continue
+				except WorkerException as e:
+					slot, filePath = e.tag
+					metrics.reset(slot)
+					metrics.event('error', slot=slot, file=filePath, error=str(e))
+					freeSlots.append(slot)
+					Print.error('Error while compressing file: %s' % filePath)
+					err.append({"filename":filePath,"error":str(e)})
 					continue
-				if not problems.empty():
-					err.append(problems.get())
-				pleaseNoPrint.increment()
-				for i in range(parallelTasks):
-					compressedRead, compressedWritten, total, currentStep = statusReport[i]
-					if bars[i].total != total:
-						bars[i].total = total//1048576
-					bars[i].count = compressedRead//1048576
-					compressedSubBars[i].count = compressedWritten//1048576
-					bars[i].desc = currentStep
-					bars[i].refresh()
-				pleaseNoPrint.decrement()
-			pleaseKillYourself.increment()
-			for i in range(readyForWork.value()):
-				work.put(None)
-			
-			while readyForWork.value() > 0:
-				sleep(0.02)
+				sleep(0.2)
+				with Print.outputLock:
+					for i in range(parallelTasks):
+						status = metrics.snapshot(i)
+						if status['step'] == 'Idle':
+							continue
+						if bars[i].total != status['total']//1048576:
+							bars[i].total = status['total']//1048576
+						bars[i].count = status['read']//1048576
+						compressedSubBars[i].count = status['written']//1048576
+						bars[i].desc = status['step']
+						bars[i].refresh()
 			
 			for i in range(parallelTasks):
 				bars[i].close(clear=True)
@@ -266,7 +312,28 @@ def main():
 				else:
 					delete_source_file(filePath, filePath.parent.absolute())
 
+			pool.close()
+			if metricsWriter != None:
+				metricsWriter.stop()
+
+		if args.watch:
+			from nsz.Watch import watch
+			watch(args, args.watch, argOutFolder)
+
+		if args.serve:
+			from nsz.Server import serve
+			serve(args.file, args.serve, args.block_cache)
+
+		if args.mount:
+			try:
+				from nsz.Mount import mount
+			except ImportError:
+				Print.error("Failed to import fusepy - is it installed?")
+				return
+			mount(args.file, args.mount, args.block_cache)
+
 		if args.D:
+			from nsz.FileExistingChecks import CreateTargetDict, AllowedToWriteOutfile, delete_source_file
 			for f_str in args.file:
 				for filePath in expandFiles(Path(f_str)):
 					if not isCompressedGame(filePath) and not isCompressedGameFile(filePath):
@@ -299,9 +366,36 @@ def main():
 						err.append({"filename":filePath, "error":format_exc()})
 						print_exc()
 
+		if args.materialize:
+			from nsz.ContentStore import ContentStore, materialize
+			for f_str in args.file:
+				for filePath in Path(f_str).glob('*.manifest') if Path(f_str).is_dir() else [Path(f_str)]:
+					try:
+						materialize(filePath, argOutFolder, ContentStore(args.store) if args.store != None else None)
+					except KeyboardInterrupt:
+						raise
+					except BaseException as e:
+						Print.error('Error while materializing file: {0}'.format(filePath))
+						err.append({"filename":filePath, "error":format_exc()})
+						print_exc()
+
 		if args.info:
+			from nsz.Fs import factory
+			from nsz.TitleInfo import titleInfo
 			for f_str in args.file:
 				for filePath in expandFiles(Path(f_str)):
+					if args.json:
+						if not isGame(filePath):
+							continue
+						try:
+							info = titleInfo(filePath)
+						except KeyboardInterrupt:
+							raise
+						except BaseException as e:
+							info = {'path': str(filePath), 'name': filePath.name, 'error': str(e)}
+							err.append({"filename":filePath, "error":format_exc()})
+						print(json.dumps(info), flush=True)
+						continue
 					filePath_str = str(filePath)
 					Print.info(filePath_str)
 					f = factory(filePath)
@@ -323,6 +417,11 @@ def main():
 						err.append({"filename":filePath,"error":format_exc()})
 						print_exc()
 
+		if args.profile:
+			profileReport = Profile.report()
+			Profile.printSummary(profileReport)
+			Profile.writeReport(profileReport, args.profile)
+
 		if len(argv) == 1:
 			pass
 	except KeyboardInterrupt:
@@ -343,12 +442,12 @@ def main():
 		Print.info('\nDone!\n')
 		print()
 		print()
-		if len(argv) <= 1:
+		if interactive:
 			input("Press Enter to exit...")	
 		sys.exit(1)
 	
 	Print.info('\nDone!\n')
-	if len(argv) <= 1:
+	if interactive:
 		input("Press Enter to exit...")
 	sys.exit(0)
 	#breakpoint()
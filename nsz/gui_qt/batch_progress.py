@@ -0,0 +1,91 @@
+"""
+Per-file progress of the batch jobs started from the file trees. Every file of
+a job gets a row which follows the --metrics-json records of the job: the
+file_started event ties a worker slot to the file, the progress records of
+that slot update the row until file_done, verify_failed or error.
+"""
+
+import os
+
+from PySide6.QtWidgets import QTreeWidget, QTreeWidgetItem
+from PySide6.QtCore import Slot
+
+from nsz.gui_qt.job_engine import format_size
+
+FINISHED = ('Done', 'Failed')
+
+def normalized_path(path):
+    return os.path.normcase(os.path.realpath(path))
+
+class BatchProgressWidget(QTreeWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setColumnCount(5)
+        self.setHeaderLabels(['Job', 'File', 'Status', 'Progress', 'Speed'])
+        self.setRootIsDecorated(False)
+        self.setAlternatingRowColors(True)
+        self.setUniformRowHeights(True)
+        self.rows = {} # job id -> {normalized path: QTreeWidgetItem}
+        self.slots = {} # job id -> {slot: normalized path}
+
+    def add_job(self, job_id, action, paths):
+        rows = {}
+        for path in paths:
+            item = QTreeWidgetItem([f"#{job_id} {action}", os.path.basename(path), 'Queued', '', ''])
+            item.setToolTip(1, path)
+            self.addTopLevelItem(item)
+            rows[normalized_path(path)] = item
+        self.rows[job_id] = rows
+        self.slots[job_id] = {}
+        self.resizeColumnToContents(1)
+
+    def set_status(self, item, status, progress=None, speed=None):
+        if item.text(2) in FINISHED:
+            return
+        item.setText(2, status)
+        if progress is not None:
+            item.setText(3, progress)
+        if speed is not None:
+            item.setText(4, speed)
+
+    @Slot(int, str)
+    def handle_job_started(self, job_id, command):
+        for item in self.rows.get(job_id, {}).values():
+            self.set_status(item, 'Running')
+
+    @Slot(int, object)
+    def handle_job_event(self, job_id, record):
+        rows = self.rows.get(job_id)
+        if rows is None:
+            return
+        slots = self.slots[job_id]
+        kind = record.get('type')
+        if kind == 'progress':
+            item = rows.get(slots.get(record.get('slot')))
+            if item is not None:
+                percent = record['read'] * 100 // record['total'] if record['total'] else 0
+                self.set_status(item, record['step'], f"{percent}% of {format_size(record['total'])}", f"{record['mib_per_s']:.1f} MiB/s")
+            return
+        path = normalized_path(record['file']) if record.get('file') else slots.get(record.get('slot'))
+        item = rows.get(path)
+        if item is None:
+            return
+        if kind == 'file_started':
+            slots[record.get('slot')] = path
+            self.set_status(item, 'Compressing')
+        elif kind == 'file_done':
+            self.set_status(item, 'Done', '100%', '')
+        elif kind in ('verify_failed', 'error'):
+            self.set_status(item, 'Failed', record.get('error', ''), '')
+
+    @Slot(int, int, str)
+    def handle_job_finished(self, job_id, code, output):
+        # Files without metrics (every action but compression) finish with their job
+        for item in self.rows.pop(job_id, {}).values():
+            self.set_status(item, 'Done' if code == 0 else 'Failed', '', '')
+        self.slots.pop(job_id, None)
+
+    def clear_finished(self):
+        for i in reversed(range(self.topLevelItemCount())):
+            if self.topLevelItem(i).text(2) in FINISHED:
+                self.takeTopLevelItem(i)
@@ -0,0 +1,417 @@
+"""
+File tree model of the Qt GUI. Folders are listed by a background scanner
+which streams the files to the model in batches, so the GUI stays responsive
+with tens of thousands of files. The metadata of every file is cached by path,
+size and modification time. A QFileSystemWatcher triggers rescans of the
+folder which are applied to the model as deltas instead of rebuilding it.
+"""
+
+import os
+import re
+import threading
+from bisect import bisect_left
+
+from PySide6.QtCore import (
+    Qt, QAbstractItemModel, QModelIndex, QObject, QRunnable, QThreadPool,
+    QFileSystemWatcher, QTimer, Signal, Slot
+)
+
+from nsz.gui_qt.job_engine import format_size
+
+TITLE_ID_REGEX = re.compile(r"\[(01[0-9A-Fa-f]{14})\]") # Regex to find TitleID like [01...]
+BATCH_SIZE = 500 # Files sent to the model at once during a scan
+RESCAN_DELAY_MS = 300 # Watcher notifications are coalesced for this long
+COLUMNS = ['Name', 'Type', 'Size']
+
+class FileEntry:
+    """Metadata of one file of the folder. Immutable once scanned."""
+    __slots__ = ('name', 'path', 'type', 'size', 'mtime', 'title_id', 'base_id')
+
+    def __init__(self, name, path, size, mtime):
+        self.name = name
+        self.path = path
+        self.type = os.path.splitext(name)[1][1:].upper() or 'File'
+        self.size = size
+        self.mtime = mtime
+        self.title_id = None
+        self.base_id = None
+        match = TITLE_ID_REGEX.search(name)
+        if match:
+            self.title_id = match.group(1)
+            # The base ID (first 13 characters) groups a title with its updates and DLCs
+            self.base_id = self.title_id[:13]
+
+class MetadataCache:
+    """FileEntry per path, reused as long as size and modification time match"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, path, size, mtime):
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is None or entry.size != size or entry.mtime != mtime:
+            entry = FileEntry(name, path, size, mtime)
+            with self.lock:
+                self.entries[path] = entry
+        return entry
+
+    def discard(self, paths):
+        with self.lock:
+            for path in paths:
+                self.entries.pop(path, None)
+
+def scan_folder(folder, cache, cancelled):
+    """Yields the FileEntry of every file in folder"""
+    try:
+        with os.scandir(folder) as it:
+            for dir_entry in it:
+                if cancelled():
+                    return
+                try:
+                    if not dir_entry.is_file():
+                        continue
+                    stat = dir_entry.stat()
+                except OSError:
+                    # Ignore files we can't access (e.g., permission errors)
+                    continue
+                yield cache.get(dir_entry.name, dir_entry.path, stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        return
+
+class ScanRunnable(QRunnable):
+    """Lists a folder on a pool thread. Without known entries the files are
+    sent in batches as they are found, otherwise the differences to known
+    ({path: (size, mtime)}) are sent once the whole folder was listed."""
+
+    def __init__(self, scanner, generation, folder, known=None):
+        super().__init__()
+        self.scanner = scanner
+        self.generation = generation
+        self.folder = folder
+        self.known = known
+
+    def run(self):
+        cancelled = lambda: self.scanner.generation != self.generation
+        entries = scan_folder(self.folder, self.scanner.cache, cancelled)
+        if self.known is None:
+            batch = []
+            for entry in entries:
+                batch.append(entry)
+                if len(batch) >= BATCH_SIZE:
+                    self.scanner.batch_ready.emit(self.generation, batch)
+                    batch = []
+            if batch:
+                self.scanner.batch_ready.emit(self.generation, batch)
+        else:
+            changed = []
+            seen = set()
+            for entry in entries:
+                seen.add(entry.path)
+                if self.known.get(entry.path) != (entry.size, entry.mtime):
+                    changed.append(entry)
+            removed = [path for path in self.known if path not in seen]
+            if not cancelled():
+                self.scanner.cache.discard(removed)
+                self.scanner.delta_ready.emit(self.generation, changed, removed)
+        self.scanner.scan_finished.emit(self.generation)
+
+class FolderScanner(QObject):
+    batch_ready = Signal(int, object) # generation, [FileEntry]
+    delta_ready = Signal(int, object, object) # generation, [added or changed FileEntry], [removed path]
+    scan_finished = Signal(int) # generation
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cache = MetadataCache()
+        self.generation = 0
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def start(self, folder, known=None):
+        """Starts listing folder and returns the generation its results are tagged with.
+        Results of earlier scans are dropped from now on."""
+        self.generation += 1
+        self.pool.start(ScanRunnable(self, self.generation, folder, known))
+        return self.generation
+
+    def cancel(self):
+        self.generation += 1
+
+class Node:
+    __slots__ = ('kind', 'key', 'entry', 'base_id', 'parent', 'children', 'keys', 'check_state')
+
+    def __init__(self, kind, name, entry=None, base_id=None, parent=None):
+        self.kind = kind # 'root', 'group' or 'file'
+        self.key = (name, entry.path if entry else '')
+        self.entry = entry
+        self.base_id = base_id
+        self.parent = parent
+        self.children = []
+        self.keys = [] # Sort keys of the children, to find rows by bisection
+        self.check_state = Qt.Unchecked
+
+    def name(self):
+        return self.key[0]
+
+    def row(self):
+        return bisect_left(self.parent.keys, self.key)
+
+    def insert(self, child):
+        row = bisect_left(self.keys, child.key)
+        self.children.insert(row, child)
+        self.keys.insert(row, child.key)
+        return row
+
+class FileTreeModel(QAbstractItemModel):
+    """Files of one folder grouped by the base TitleID in their name. Files
+    without a TitleID are top-level items. Every item can be checked, checking
+    a group checks all of its files."""
+    scan_started = Signal()
+    scan_finished = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.folder_path = ''
+        self.root = Node('root', '')
+        self.files = {} # path -> file Node
+        self.groups = {} # base_id -> group Node
+        self.generation = None # Scan the model is waiting for
+        self.rescan_pending = False
+        self.scanner = FolderScanner(self)
+        self.scanner.batch_ready.connect(self.add_batch)
+        self.scanner.delta_ready.connect(self.apply_delta)
+        self.scanner.scan_finished.connect(self.handle_scan_finished)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.schedule_rescan)
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.setInterval(RESCAN_DELAY_MS)
+        self.rescan_timer.timeout.connect(self.rescan)
+
+    # --- Folder handling --- #
+    def set_folder(self, folder_path):
+        """Empties the model and lists folder_path in the background"""
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        self.rescan_timer.stop()
+        self.rescan_pending = False
+        self.beginResetModel()
+        self.folder_path = folder_path
+        self.root = Node('root', '')
+        self.files = {}
+        self.groups = {}
+        self.endResetModel()
+        if not folder_path or not os.path.isdir(folder_path):
+            self.scanner.cancel()
+            self.generation = None
+            return
+        self.watcher.addPath(folder_path)
+        self.generation = self.scanner.start(folder_path)
+        self.scan_started.emit()
+
+    @Slot()
+    def rescan(self):
+        """Lists the folder again and applies the differences"""
+        if not self.folder_path or not os.path.isdir(self.folder_path):
+            return
+        if self.generation is not None:
+            # Checked again once the running scan is done
+            self.rescan_pending = True
+            return
+        known = {path: (node.entry.size, node.entry.mtime) for path, node in self.files.items()}
+        self.generation = self.scanner.start(self.folder_path, known)
+        self.scan_started.emit()
+
+    @Slot(str)
+    def schedule_rescan(self, path):
+        self.rescan_timer.start()
+
+    def is_scanning(self):
+        return self.generation is not None
+
+    @Slot(int, object)
+    def add_batch(self, generation, entries):
+        if generation != self.generation:
+            return
+        for entry in entries:
+            self.add_entry(entry)
+
+    @Slot(int, object, object)
+    def apply_delta(self, generation, changed, removed):
+        if generation != self.generation:
+            return
+        for path in removed:
+            self.remove_path(path)
+        for entry in changed:
+            node = self.files.get(entry.path)
+            if node is None:
+                self.add_entry(entry)
+            else:
+                node.entry = entry
+                self.dataChanged.emit(self.createIndex(node.row(), 1, node), self.createIndex(node.row(), len(COLUMNS) - 1, node))
+
+    @Slot(int)
+    def handle_scan_finished(self, generation):
+        if generation != self.generation:
+            return
+        self.generation = None
+        self.scan_finished.emit()
+        if self.rescan_pending:
+            self.rescan_pending = False
+            self.rescan()
+
+    # --- Structure changes --- #
+    def index_of(self, node, column=0):
+        if node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row(), column, node)
+
+    def insert_node(self, parent, node):
+        row = bisect_left(parent.keys, node.key)
+        self.beginInsertRows(self.index_of(parent), row, row)
+        parent.insert(node)
+        self.endInsertRows()
+
+    def remove_node(self, node):
+        parent = node.parent
+        row = node.row()
+        self.beginRemoveRows(self.index_of(parent), row, row)
+        del parent.children[row]
+        del parent.keys[row]
+        self.endRemoveRows()
+
+    def add_entry(self, entry):
+        if entry.path in self.files:
+            return
+        parent = self.root
+        if entry.base_id:
+            parent = self.groups.get(entry.base_id)
+            if parent is None:
+                parent = Node('group', f"[{entry.base_id}]", base_id=entry.base_id, parent=self.root)
+                self.groups[entry.base_id] = parent
+                self.insert_node(self.root, parent)
+        node = Node('file', entry.name, entry=entry, parent=parent)
+        self.files[entry.path] = node
+        self.insert_node(parent, node)
+        if parent.kind == 'group':
+            self.update_group_state(parent)
+
+    def remove_path(self, path):
+        node = self.files.pop(path, None)
+        if node is None:
+            return
+        parent = node.parent
+        self.remove_node(node)
+        if parent.kind == 'group':
+            if parent.children:
+                self.update_group_state(parent)
+            else:
+                del self.groups[parent.base_id]
+                self.remove_node(parent)
+
+    # --- Check states --- #
+    def update_group_state(self, group):
+        states = set(child.check_state for child in group.children)
+        state = states.pop() if len(states) == 1 else Qt.PartiallyChecked
+        if state != group.check_state:
+            group.check_state = state
+            index = self.index_of(group)
+            self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+
+    def group_entries(self, index):
+        """FileEntry of every file of the group at index, or of the file at index"""
+        node = self.node(index.siblingAtColumn(0))
+        if node.kind == 'file':
+            return [node.entry]
+        return [child.entry for child in node.children]
+
+    def checked_entries(self):
+        """FileEntry of every checked file, in display order"""
+        entries = []
+        def collect(node):
+            for child in node.children:
+                if child.kind == 'group':
+                    collect(child)
+                elif child.check_state == Qt.Checked:
+                    entries.append(child.entry)
+        collect(self.root)
+        return entries
+
+    # --- QAbstractItemModel --- #
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.node(parent)
+        if row < 0 or row >= len(node.children) or column < 0 or column >= len(COLUMNS):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index=QModelIndex()):
+        if not index.isValid():
+            return QModelIndex()
+        return self.index_of(index.internalPointer().parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() and parent.column() != 0:
+            return 0
+        return len(self.node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(COLUMNS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        return self.node(parent).kind != 'file' and self.rowCount(parent) > 0
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == 0:
+            flags |= Qt.ItemIsUserCheckable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return node.name()
+            if node.kind == 'file':
+                return node.entry.type if column == 1 else format_size(node.entry.size)
+            return None
+        if role == Qt.CheckStateRole and column == 0:
+            return node.check_state
+        if role == Qt.UserRole:
+            # Same item data as the QTreeWidget version of the tree used
+            if node.kind == 'group':
+                return {'type': 'group', 'path': self.folder_path, 'base_id': node.base_id}
+            return {'type': 'file', 'path': node.entry.path, 'title_id': node.entry.title_id}
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.CheckStateRole or index.column() != 0:
+            return False
+        node = index.internalPointer()
+        state = Qt.CheckState(value)
+        node.check_state = state
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        if node.kind == 'group':
+            # Group changed: update all of its files
+            for child in node.children:
+                child.check_state = state
+            if node.children:
+                self.dataChanged.emit(self.index(0, 0, index), self.index(len(node.children) - 1, 0, index), [Qt.CheckStateRole])
+        elif node.parent.kind == 'group':
+            # File changed: update its group
+            self.update_group_state(node.parent)
+        return True
@@ -0,0 +1,261 @@
+"""
+Job engine of the Qt GUI. Jobs are nsz command lines which run inside
+persistent worker processes: each one imports nsz and derives the keys once
+and then calls nsz.main() for every job it gets. Output is streamed back line
+by line while the job runs. A QThreadPool queues the jobs and limits how many
+run at the same time. Output lines which arrive together are passed on as one
+block to keep the number of signals low for chatty jobs.
+"""
+
+import sys
+import json
+import itertools
+import threading
+import traceback
+import multiprocessing
+from queue import Empty
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+MAX_BURST = 1000 # Messages of a worker handled at once
+FILE_EVENTS = ('file_started', 'progress', 'file_done', 'verify_failed', 'error') # --metrics-json records passed on by job_event
+
+def format_size(size):
+    # Human-readable size
+    for unit in ['B','KB','MB','GB','TB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} PB"
+
+class JobOutput:
+    """stdout/stderr of a worker process while it runs a job. Complete lines are
+    sent to the GUI, JSON records written by --metrics-json - as metrics."""
+
+    def __init__(self, results, job_id):
+        self.results = results
+        self.job_id = job_id
+        self.buffer = ''
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            lines = (self.buffer + text).split('\n')
+            self.buffer = lines.pop()
+        for line in lines:
+            self.send(line)
+        return len(text)
+
+    def send(self, line):
+        if line.startswith('{'):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict) and 'type' in record:
+                self.results.put(('metrics', self.job_id, record))
+                return
+        self.results.put(('log', self.job_id, line.rstrip('\r')))
+
+    def flush(self):
+        pass
+
+    def close_line(self):
+        with self.lock:
+            line, self.buffer = self.buffer, ''
+        if line:
+            self.send(line)
+
+    def isatty(self):
+        return False
+
+def worker_main(jobs, results):
+    """Entry point of a worker process: runs (job_id, arguments) from jobs until it gets None"""
+    from nsz import main as nsz_main
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, arguments = job
+        output = JobOutput(results, job_id)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = output
+        code = 0
+        try:
+            nsz_main(arguments)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            output.close_line()
+            sys.stdout, sys.stderr = stdout, stderr
+        results.put(('done', job_id, code))
+
+class WorkerProcess:
+    def __init__(self, context):
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        # Not a daemon: nsz starts its own worker processes for compression
+        self.process = context.Process(target=worker_main, args=(self.jobs, self.results), daemon=False)
+        self.process.start()
+
+    def run(self, job_id, arguments, on_messages):
+        """Runs the job and returns its exit code or None if the worker died.
+        on_messages gets lists of (kind, value) of everything queued so far."""
+        self.jobs.put((job_id, arguments))
+        while True:
+            try:
+                messages = [self.results.get(timeout=1)]
+            except Empty:
+                if not self.process.is_alive():
+                    return None
+                continue
+            while len(messages) < MAX_BURST and messages[-1][0] != 'done':
+                try:
+                    messages.append(self.results.get_nowait())
+                except Empty:
+                    break
+            on_messages([(kind, value) for kind, message_job_id, value in messages if kind != 'done'])
+            if messages[-1][0] == 'done':
+                return messages[-1][2]
+
+    def stop(self):
+        if self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+class JobRunnable(QRunnable):
+    def __init__(self, engine, job_id, arguments):
+        super().__init__()
+        self.engine = engine
+        self.job_id = job_id
+        self.arguments = arguments
+
+    def run(self):
+        self.engine.run_job(self.job_id, self.arguments)
+
+class JobEngine(QObject):
+    job_queued = Signal(int, str) # job id, command line
+    job_started = Signal(int, str)
+    job_log = Signal(int, str) # job id, output lines separated by '\n'
+    job_progress = Signal(int, str) # job id, progress text ('' once the job has none anymore)
+    job_event = Signal(int, object) # job id, --metrics-json record about a file of the job
+    job_finished = Signal(int, int, str) # job id, exit code (-1 if the worker died), whole output
+
+    def __init__(self, max_concurrent=2, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, max_concurrent))
+        # Never fork the GUI process
+        self.context = multiprocessing.get_context('spawn')
+        self.idle = []
+        self.workers = []
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def max_concurrent(self):
+        return self.pool.maxThreadCount()
+
+    def set_max_concurrent(self, count):
+        count = max(1, count)
+        self.pool.setMaxThreadCount(count)
+        # Jobs already running keep their worker, surplus idle ones are stopped
+        with self.lock:
+            surplus = self.idle[count:]
+            self.idle = self.idle[:count]
+            for worker in surplus:
+                self.workers.remove(worker)
+        for worker in surplus:
+            worker.stop()
+
+    def submit(self, arguments):
+        """Queues an nsz command line (without the program name) and returns its job id"""
+        job_id = next(self.ids)
+        self.job_queued.emit(job_id, ' '.join(arguments))
+        self.pool.start(JobRunnable(self, job_id, list(arguments)))
+        return job_id
+
+    def acquire_worker(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            worker = WorkerProcess(self.context)
+            self.workers.append(worker)
+            return worker
+
+    def release_worker(self, worker, healthy):
+        with self.lock:
+            if healthy and len(self.idle) < self.pool.maxThreadCount():
+                self.idle.append(worker)
+                return
+            if worker in self.workers:
+                self.workers.remove(worker)
+        worker.stop()
+
+    def run_job(self, job_id, arguments):
+        self.job_started.emit(job_id, ' '.join(arguments))
+        output = []
+        progress = {}
+
+        def on_messages(messages):
+            lines = []
+            for kind, value in messages:
+                if kind == 'log':
+                    output.append(value)
+                    lines.append(value)
+                elif kind == 'metrics':
+                    if lines:
+                        self.job_log.emit(job_id, '\n'.join(lines))
+                        lines = []
+                    self.handle_metrics(job_id, progress, value)
+            if lines:
+                self.job_log.emit(job_id, '\n'.join(lines))
+
+        code = None
+        worker = None
+        try:
+            worker = self.acquire_worker()
+            code = worker.run(job_id, arguments, on_messages)
+        except Exception as e:
+            self.job_log.emit(job_id, f"[ERROR] Job failed: {e}")
+        finally:
+            if worker is not None:
+                self.release_worker(worker, code is not None)
+        if code is None:
+            self.job_log.emit(job_id, "[ERROR] nsz worker process died")
+            code = -1
+        self.job_progress.emit(job_id, '')
+        self.job_finished.emit(job_id, code, '\n'.join(output))
+
+    def handle_metrics(self, job_id, progress, record):
+        """Turns the --metrics-json records of a job into progress updates"""
+        if record.get('type') in FILE_EVENTS:
+            self.job_event.emit(job_id, record)
+        if record.get('type') == 'progress':
+            progress[record['slot']] = record
+        elif record.get('type') == 'nca':
+            self.job_log.emit(job_id, f"[METRICS] {record['nca']}: {format_size(record['read'])} -> {format_size(record['written'])}")
+            return
+        elif record.get('type') in ('file_done', 'verify_failed', 'error'):
+            progress.pop(record.get('slot'), None)
+        else:
+            return
+        parts = []
+        for slot in sorted(progress):
+            record = progress[slot]
+            percent = record['read'] * 100 // record['total'] if record['total'] else 0
+            parts.append(f"#{slot} {record['step']} {percent}% {record['mib_per_s']:.1f} MiB/s")
+        self.job_progress.emit(job_id, ' | '.join(parts))
+
+    def shutdown(self):
+        """Drops queued jobs, waits for the running ones and stops all workers"""
+        self.pool.clear()
+        self.pool.waitForDone()
+        with self.lock:
+            workers, self.workers, self.idle = self.workers, [], []
+        for worker in workers:
+            worker.stop()
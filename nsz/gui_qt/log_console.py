@@ -0,0 +1,55 @@
+"""
+Console of the Qt GUI. Lines are collected and written to the widget at most
+every FLUSH_INTERVAL_MS with a single append, and the widget only keeps the
+last max_lines lines, so verbose batch jobs neither flood the event loop nor
+grow the document without bounds.
+"""
+
+from collections import deque
+
+from PySide6.QtWidgets import QPlainTextEdit
+from PySide6.QtCore import QTimer, Slot
+
+FLUSH_INTERVAL_MS = 100
+MAX_LINES = 10000
+
+class LogConsole(QPlainTextEdit):
+    def __init__(self, max_lines=MAX_LINES, parent=None):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setLineWrapMode(QPlainTextEdit.NoWrap) # Wrapping makes every appended block relayout
+        self.setMaximumBlockCount(max_lines) # The oldest lines are dropped by the document itself
+        # Lines waiting for the next flush, bounded as well
+        self.pending = deque(maxlen=max_lines)
+        self.skipped = 0
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(FLUSH_INTERVAL_MS)
+        self.flush_timer.timeout.connect(self.flush)
+
+    @Slot(str)
+    def append_log(self, text):
+        lines = text.split('\n')
+        overflow = len(self.pending) + len(lines) - self.pending.maxlen
+        if overflow > 0:
+            self.skipped += overflow
+        self.pending.extend(lines)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    @Slot()
+    def flush(self):
+        if not self.pending:
+            return
+        lines = list(self.pending)
+        self.pending.clear()
+        if self.skipped:
+            lines.insert(0, f"[... {self.skipped} lines skipped ...]")
+            self.skipped = 0
+        scrollbar = self.verticalScrollBar()
+        # Only follow the output if the user didn't scroll up
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+        self.appendPlainText('\n'.join(lines))
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
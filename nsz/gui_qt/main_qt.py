@@ -1,5 +1,6 @@
 import sys
 import os
+import json
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 print("DEBUG: sys.path set")
 try:
@@ -7,74 +8,31 @@ try:
 except Exception as e:
     print(f"IMPORT ERROR: {e}")
 
-import threading
 import re
 from pathlib import Path # Import Path
 
 from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QTreeWidget, QTreeWidgetItem, QVBoxLayout, QHBoxLayout,
-    QFileDialog, QLabel, QMenu, QPushButton, QSplitter, QAbstractItemView, QDialog, QFormLayout, QLineEdit, QDialogButtonBox, QTextEdit,
+    QApplication, QMainWindow, QWidget, QTreeView, QVBoxLayout, QHBoxLayout,
+    QFileDialog, QLabel, QMenu, QPushButton, QSplitter, QAbstractItemView, QDialog, QFormLayout, QLineEdit, QDialogButtonBox,
     QCheckBox, QSpinBox, QComboBox # Import QCheckBox, QSpinBox, QComboBox
 )
 from PySide6.QtGui import QFont, QCursor, QAction
 from PySide6.QtCore import Qt, Signal, QSettings, Slot, QThread, QObject # Import QThread, QObject
+from nsz.gui_qt.job_engine import JobEngine, format_size
+from nsz.gui_qt.file_model import FileTreeModel
+from nsz.gui_qt.log_console import LogConsole
+from nsz.gui_qt.batch_progress import BatchProgressWidget
 
 # --- Constants --- #
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 NSZ_DIR = os.path.dirname(SCRIPT_DIR)
 # nsz.py is in the root directory, not in the nsz directory
 NSZ_SCRIPT_PATH = os.path.abspath(os.path.join(os.path.dirname(NSZ_DIR), 'nsz.py'))
-TITLE_ID_REGEX = re.compile(r"\[(01[0-9A-Fa-f]{14})\]") # Regex to find TitleID like [01...]
 
 # Add NSZ directory to sys.path to allow importing nsz_main
 if NSZ_DIR not in sys.path:
     sys.path.insert(0, NSZ_DIR)
 
-# --- Action logic with console output hooks ---
-def format_size(size):
-    # Human-readable size
-    for unit in ['B','KB','MB','GB','TB']:
-        if size < 1024:
-            return f"{size:.1f} {unit}"
-        size /= 1024
-    return f"{size:.1f} PB"
-
-# Ensure this function definition is at the top-level (module scope)
-def list_files_with_info(folder):
-    if not folder or not os.path.isdir(folder):
-        return []
-    files = []
-    for f in os.listdir(folder):
-        path = os.path.join(folder, f)
-        if os.path.isfile(path):
-            try:
-                 size = os.path.getsize(path)
-                 ext = os.path.splitext(f)[1][1:].upper() or 'File'
-                 title_id = None
-                 base_id = None
-                 match = TITLE_ID_REGEX.search(f)
-                 if match:
-                     title_id = match.group(1)
-                     # Extract the base ID (first 13 characters) for grouping
-                     base_id = title_id[:13]
-
-                 files.append({
-                     'name': f,
-                     'type': ext,
-                     'size': size,
-                     'path': path,
-                     'title_id': title_id,
-                     'base_id': base_id
-                 })
-            except OSError:
-                 # Ignore files we can't access (e.g., permission errors)
-                 pass
-        # elif os.path.isdir(path):
-             # Optionally include directories if needed in the future
-             # files.append({'name': f, 'type': 'Folder', 'size': 0, 'path': path})
-             # pass
-    return files
-
 class FileTreeConsoleWidget(QWidget):
     def __init__(self, folder_type='Input', main_window=None):
         super().__init__()
@@ -114,7 +72,7 @@ class FileTreeConsoleWidget(QWidget):
     def set_folder(self, folder_path):
         self.tree.set_folder(folder_path)
 
-class FileTreeWidget(QTreeWidget):
+class FileTreeWidget(QTreeView):
     log_signal = Signal(str) # Define the signal for logging
     info_result_signal = Signal(str, str, str) # file_path, stdout, stderr for info parsing
 
@@ -123,165 +81,89 @@ class FileTreeWidget(QTreeWidget):
         self.folder_path = ''
         self.folder_type = folder_type
         self.main_window = main_window
+        self.pending_jobs = {} # Job id -> (file_path, callback_signal) of the jobs started from this tree
+        if self.main_window:
+            self.main_window.job_engine.job_finished.connect(self.handle_job_finished)
+        # Files are listed in the background and kept up to date by a filesystem watcher
+        self.file_model = FileTreeModel(self)
+        self.file_model.scan_finished.connect(self.resize_columns) # Autofit columns once a scan is done
+        self.setModel(self.file_model)
+        self.setUniformRowHeights(True) # Lets the view skip measuring every row of large folders
         self.setSelectionMode(QAbstractItemView.SingleSelection)
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.open_context_menu)
-        self.setColumnCount(3)
-        self.setHeaderLabels(['Name', 'Type', 'Size'])
         self.setRootIsDecorated(True) # Show expand indicators for groups
         self.setAlternatingRowColors(True)
         self.info_result_signal.connect(self.handle_info_result) # Connect info result signal
-        self.itemChanged.connect(self.handle_item_changed) # Connect item changed signal for checkboxes
-        self.itemExpanded.connect(self.resize_columns) # Resize columns when item is expanded
+        self.expanded.connect(self.resize_columns) # Resize columns when item is expanded
         self.setStyleSheet("background-color: #263238; color: #fff;")
 
     def set_folder(self, folder_path):
         self.folder_path = folder_path
-        self.refresh()
+        self.file_model.set_folder(folder_path)
 
     def refresh(self):
-        self.clear()
-        files = list_files_with_info(self.folder_path)
-        groups = {} # Key: base_id, Value: QTreeWidgetItem (group parent)
-
-        for f in files:
-            base_id = f.get('base_id')
-            if base_id:
-                group_item = groups.get(base_id)
-                if not group_item:
-                    # Create new group item
-                    # Display the base ID with the correct format
-                    group_item = QTreeWidgetItem([f"[{base_id}]"])
-                    # Store group info: type, the FOLDER path it belongs to, and the base ID
-                    group_item.setData(0, Qt.UserRole, {'type': 'group', 'path': self.folder_path, 'base_id': base_id})
-                    group_item.setFlags(group_item.flags() | Qt.ItemIsUserCheckable) # Enable checkbox
-                    group_item.setCheckState(0, Qt.Unchecked) # Default to unchecked
-                    # Optionally set an icon for groups
-                    # group_item.setIcon(0, QIcon(...))
-                    self.addTopLevelItem(group_item)
-                    groups[base_id] = group_item
-
-                # Create file item as child
-                file_item = QTreeWidgetItem([
-                    f['name'],
-                    f['type'],
-                    format_size(f['size'])
-                ])
-                # Store file info: type, the FILE path, and full title ID
-                file_item.setData(0, Qt.UserRole, {'type': 'file', 'path': f['path'], 'title_id': f['title_id']})
-                file_item.setFlags(file_item.flags() | Qt.ItemIsUserCheckable) # Enable checkbox
-                file_item.setCheckState(0, Qt.Unchecked) # Default to unchecked
-                group_item.addChild(file_item)
-            else:
-                # File without a parsable TitleID - add as top-level
-                item = QTreeWidgetItem([
-                    f['name'],
-                    f['type'],
-                    format_size(f['size'])
-                ])
-                # Store file info: type and FILE path
-                item.setData(0, Qt.UserRole, {'type': 'file', 'path': f['path']})
-                item.setFlags(item.flags() | Qt.ItemIsUserCheckable) # Enable checkbox
-                item.setCheckState(0, Qt.Unchecked) # Default to unchecked
-                self.addTopLevelItem(item)
-
-        # Optionally sort top-level items (groups and non-grouped files)
-        self.sortItems(0, Qt.AscendingOrder)
-        # Autofit columns after populating
-        self.resize_columns()
+        # Only the differences to the listed files are applied, check states are kept
+        self.file_model.rescan()
 
     def resize_columns(self):
         """Resize all columns to fit their content."""
-        for i in range(self.columnCount()):
+        for i in range(self.file_model.columnCount()):
             self.resizeColumnToContents(i)
 
     def open_context_menu(self, position):
-        item = self.itemAt(position)
-        if not item:
+        index = self.indexAt(position)
+        if not index.isValid():
             return
 
         menu = QMenu()
-        item_data = item.data(0, Qt.UserRole)
+        item_data = index.siblingAtColumn(0).data(Qt.UserRole)
         item_type = item_data.get('type') if isinstance(item_data, dict) else None
         path = item_data.get('path') if isinstance(item_data, dict) else None # Path for file or folder
 
+        checked = [entry.path for entry in self.file_model.checked_entries()]
+        if checked:
+            # --- Actions for all checked files, run as a single job ---
+            self.add_batch_actions(menu, checked, f"{len(checked)} Checked")
+            menu.addSeparator()
+
         if item_type == 'file' and path and os.path.isfile(path):
             # --- Actions for Files (Children or non-grouped top-level) ---
-            menu.addAction('Compress...', lambda: self.show_compress_options(path))
-            menu.addAction('Decompress...', lambda: self.show_decompress_options(path))
+            menu.addAction('Compress...', lambda: self.show_compress_options([path]))
+            menu.addAction('Decompress...', lambda: self.show_decompress_options([path]))
             menu.addAction('Verify', lambda: self.run_nsz_action('verify', path))
             menu.addAction('Info', lambda: self.run_nsz_action('info', path))
             menu.addAction('Titlekeys', lambda: self.run_nsz_action('titlekeys', path))
-            menu.addAction('Extract...', lambda: self.show_extract_options(path))
+            menu.addAction('Extract...', lambda: self.show_extract_options([path]))
             menu.addAction('Parse Info & Rename', lambda: self.run_nsz_action('info_for_rename', path))
         elif item_type == 'group' and path and os.path.isdir(path):
             # --- Actions for Folders (Parents/Groups) ---
             # Path here is the FOLDER path stored in the group item's data
             menu.addAction('Undupe Folder...', lambda: self.show_undupe_options(path))
+            # --- Actions for all files of the group, run as a single job ---
+            menu.addSeparator()
+            self.add_batch_actions(menu, [entry.path for entry in self.file_model.group_entries(index)], "Group")
         else:
             # Fallback or placeholder for unexpected items
             pass
 
         menu.exec(QCursor.pos())
 
-    @Slot(QTreeWidgetItem, int)
-    def handle_item_changed(self, item, column):
-        """Handle changes to item check state for hierarchical selection."""
-        if column != 0: # Only handle changes in the first column (checkbox column)
-            return
-
-        # --- Temporarily block signals to prevent recursion --- #
-        self.blockSignals(True)
-
-        try:
-            item_data = item.data(0, Qt.UserRole)
-            item_type = item_data.get('type') if isinstance(item_data, dict) else None
-            current_state = item.checkState(0)
-
-            if item_type == 'group':
-                # Parent item changed: Update all children
-                child_count = item.childCount()
-                for i in range(child_count):
-                    child = item.child(i)
-                    child.setCheckState(0, current_state)
-            elif item_type == 'file':
-                # Child item changed: Update parent
-                parent = item.parent()
-                if parent:
-                    if current_state == Qt.Unchecked:
-                        # If one child is unchecked, parent becomes partially or fully unchecked
-                        all_unchecked = True
-                        for i in range(parent.childCount()):
-                            if parent.child(i).checkState(0) != Qt.Unchecked:
-                                all_unchecked = False
-                                break
-                        if all_unchecked:
-                            parent.setCheckState(0, Qt.Unchecked)
-                        else:
-                            parent.setCheckState(0, Qt.PartiallyChecked)
-                    elif current_state == Qt.Checked:
-                        # If one child is checked, check if all siblings are now checked
-                        all_checked = True
-                        for i in range(parent.childCount()):
-                            if parent.child(i).checkState(0) == Qt.Unchecked:
-                                all_checked = False
-                                parent.setCheckState(0, Qt.PartiallyChecked)
-                                break
-                        if all_checked:
-                            parent.setCheckState(0, Qt.Checked)
-        finally:
-            # --- Always unblock signals --- #
-            self.blockSignals(False)
+    def add_batch_actions(self, menu, paths, label):
+        menu.addAction(f'Compress {label}...', lambda: self.show_compress_options(paths))
+        menu.addAction(f'Decompress {label}...', lambda: self.show_decompress_options(paths))
+        menu.addAction(f'Verify {label}', lambda: self.run_nsz_batch('verify', paths))
+        menu.addAction(f'Parse Info & Rename {label}', lambda: self.run_nsz_batch('info_for_rename', paths))
 
     # --- Intermediate methods to show dialogs --- #
-    def show_compress_options(self, file_path):
+    def show_compress_options(self, file_paths):
         if not self.main_window or not getattr(self.main_window, 'output_folder_path', None):
              self.log_signal.emit("[ERROR] Output folder not selected.")
              return
-        dialog = CompressOptionsDialog(file_path, self)
+        dialog = CompressOptionsDialog(file_paths, self)
         if dialog.exec():
              extra_options = dialog.get_selected_options()
-             self.run_nsz_action('compress', file_path, extra_args=extra_options)
+             self.run_nsz_batch('compress', file_paths, extra_args=extra_options)
         else:
              self.log_signal.emit("[INFO] Compress action cancelled by user.")
 
@@ -295,189 +177,135 @@ class FileTreeWidget(QTreeWidget):
         else:
              self.log_signal.emit("[INFO] Unduplication cancelled by user.")
 
-    def show_decompress_options(self, file_path):
+    def show_decompress_options(self, file_paths):
         if not self.main_window or not getattr(self.main_window, 'output_folder_path', None):
              self.log_signal.emit("[ERROR] Output folder not selected.")
              return
-        dialog = DecompressOptionsDialog(file_path, self)
+        dialog = DecompressOptionsDialog(file_paths, self)
         if dialog.exec():
              extra_options = dialog.get_selected_options()
-             self.run_nsz_action('decompress', file_path, extra_args=extra_options)
+             self.run_nsz_batch('decompress', file_paths, extra_args=extra_options)
         else:
              self.log_signal.emit("[INFO] Decompress action cancelled by user.")
 
-    def show_extract_options(self, file_path):
+    def show_extract_options(self, file_paths):
         if not self.main_window or not getattr(self.main_window, 'output_folder_path', None):
              self.log_signal.emit("[ERROR] Output folder not selected.")
              return
-        dialog = ExtractOptionsDialog(file_path, self)
+        dialog = ExtractOptionsDialog(file_paths, self)
         if dialog.exec():
              extra_options = dialog.get_selected_options()
-             self.run_nsz_action('extract', file_path, extra_args=extra_options)
+             self.run_nsz_batch('extract', file_paths, extra_args=extra_options)
         else:
              self.log_signal.emit("[INFO] Extract action cancelled by user.")
 
     def run_nsz_action(self, action, file_path, extra_args=None):
+        self.run_nsz_batch(action, [file_path], extra_args)
+
+    def run_nsz_batch(self, action, file_paths, extra_args=None):
+        """Runs action on all file_paths as a single nsz job, so they share its
+        worker pool, its scan of the output folder and -m/--multi parallelism"""
         # Access the main window instance directly via the stored reference
         if not self.main_window:
             self.log_signal.emit("[ERROR] Internal error: MainWindow reference not found.")
             return
+        if not file_paths:
+            self.log_signal.emit("[INFO] No files checked.")
+            return
         output_folder = getattr(self.main_window, 'output_folder_path', None)
 
-        args = ['nsz.py'] # Keep script name as first arg for sys.argv manipulation
+        args = [] # nsz command line without the program name
         callback_signal = None # Default: no specific callback needed
 
         if action == 'compress':
             if not output_folder:
                 self.log_signal.emit("[ERROR] Output folder not selected.")
                 return
-            args += ['-C', '-i', file_path, '-o', output_folder]
+            args += ['-C', '-o', output_folder]
             if extra_args:
                  args.extend(extra_args)
         elif action == 'decompress':
             if not output_folder:
                 self.log_signal.emit("[ERROR] Output folder not selected.")
                 return
-            args += ['-D', '-i', file_path, '-o', output_folder]
+            args += ['-D', '-o', output_folder]
             if extra_args:
                  args.extend(extra_args)
         elif action == 'verify':
-            args += ['--verify', file_path]
+            args += ['--verify']
         elif action == 'info': # Regular info action (just log output)
-            args += ['--info', file_path]
+            args += ['--info']
         elif action == 'titlekeys':
              # Assuming titlekeys takes the file path directly
-             args += ['--titlekeys', file_path]
+             args += ['--titlekeys']
         elif action == 'extract':
             if not output_folder:
                 self.log_signal.emit("[ERROR] Output folder not selected for extraction.")
                 return
-            args += ['--extract', '-i', file_path, '-o', output_folder]
+            args += ['--extract', '-o', output_folder]
             if extra_args:
                  args.extend(extra_args)
         elif action == 'info_for_rename': # Action to trigger info gathering for rename
-            args += ['--info', file_path]
+            args += ['--info', '--json']
             callback_signal = self.info_result_signal # Use the specific signal for info results
         elif action == 'undupe': # Dedupe action (path is the folder)
-             args += ['--undupe', file_path] # Changed from '--dedupe' to '--undupe'
+             args += ['--undupe'] # Changed from '--dedupe' to '--undupe'
              if extra_args:
                   args.extend(extra_args)
         else:
             self.log_signal.emit(f"Unknown action: {action}")
             return
 
-        self.log_signal.emit(f"[NSZ] Running: {' '.join(args)} (subprocess)")
-        thread_args = (args, file_path, callback_signal) # Pass file_path for context in callback
-        threading.Thread(target=self.run_nsz_subprocess, args=thread_args).start()
-
-    def run_nsz_subprocess(self, args, context_file_path=None, callback_signal=None):
-        import subprocess
-        import sys
-        import os
-
-        self.log_signal.emit(f"[DEBUG] run_nsz_subprocess started in thread: {threading.current_thread().name}")
-
-        script_dir = os.path.dirname(__file__)
-        # Correctly use the constant defined at the top
-        nsz_script_path = str(NSZ_SCRIPT_PATH)
-
-        command = [sys.executable, nsz_script_path] + args[1:]
-
-        self.log_signal.emit(f"[DEBUG] Executing subprocess: {' '.join(command)}")
-
-        result = None # Initialize result
-        try:
-            result = subprocess.run(command, capture_output=True, text=True, check=False, encoding='utf-8')
-
-            if result.stdout:
-                self.log_signal.emit("--- NSZ Output ---")
-                for line in result.stdout.splitlines():
-                    self.log_signal.emit(line)
-                self.log_signal.emit("------------------")
-
-            if result.stderr:
-                self.log_signal.emit("--- NSZ Error Output ---")
-                for line in result.stderr.splitlines():
-                    self.log_signal.emit(f"[ERROR] {line}")
-                self.log_signal.emit("------------------------")
-
-            if result.returncode != 0:
-                self.log_signal.emit(f"[ERROR] nsz.py exited with code: {result.returncode}")
-            else:
-                self.log_signal.emit(f"[INFO] nsz.py completed successfully.")
-
-            if callback_signal and result:
-                 callback_signal.emit(context_file_path, result.stdout or "", result.stderr or "")
-
-        except FileNotFoundError:
-            self.log_signal.emit(f"[ERROR] Could not find nsz.py at: {nsz_script_path}")
-        except Exception as e:
-            self.log_signal.emit(f"[ERROR] Subprocess execution failed: {e}")
+        if '-C' in args:
+            args += ['--metrics-json', '-'] # Progress records are streamed back by the job engine
+        args += file_paths
+        job_id = self.main_window.job_engine.submit(args)
+        self.pending_jobs[job_id] = (file_paths[0] if len(file_paths) == 1 else '', callback_signal)
+        if action != 'undupe':
+            self.main_window.batch_progress.add_job(job_id, action, file_paths)
+        self.log_signal.emit(f"[NSZ] Queued job #{job_id}: nsz {' '.join(args)}")
+
+    @Slot(int, int, str)
+    def handle_job_finished(self, job_id, code, output):
+        if job_id not in self.pending_jobs:
+            return # Started from the other tree
+        file_path, callback_signal = self.pending_jobs.pop(job_id)
+        if code != 0:
+            self.log_signal.emit(f"[ERROR] Job #{job_id} exited with code: {code}")
+        else:
+            self.log_signal.emit(f"[INFO] Job #{job_id} completed successfully.")
+        if callback_signal:
+            callback_signal.emit(file_path, output, '' if code == 0 else f"nsz exited with code {code}")
 
     @Slot(str, str, str)
     def handle_info_result(self, file_path, stdout, stderr):
-        if not stdout or stderr:
-            self.log_signal.emit(f"[ERROR] Failed to get info for {os.path.basename(file_path)} for renaming. Error: {stderr}")
+        # --info --json prints one JSON object per file between the regular log lines
+        infos = []
+        for line in stdout.splitlines():
+            if line.startswith('{'):
+                try:
+                    infos.append(json.loads(line))
+                except ValueError:
+                    continue
+        if not infos:
+            self.log_signal.emit(f"[ERROR] Failed to get info for {os.path.basename(file_path) or 'the checked files'} for renaming. Error: {stderr}")
             return
 
+        for info in infos:
+            self.rename_from_info(info)
+        self.refresh() # Refresh list to show new names
+
+    def rename_from_info(self, info):
+        file_path = info.get('path', '')
         self.log_signal.emit(f"[INFO] Parsing info for {os.path.basename(file_path)}...")
-        title_id = None
-        version = None
-        current_section = None
-        current_file = None
-        is_cnmt = False
-        is_cnmt_xml = False
 
         try:
-            # Parse the output to find the CNMT Title ID and version
-            for line in stdout.splitlines():
-                line = line.strip()
-                
-                # Track which section we're in
-                if line.startswith("NCA Archive"):
-                    current_section = "nca"
-                    is_cnmt = False
-                elif line.startswith("File Path:"):
-                    current_section = "file"
-                    current_file = line.split("File Path:")[1].strip()
-                    if current_file.endswith(".cnmt.nca"):
-                        is_cnmt = True
-                    elif current_file.endswith(".cnmt.xml"):
-                        is_cnmt_xml = True
-                elif line.startswith("Ticket"):
-                    current_section = "ticket"
-                
-                # Get Title ID from CNMT NCA
-                if current_section == "nca" and is_cnmt and "titleId = " in line:
-                    title_id = line.split("titleId = ")[1].strip()
-                    # Remove any whitespace or extra characters
-                    title_id = title_id.strip()
-                # Get version from CNMT XML
-                elif current_section == "file" and is_cnmt_xml and "version=" in line:
-                    version_str = line.split("version=")[1].strip()
-                    if version_str.startswith('"'):
-                        version_str = version_str.strip('"')
-                    try:
-                        version = str(int(version_str, 16))
-                    except ValueError:
-                        self.log_signal.emit(f"[WARNING] Could not parse version: {version_str}")
-                        version = None
-
-            if not title_id:
-                # Try to get Title ID from ticket section as fallback
-                for line in stdout.splitlines():
-                    line = line.strip()
-                    if line.startswith("titleId = "):
-                        title_id = line.split("titleId = ")[1].strip()
-                        break
-
-            if not title_id:
-                raise ValueError("TitleID not found in CNMT NCA or ticket output")
-
-            # Format the version if we have one
-            if version:
-                version = version.lstrip('v').replace(' ', '_')
-            
+            if 'error' in info:
+                raise ValueError(info['error'])
+
+            title_id = info['titleId']
+            version = str(info['version'])
+
             # Extract the base name without any existing Title ID and version
             base_name = os.path.basename(file_path)
             # Remove any existing Title ID and version patterns
@@ -507,7 +335,6 @@ class FileTreeWidget(QTreeWidget):
             self.log_signal.emit(f"[INFO] Renaming '{os.path.basename(file_path)}' to '{new_name}'")
             os.rename(file_path, new_path)
             self.log_signal.emit(f"[SUCCESS] Renamed to '{new_name}'")
-            self.refresh() # Refresh list to show new name
 
         except Exception as e:
             self.log_signal.emit(f"[ERROR] Failed to parse info or rename '{os.path.basename(file_path)}': {str(e)}")
@@ -519,6 +346,12 @@ class MainWindow(QMainWindow):
         self.settings = QSettings("YourOrgName", "SwitchFileManager") # Use appropriate names
         self.setWindowTitle("Switch File Manager NSZ GUI")
         self.setGeometry(100, 100, 1200, 800)
+        # Jobs run in persistent nsz worker processes, at most max_jobs at once
+        max_jobs = int(self.settings.value("maxConcurrentJobs", 2))
+        self.job_engine = JobEngine(max_concurrent=max_jobs, parent=self)
+        self.job_engine.job_log.connect(self.append_job_log)
+        self.job_engine.job_progress.connect(self.show_job_progress)
+        self.job_progress = {} # Job id -> progress text
         # Check for key files
         self.check_key_files()
 
@@ -551,12 +384,27 @@ class MainWindow(QMainWindow):
         splitter.setSizes([600, 600]) # Initial size distribution
         main_layout.addWidget(splitter)
 
+        # Per-file progress of the jobs started from the trees
+        batch_header_layout = QHBoxLayout()
+        batch_header_layout.addWidget(QLabel("Batch Progress:"))
+        batch_header_layout.addStretch()
+        clear_finished_button = QPushButton("Clear Finished")
+        batch_header_layout.addWidget(clear_finished_button)
+        main_layout.addLayout(batch_header_layout)
+        self.batch_progress = BatchProgressWidget()
+        self.batch_progress.setMaximumHeight(160)
+        clear_finished_button.clicked.connect(self.batch_progress.clear_finished)
+        self.job_engine.job_started.connect(self.batch_progress.handle_job_started)
+        self.job_engine.job_event.connect(self.batch_progress.handle_job_event)
+        self.job_engine.job_finished.connect(self.batch_progress.handle_job_finished)
+        main_layout.addWidget(self.batch_progress)
+
         # Add shared console output at the bottom
         console_label = QLabel("Console Output:")
         main_layout.addWidget(console_label)
         
-        self.console = QTextEdit()
-        self.console.setReadOnly(True)
+        # Lines are appended in batches and only the last maxLogLines are kept
+        self.console = LogConsole(max_lines=int(self.settings.value("maxLogLines", 10000)))
         self.console.setStyleSheet("background-color: #181c1f; color: #00ff00; font-family: Consolas, monospace;")
         self.console.setMinimumHeight(200)  # Make console taller
         main_layout.addWidget(self.console)
@@ -566,6 +414,14 @@ class MainWindow(QMainWindow):
 
         # Setup Status Bar
         self.key_status_label = QLabel("Key Status: Unknown")
+        self.progress_label = QLabel("")
+        self.statusBar().addWidget(self.progress_label) # Progress of running compression jobs (left side)
+        self.max_jobs_spinbox = QSpinBox()
+        self.max_jobs_spinbox.setRange(1, 16)
+        self.max_jobs_spinbox.setValue(self.job_engine.max_concurrent())
+        self.max_jobs_spinbox.valueChanged.connect(self.set_max_jobs)
+        self.statusBar().addPermanentWidget(QLabel("Parallel jobs:"))
+        self.statusBar().addPermanentWidget(self.max_jobs_spinbox)
         self.statusBar().addPermanentWidget(self.key_status_label) # Add to status bar (usually right side)
         self.update_key_status_label() # Set initial text/color
         # End Status Bar Setup
@@ -628,12 +484,31 @@ class MainWindow(QMainWindow):
             self.output_folder_button.setText(f"Output: ...{os.path.basename(folder)}")
             self.settings.setValue("lastOutputFolder", folder) # Save setting
 
+    @Slot(int)
+    def set_max_jobs(self, count):
+        self.job_engine.set_max_concurrent(count)
+        self.settings.setValue("maxConcurrentJobs", count) # Save setting
+
+    @Slot(int, str)
+    def show_job_progress(self, job_id, text):
+        if text:
+            self.job_progress[job_id] = text
+        else:
+            self.job_progress.pop(job_id, None)
+        self.progress_label.setText(' || '.join(f"Job #{job}: {self.job_progress[job]}" for job in sorted(self.job_progress)))
+
+    @Slot(int, str)
+    def append_job_log(self, job_id, text):
+        self.append_log('\n'.join(f"[#{job_id}] {line}" for line in text.split('\n')))
+
+    def closeEvent(self, event):
+        # Waits for running jobs and stops the worker processes
+        self.job_engine.shutdown()
+        super().closeEvent(event)
+
     @Slot(str)
     def append_log(self, text):
-        self.console.append(text)
-        # Auto-scroll to bottom
-        scrollbar = self.console.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
+        self.console.append_log(text)
 
 class UndupeOptionsDialog(QDialog):
     def __init__(self, folder_path, parent=None):
@@ -1,4 +1,4 @@
-import os, sys, re
+import os, sys, re, hashlib
 from traceback import format_exc
 from nsz.nut import aes128
 from binascii import crc32, hexlify as hx, unhexlify as uhx
@@ -8,9 +8,20 @@ from pathlib import Path
 from multiprocessing.process import current_process
 
 keys = {}
-titleKeks = []
-keyAreaKeys = []
+#Keys which already passed getKey's checksum test
+validatedKeys = {}
+titleKeks = {}
+keyAreaKeys = {}
+#Memoized results of decryptTitleKey and unwrapAesWrappedTitlekey
+decryptedTitleKeys = {}
+unwrappedKeys = {}
+#SHA-256 of the loaded keys file. Derived keys are only restored for the same file.
+keysFileHash = None
+keyAreaKeySources = ['key_area_key_application_source', 'key_area_key_ocean_source', 'key_area_key_system_source']
 loadedKeysFile = "non-existing prod.keys/keys.txt"
+#Synthetic keys used by the benchmark suite instead of the dumped ones. They
+#can't match the checksums below so those checks are skipped for them.
+testKeysFile = os.environ.get('NSZ_TEST_KEYS')
 
 #This are NOT the keys but only a 4 bytes long checksum!
 #See https://en.wikipedia.org/wiki/Cyclic_redundancy_check
@@ -54,19 +65,25 @@ def getMasterKeyIndex(i):
 		return 0
 
 def keyAreaKey(cryptoType, i):
-	return keyAreaKeys[cryptoType][i]
+	if (cryptoType, i) not in keyAreaKeys:
+		keyAreaKeys[(cryptoType, i)] = generateKek(getKey(keyAreaKeySources[i]), getMasterKey(cryptoType), getKey('aes_kek_generation_source'), getKey('aes_key_generation_source'))
+	return keyAreaKeys[(cryptoType, i)]
 
 def get(key):
 	return keys[key]
 	
 def getTitleKek(i):
+	if i not in titleKeks:
+		crypto = aes128.AESECB(getMasterKey(i))
+		titleKeks[i] = crypto.decrypt(getKey('titlekek_source')).hex()
 	return titleKeks[i]
 	
 def decryptTitleKey(key, i):
-	kek = getTitleKek(i)
-	
-	crypto = aes128.AESECB(uhx(kek))
-	return crypto.decrypt(key)
+	if (key, i) not in decryptedTitleKeys:
+		kek = getTitleKek(i)
+		crypto = aes128.AESECB(uhx(kek))
+		decryptedTitleKeys[(key, i)] = crypto.decrypt(key)
+	return decryptedTitleKeys[(key, i)]
 	
 def encryptTitleKey(key, i):
 	kek = getTitleKek(i)
@@ -94,19 +111,21 @@ def generateKek(src, masterKey, kek_seed, key_seed):
 		return src_kek
 
 def unwrapAesWrappedTitlekey(wrappedKey, keyGeneration):
-	aes_kek_generation_source = getKey('aes_kek_generation_source')
-	aes_key_generation_source = getKey('aes_key_generation_source')
-
-	kek = generateKek(getKey('key_area_key_application_source'), getMasterKey(keyGeneration), aes_kek_generation_source, aes_key_generation_source)
-
-	crypto = aes128.AESECB(kek)
-	return crypto.decrypt(wrappedKey)
+	if (wrappedKey, keyGeneration) not in unwrappedKeys:
+		crypto = aes128.AESECB(keyAreaKey(keyGeneration, 0))
+		unwrappedKeys[(wrappedKey, keyGeneration)] = crypto.decrypt(wrappedKey)
+	return unwrappedKeys[(wrappedKey, keyGeneration)]
 
 def getKey(key):
+	if key in validatedKeys:
+		return validatedKeys[key]
 	if key not in keys:
 		Print.error('{0} missing from {1}! This will lead to corrupted output.'.format(key, loadedKeysFile))
 		raise IOError('{0} missing from {1}! This will lead to corrupted output.'.format(key, loadedKeysFile))
 	foundKey = uhx(keys[key])
+	if testKeysFile != None:
+		validatedKeys[key] = foundKey
+		return foundKey
 	foundKeyChecksum = crc32(foundKey)
 	if key in crc32_checksum:
 		if crc32_checksum[key] != foundKeyChecksum:
@@ -114,6 +133,7 @@ def getKey(key):
 			raise IOError('{0} from {1} is invalid (crc32 missmatch)! This will lead to corrupted output.'.format(key, loadedKeysFile))
 	elif current_process().name == 'MainProcess':
 		Print.info('Unconfirmed: crc32({0}) = {1}'.format(key, foundKeyChecksum))
+	validatedKeys[key] = foundKey
 	return foundKey
 
 def getMasterKey(masterKeyIndex):
@@ -124,42 +144,47 @@ def existsMasterKey(masterKeyIndex):
 
 def load(fileName):
 	try:
-		global keyAreaKeys
-		global titleKeks
-		global loadedKeysFile
+		global loadedKeysFile, keysFileHash
 		loadedKeysFile = fileName
 		
-		with open(fileName, encoding="utf8") as f:
-			for line in f.readlines():
-				r = re.match(r'\s*([a-z0-9_]+)\s*=\s*([A-F0-9]+)\s*', line, re.I)
-				if r:
-					keys[r.group(1)] = r.group(2)
-		
-		aes_kek_generation_source = getKey('aes_kek_generation_source')
-		aes_key_generation_source = getKey('aes_key_generation_source')
-		titlekek_source = getKey('titlekek_source')
-		key_area_key_application_source = getKey('key_area_key_application_source')
-		key_area_key_ocean_source = getKey('key_area_key_ocean_source')
-		key_area_key_system_source = getKey('key_area_key_system_source')
+		with open(fileName, 'rb') as f:
+			content = f.read()
+		keysFileHash = hashlib.sha256(content).hexdigest()
+		for line in content.decode('utf8').splitlines():
+			r = re.match(r'\s*([a-z0-9_]+)\s*=\s*([A-F0-9]+)\s*', line, re.I)
+			if r:
+				keys[r.group(1)] = r.group(2)
 		
-		keyAreaKeys = []
-		for i in range(32):
-			keyAreaKeys.append([None, None, None])
-		
-		for i in range(32):
-			if not existsMasterKey(i):
-				continue
-			masterKey = getMasterKey(i)
-			crypto = aes128.AESECB(masterKey)
-			titleKeks.append(crypto.decrypt(titlekek_source).hex())
-			keyAreaKeys[i][0] = generateKek(key_area_key_application_source, masterKey, aes_kek_generation_source, aes_key_generation_source)
-			keyAreaKeys[i][1] = generateKek(key_area_key_ocean_source, masterKey, aes_kek_generation_source, aes_key_generation_source)
-			keyAreaKeys[i][2] = generateKek(key_area_key_system_source, masterKey, aes_kek_generation_source, aes_key_generation_source)
+		validatedKeys.clear()
+		keyAreaKeys.clear()
+		titleKeks.clear()
+		decryptedTitleKeys.clear()
+		unwrappedKeys.clear()
+
+		#Only validate the sources here. Deriving the keys is done lazily by keyAreaKey and getTitleKek
+		#as the pure Python AES is slow and most runs only need one or two master key generations.
+		getKey('aes_kek_generation_source')
+		getKey('aes_key_generation_source')
+		getKey('titlekek_source')
+		for source in keyAreaKeySources:
+			getKey(source)
 	except BaseException as e:
 		Print.error(format_exc())
 		Print.error(str(e))
 
 
+def snapshot():
+	'''Keys derived so far together with the hash of the keys file they were derived from'''
+	return (keysFileHash, dict(titleKeks), dict(keyAreaKeys), dict(unwrappedKeys))
+
+def restore(derived):
+	'''Takes over the keys derived by another process if it loaded the same keys file'''
+	fileHash, derivedTitleKeks, derivedKeyAreaKeys, derivedUnwrappedKeys = derived
+	if fileHash == None or fileHash != keysFileHash:
+		return
+	titleKeks.update(derivedTitleKeks)
+	keyAreaKeys.update(derivedKeyAreaKeys)
+	unwrappedKeys.update(derivedUnwrappedKeys)
 
 keyScriptPath = Path(sys.argv[0])
 #While loop to get rid of things like C:\\Python37\\Scripts\\nsz.exe\\__main__.py
@@ -167,7 +192,11 @@ while not keyScriptPath.is_dir():
 	keyScriptPath = keyScriptPath.parents[0]
 keypath = keyScriptPath.joinpath('keys.txt')
 dumpedKeys = Path.home().joinpath(".switch", "prod.keys")
-if keypath.is_file():
+if testKeysFile != None:
+	if current_process().name == 'MainProcess':
+		Print.warning('NSZ_TEST_KEYS is set: using the keys from {0} without checking their crc32. Only meant for benchmark/suite.py, unset it to use your own keys.'.format(testKeysFile))
+	load(testKeysFile)
+elif keypath.is_file():
 	load(str(keypath))
 elif dumpedKeys.is_file():
 	load(str(dumpedKeys))
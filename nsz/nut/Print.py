@@ -1,5 +1,6 @@
 import sys
-import time
+import threading
+from queue import Empty
 
 global silent
 enableInfo = True
@@ -8,27 +9,100 @@ enableWarning = True
 enableDebug = False
 
 silent = False
-	
-def info(s, pleaseNoPrint = None):
-	if pleaseNoPrint == None:
-		sys.stdout.write(s + "\n")
+
+DEBUG = 10
+VERBOSE = 15
+INFO = 20
+WARNING = 30
+ERROR = 40
+levels = {'debug': DEBUG, 'verbose': VERBOSE, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+level = VERBOSE
+
+#Worker processes never write to stdout themselves. Their lines are put into
+#logQueue and written by the LogWriter thread of the main process so printing
+#never blocks a worker and lines of different processes don't interleave.
+logQueue = None
+#Held while writing to stdout. Take it before redrawing progress bars.
+outputLock = threading.Lock()
+#Stream log lines are written to or None for sys.stdout. Looked up on every
+#write as sys.stdout may be replaced.
+output = None
+
+def setLevel(newLevel):
+	global level
+	level = levels[newLevel] if isinstance(newLevel, str) else newLevel
+
+def setOutput(newOutput):
+	global output
+	output = newOutput
+
+def stream():
+	return output if output != None else sys.stdout
+
+def setQueue(queue):
+	global logQueue
+	logQueue = queue
+
+def write(s):
+	if logQueue != None:
+		logQueue.put(s)
 	else:
-		while pleaseNoPrint.value() > 0:
-			#print("Wait")
-			time.sleep(0.01)
-		pleaseNoPrint.increment()
-		sys.stdout.write(s + "\n")
-		sys.stdout.flush()
-		pleaseNoPrint.decrement()
-	
+		with outputLock:
+			stream().write(s)
+
+def info(s):
+	if enableInfo and level <= INFO:
+		write(s + "\n")
+
+def verbose(s):
+	if enableInfo and level <= VERBOSE:
+		write(s + "\n")
+
 def infoNoNewline(s):
-	sys.stdout.write(s)
+	if enableInfo and level <= INFO:
+		write(s)
 
 def error(s):
-	sys.stdout.write(s + "\n")
+	if enableError and level <= ERROR:
+		write(s + "\n")
 
 def warning(s):
-	sys.stdout.write(s + "\n")
+	if enableWarning and level <= WARNING:
+		write(s + "\n")
 
 def debug(s):
-	sys.stdout.write(s + "\n")
+	if enableDebug or level <= DEBUG:
+		write(s + "\n")
+
+class LogWriter(threading.Thread):
+	def __init__(self, queue):
+		super(LogWriter, self).__init__(daemon=True)
+		self.queue = queue
+
+	def drain(self):
+		with outputLock:
+			while True:
+				try:
+					s = self.queue.get(False)
+				except Empty:
+					break
+				if s == None:
+					return False
+				stream().write(s)
+			stream().flush()
+		return True
+
+	def run(self):
+		while True:
+			s = self.queue.get()
+			if s == None:
+				break
+			with outputLock:
+				stream().write(s)
+			if not self.drain():
+				break
+
+	def stop(self):
+		self.queue.put(None)
+		self.join()
+		self.drain()
@@ -1,35 +1,46 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
-import re
-import time
+import sys
 import json
-from nsz import nut
-import operator
+import struct
+from pathlib import Path
 from nsz.nut import Print
 
-
-global titles
-titles = None
+#Records of snapshot(): title ID, rights ID and title key
+RECORD = struct.Struct('>Q16s16s')
+ZERO_KEY = '0' * 32
 
 class Title:
+	__slots__ = ('id', 'key', 'rightsId', 'name')
+
 	def __init__(self):
 		self.key = None
 		self.id = None
-		
+		self.rightsId = None
+		self.name = None
+
 	def setId(self, id):
 		self.id = id.upper()
 
-global nsuIdMap
-nsuIdMap = {}
+#{64-bit title ID: Title}
+global titles
+titles = {}
 
 global regionTitles
 regionTitles = {}
 
-def data(region = None, language = None):
-	global regionTitles
-	global titles
+#titlekeys.txt is only loaded on the first lookup
+global loaded
+loaded = False
+
+def titleIdKey(id):
+	'''64-bit key of a title ID given as hex string (a rights ID works as well) or int'''
+	if isinstance(id, int):
+		return id
+	return int(id[0:16], 16)
 
+def data(region = None, language = None):
 	if region:
 		if not region in regionTitles:
 			regionTitles[region] = {}
@@ -39,40 +50,106 @@ def data(region = None, language = None):
 
 		return regionTitles[region][language]
 
-	if titles == None:
-		titles = {}
+	ensureLoaded()
 	return titles
 
 def items(region = None, language = None):
-	if region:
-		return regionTitles[region][language].items()
-
-	return titles.items()
+	return data(region, language).items()
 
 def get(key, region = None, language = None):
-	key = key.upper()
-
-	if not key in data(region, language):
+	'''Returns the Title or None. Unlike add() this never creates one.'''
+	return data(region, language).get(titleIdKey(key))
+
+def add(key, region = None, language = None):
+	'''Returns the Title of key, created if it doesn't exist yet'''
+	table = data(region, language)
+	t = table.get(titleIdKey(key))
+	if t == None:
 		t = Title()
-		t.setId(key)
-		data(region, language)[key] = t
-	return data(region, language)[key]
-	
-def contains(key, region = None):
-	return key in titles
+		t.setId(format(titleIdKey(key), '016X'))
+		table[titleIdKey(key)] = t
+	return t
 
-def erase(id):
-	id = id.upper()
-	del titles[id]
-	
-def set(key, value):
-	titles[key] = value
-	
-	
-def keys(region = None, language = None):
-	if region:
-		return regionTitles[region][language].keys()
+def contains(key, region = None, language = None):
+	return titleIdKey(key) in data(region, language)
 
-	return titles.keys() if titles != None else {}
+def erase(id):
+	del data()[titleIdKey(id)]
 
+def set(key, value):
+	data()[titleIdKey(key)] = value
 
+def keys(region = None, language = None):
+	return [format(id, '016X') for id in data(region, language).keys()]
+
+def titleKey(key):
+	'''Encrypted title key of the title or rights ID key as hex string or None'''
+	t = get(key)
+	return t.key if t != None and t.key else None
+
+def setKey(key, titleKey, rightsId = None, name = None):
+	t = add(key)
+	t.key = titleKey
+	if rightsId != None:
+		t.rightsId = rightsId
+	if name != None:
+		t.name = name
+
+def loadTitleKeys(path):
+	'''Adds the keys of a titlekeys.txt (rightsId|titleKey|name per line)'''
+	count = 0
+	with open(str(path), encoding="utf-8") as f:
+		for line in f:
+			fields = line.rstrip().split('|')
+			if len(fields) < 2 or len(fields[0]) != 32 or len(fields[1]) != 32 or fields[1] == ZERO_KEY:
+				continue
+			rightsId, key = fields[0].upper(), fields[1].upper()
+			t = titles.get(titleIdKey(rightsId))
+			#Keys found in tickets take precedence
+			if t == None or not t.key:
+				setKey(rightsId, key, rightsId, fields[2] if len(fields) > 2 else None)
+				count += 1
+	return count
+
+def defaultTitleKeyFiles():
+	scriptPath = Path(sys.argv[0])
+	while not scriptPath.is_dir():
+		scriptPath = scriptPath.parents[0]
+	return [Path('titlekeys.txt'), scriptPath.joinpath('titlekeys.txt'), Path.home().joinpath('.switch', 'titlekeys.txt')]
+
+def ensureLoaded():
+	'''Loads the first titlekeys.txt found next to the script, in the working
+	directory or in ~/.switch once per process'''
+	global loaded
+	if loaded:
+		return
+	loaded = True
+	for path in defaultTitleKeyFiles():
+		if path.is_file():
+			try:
+				Print.debug('{0} title keys loaded from {1}'.format(loadTitleKeys(path), path))
+			except BaseException as e:
+				Print.warning('Could not load {0}: {1}'.format(path, e))
+			return
+
+def snapshot():
+	'''Every known title key packed into one bytes object to hand to worker processes'''
+	ensureLoaded()
+	records = []
+	for id, t in titles.items():
+		if t.key:
+			rightsId = bytes.fromhex(t.rightsId) if t.rightsId else b'\0' * 16
+			records.append(RECORD.pack(id, rightsId, bytes.fromhex(t.key)))
+	return b''.join(records)
+
+def restore(packed):
+	'''Loads a snapshot() instead of reading titlekeys.txt again'''
+	global loaded
+	loaded = True
+	for id, rightsId, key in RECORD.iter_unpack(packed):
+		if not id in titles:
+			t = Title()
+			t.id = format(id, '016X')
+			t.key = key.hex().upper()
+			t.rightsId = rightsId.hex().upper() if any(rightsId) else None
+			titles[id] = t
@@ -0,0 +1,90 @@
+import unittest
+import random
+from io import BytesIO
+from nsz.Fs.File import File, MemoryFile
+from nsz.Fs import Bktr
+
+BUCKET_SIZE = 0x4000
+
+def bktrHeader(entryCount):
+    # The table is placed at offset 0 of the section
+    return (0).to_bytes(8, 'little') + (0x100000).to_bytes(8, 'little') + b'BKTR' + (1).to_bytes(4, 'little') + entryCount.to_bytes(4, 'little') + b'\0' * 4
+
+def bktrTable(buckets, totalSize):
+    '''buckets is a list of (virtual start, end offset, [entry bytes])'''
+    table = (0).to_bytes(4, 'little') + len(buckets).to_bytes(4, 'little') + totalSize.to_bytes(8, 'little')
+    table += b''.join(start.to_bytes(8, 'little') for start, end, entries in buckets).ljust(0x3FF0, b'\0')
+    for start, end, entries in buckets:
+        bucket = (0).to_bytes(4, 'little') + len(entries).to_bytes(4, 'little') + end.to_bytes(8, 'little') + b''.join(entries)
+        table += bucket.ljust(BUCKET_SIZE, b'\0')
+    return table
+
+def relocationEntry(virtualOffset, physicalOffset, isPatch):
+    return virtualOffset.to_bytes(8, 'little') + physicalOffset.to_bytes(8, 'little') + int(isPatch).to_bytes(4, 'little')
+
+def subsectionEntry(virtualOffset, ctr):
+    return virtualOffset.to_bytes(8, 'little') + b'\0' * 4 + ctr.to_bytes(4, 'little')
+
+# (virtual offset, physical offset, isPatch) per bucket, each bucket ends where the next starts
+RELOCATIONS = [
+    [(0x0, 0x1000, False), (0x800, 0x0, True), (0xC00, 0x2000, False)],
+    [(0x2000, 0x400, True), (0x2800, 0x8000, False), (0x3000, 0x3000, True)],
+]
+RELOCATION_ENDS = [0x2000, 0x4000]
+
+class TestBktr(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(1)
+        self.base = r.randbytes(0x10000)
+        self.patch = r.randbytes(0x10000)
+        buckets = []
+        for entries, end in zip(RELOCATIONS, RELOCATION_ENDS):
+            buckets.append((entries[0][0], end, [relocationEntry(*entry) for entry in entries]))
+        self.relocation = Bktr.Bktr1(MemoryFile(bktrHeader(6)), 'rb', nca = File(MemoryFile(bktrTable(buckets, 0x4000)), 'rb'))
+
+        # The patched section assembled entry by entry
+        self.expected = b''
+        for entries, end in zip(RELOCATIONS, RELOCATION_ENDS):
+            for i, (virtualOffset, physicalOffset, isPatch) in enumerate(entries):
+                entryEnd = entries[i + 1][0] if i + 1 < len(entries) else end
+                source = self.patch if isPatch else self.base
+                self.expected += source[physicalOffset:physicalOffset + entryEnd - virtualOffset]
+
+    def test_relocation_entry(self):
+        self.assertEqual(self.relocation.getRelocationEntry(0x0).physicalOffset, 0x1000)
+        self.assertEqual(self.relocation.getRelocationEntry(0x7FF).physicalOffset, 0x1000)
+        self.assertEqual(self.relocation.getRelocationEntry(0x800).virtualOffset, 0x800)
+        self.assertEqual(self.relocation.getRelocationEntry(0x1FFF).virtualOffset, 0xC00)
+        self.assertEqual(self.relocation.getRelocationEntry(0x2000).virtualOffset, 0x2000)
+        self.assertEqual(self.relocation.getRelocationEntry(0x2FFF).physicalOffset, 0x8000)
+        self.assertEqual(self.relocation.getRelocationEntry(0x3FFF).virtualOffset, 0x3000)
+
+    def test_relocations_across_entries_and_buckets(self):
+        self.assertEqual(self.relocation.getRelocations(0x700, 0x200), [(0x1700, 0x100, False), (0x0, 0x100, True)])
+        self.assertEqual(self.relocation.getRelocations(0x1F00, 0x200), [(0x3300, 0x100, False), (0x400, 0x100, True)])
+        with self.assertRaises(IOError):
+            self.relocation.getRelocations(0x3F00, 0x200)
+
+    def test_read(self):
+        patch = BytesIO(self.patch)
+        base = BytesIO(self.base)
+        self.assertEqual(self.relocation.readVirtual(0, len(self.expected), patch, base), self.expected)
+        r = random.Random(2)
+        for _ in range(200):
+            offset = r.randrange(len(self.expected))
+            size = r.randint(1, len(self.expected) - offset)
+            self.assertEqual(self.relocation.readVirtual(offset, size, patch, base), self.expected[offset:offset + size])
+
+    def test_subsection_entries(self):
+        buckets = [
+            (0x0, 0x3000, [subsectionEntry(0x0, 1), subsectionEntry(0x1000, 2)]),
+            (0x3000, 0x5000, [subsectionEntry(0x3000, 3), subsectionEntry(0x4000, 4)]),
+        ]
+        subsection = Bktr.Bktr2(MemoryFile(bktrHeader(4)), 'rb', nca = File(MemoryFile(bktrTable(buckets, 0x5000)), 'rb'))
+        self.assertEqual([entry.ctr for entry in subsection.getEntries(0x1800, 1)], [2])
+        self.assertEqual([entry.ctr for entry in subsection.getEntries(0x2FFF, 0x1002)], [2, 3, 4])
+        self.assertEqual([entry.ctr for entry in subsection.getEntries(0x4800, 0x100)], [4])
+        self.assertEqual([entry.size for entry in subsection.getAllEntries()], [0x1000, 0x2000, 0x1000, 0x1000])
+
+if __name__ == '__main__':
+    unittest.main()